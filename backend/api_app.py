@@ -1,25 +1,59 @@
 # /home/www/froogle/backend/api_app.py
 # Version: Medium V3.0 - Full API conversion from monolithic app.py
 
+import base64
+import contextlib
+import contextvars
 import datetime
+import gzip
+import hashlib
 import os
 import uuid
 import json
 import shutil
+import socket
 import zipfile
 from functools import wraps
 from io import BytesIO
 import logging
+import math
+import re
 import secrets
 import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote as url_quote
 
-from flask import Flask, request, session, url_for, send_file, current_app, abort, jsonify
+import click
+
+from flask import Flask, request, session, url_for, send_file, current_app, abort, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import ClientDisconnected, HTTPException, TooManyRequests
 import redis
 from celery import Celery
+from celery.signals import before_task_publish, task_failure, task_postrun, task_prerun, task_retry, worker_process_init, worker_process_shutdown
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError, features as pil_features
+except ImportError:  # Pillow is only needed by workers that generate derivatives.
+    Image = ImageOps = UnidentifiedImageError = pil_features = None
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+try:
+    import orjson
+except ImportError:  # Optional: large listings fall back to the stdlib encoder.
+    orjson = None
+try:
+    import brotli
+except ImportError:  # Optional: large listings are then only gzip-compressed.
+    brotli = None
 from dotenv import load_dotenv
 
 # --- NEW IMPORTS FOR JWT (FINAL CORRECTION) ---
@@ -27,6 +61,7 @@ from flask_jwt_extended import JWTManager, create_access_token, jwt_required, ge
 # FINAL CORRECTED IMPORT: Removed 'MissingRequiredClaimError'
 from flask_jwt_extended.exceptions import NoAuthorizationError, InvalidHeaderError
 
+STARTUP_T0 = time.perf_counter()  # Module body timing; third-party imports above are reported by `python -X importtime`.
 load_dotenv() # Load environment variables from .env file
 
 app = Flask(__name__)
@@ -70,6 +105,20 @@ _backend_base_dir = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_FOLDER_RELATIVE = os.environ.get('UPLOAD_FOLDER', 'static/uploads')
 app.config['UPLOAD_FOLDER'] = os.path.join(_backend_base_dir, UPLOAD_FOLDER_RELATIVE)
 app.logger.info(f"Configured UPLOAD_FOLDER (absolute path): {app.config['UPLOAD_FOLDER']}")
+# Node-local working space (ZIP extraction, object-store downloads); defaults to UPLOAD_FOLDER so moves into local storage stay renames.
+app.config['SCRATCH_FOLDER'] = os.environ.get('SCRATCH_FOLDER', app.config['UPLOAD_FOLDER'])
+
+# --- Storage Backend Configuration ---
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'local').lower()
+app.config['STORAGE_S3_BUCKET'] = os.environ.get('STORAGE_S3_BUCKET', '')
+app.config['STORAGE_S3_PREFIX'] = os.environ.get('STORAGE_S3_PREFIX', '')
+app.config['STORAGE_S3_ENDPOINT_URL'] = os.environ.get('STORAGE_S3_ENDPOINT_URL', '')  # e.g. http://localhost:9000 for MinIO
+app.config['STORAGE_S3_REGION'] = os.environ.get('STORAGE_S3_REGION', '')
+app.config['STORAGE_S3_ACCESS_KEY_ID'] = os.environ.get('STORAGE_S3_ACCESS_KEY_ID', '')
+app.config['STORAGE_S3_SECRET_ACCESS_KEY'] = os.environ.get('STORAGE_S3_SECRET_ACCESS_KEY', '')
+app.config['STORAGE_S3_ADDRESSING_STYLE'] = os.environ.get('STORAGE_S3_ADDRESSING_STYLE', 'path' if os.environ.get('STORAGE_S3_ENDPOINT_URL') else 'auto')
+app.config['STORAGE_S3_MULTIPART_THRESHOLD'] = int(os.environ.get('STORAGE_S3_MULTIPART_THRESHOLD', 64 * 1024 * 1024))
+app.config['STORAGE_S3_MULTIPART_CHUNKSIZE'] = int(os.environ.get('STORAGE_S3_MULTIPART_CHUNKSIZE', 16 * 1024 * 1024))
 
 app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 9000 * 1024 * 1024))
 app.config['FFMPEG_PATH'] = os.environ.get('FFMPEG_PATH', 'ffmpeg')
@@ -94,7 +143,107 @@ app.config['VIDEO_FORMATS_TO_CONVERT_TO_MP4'] = set(
 if '' in app.config['VIDEO_FORMATS_TO_CONVERT_TO_MP4'] and len(app.config['VIDEO_FORMATS_TO_CONVERT_TO_MP4']) == 1:
     app.config['VIDEO_FORMATS_TO_CONVERT_TO_MP4'] = set()
 
+# --- Derivative (Thumbnail/Preview) Configuration ---
+# Size name -> longest edge in pixels. Names double as the <size> segment of the thumb endpoints.
+app.config['DERIVATIVE_SIZES'] = {
+    'thumb': int(os.environ.get('DERIVATIVE_THUMB_PX', 320)),
+    'preview': int(os.environ.get('DERIVATIVE_PREVIEW_PX', 1280)),
+}
+app.config['DERIVATIVE_FORMATS'] = [f for f in os.environ.get('DERIVATIVE_FORMATS', 'webp,avif').lower().split(',') if f]
+app.config['DERIVATIVE_QUALITY'] = {'webp': int(os.environ.get('DERIVATIVE_WEBP_QUALITY', 80)), 'avif': int(os.environ.get('DERIVATIVE_AVIF_QUALITY', 55))}
+app.config['DERIVATIVE_CACHE_MAX_AGE'] = int(os.environ.get('DERIVATIVE_CACHE_MAX_AGE', 7 * 24 * 3600))
+app.config['PDFTOPPM_PATH'] = os.environ.get('PDFTOPPM_PATH', 'pdftoppm')
+# Images browsers cannot (or should not) be sent as-is get a web-delivery rendition; downloads keep serving the original.
+app.config['IMAGE_FORMATS_TO_NORMALIZE'] = set(f for f in os.environ.get('IMAGE_FORMATS_TO_NORMALIZE', 'heic,heif,bmp,tif,tiff').lower().split(',') if f)
+app.config['IMAGE_NORMALIZE_FORMAT'] = os.environ.get('IMAGE_NORMALIZE_FORMAT', 'jpeg').lower()  # 'jpeg' or 'webp'
+app.config['IMAGE_NORMALIZE_QUALITY'] = int(os.environ.get('IMAGE_NORMALIZE_QUALITY', 88))
+app.config['IMAGE_NORMALIZE_MAX_PX'] = int(os.environ.get('IMAGE_NORMALIZE_MAX_PX', 4096))
+# On-demand renders (/media/<id>/render): node-local LRU cache, bounded by total bytes.
+app.config['RENDER_CACHE_DIR'] = os.environ.get('RENDER_CACHE_DIR', os.path.join(app.config['SCRATCH_FOLDER'], 'render_cache'))
+app.config['RENDER_CACHE_MAX_BYTES'] = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+app.config['RENDER_MIN_WIDTH'] = int(os.environ.get('RENDER_MIN_WIDTH', 16))
+app.config['RENDER_MAX_WIDTH'] = int(os.environ.get('RENDER_MAX_WIDTH', 4096))
+app.config['RENDER_WIDTH_STEP'] = int(os.environ.get('RENDER_WIDTH_STEP', 32))  # Requested widths round up to a multiple of this.
+app.config['RENDER_LOCK_TTL'] = int(os.environ.get('RENDER_LOCK_TTL', 60))
+app.config['RENDER_LOCK_WAIT'] = float(os.environ.get('RENDER_LOCK_WAIT', 30))
+# Video previews: a poster frame plus a sprite sheet of evenly spaced tiles indexed by WebVTT for scrubbing.
+app.config['FFPROBE_PATH'] = os.environ.get('FFPROBE_PATH', 'ffprobe')
+app.config['VIDEO_POSTER_WIDTH'] = int(os.environ.get('VIDEO_POSTER_WIDTH', 1280))
+app.config['VIDEO_SPRITE_TILE_WIDTH'] = int(os.environ.get('VIDEO_SPRITE_TILE_WIDTH', 160))
+app.config['VIDEO_SPRITE_COLUMNS'] = int(os.environ.get('VIDEO_SPRITE_COLUMNS', 10))
+app.config['VIDEO_SPRITE_INTERVAL'] = float(os.environ.get('VIDEO_SPRITE_INTERVAL', 2.0))
+app.config['VIDEO_SPRITE_MAX_TILES'] = int(os.environ.get('VIDEO_SPRITE_MAX_TILES', 100))
+app.config['VIDEO_PREVIEW_TIMEOUT'] = int(os.environ.get('VIDEO_PREVIEW_TIMEOUT', 1800))
+# Optional HLS packaging for shared videos. Ladder rungs are 'height:video_bitrate:audio_bitrate'; rungs taller than the source are skipped.
+app.config['HLS_ENABLED'] = os.environ.get('HLS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+app.config['HLS_LADDER'] = [tuple(rung.split(':')) for rung in os.environ.get('HLS_LADDER', '1080:5000k:192k,720:2800k:128k,480:1400k:128k,360:800k:96k').split(',') if rung]
+app.config['HLS_SEGMENT_SECONDS'] = int(os.environ.get('HLS_SEGMENT_SECONDS', 6))
+app.config['HLS_VIDEO_PRESET'] = os.environ.get('HLS_VIDEO_PRESET', 'veryfast')
+app.config['HLS_TIMEOUT'] = int(os.environ.get('HLS_TIMEOUT', 4 * 3600))
+app.config['HLS_PLAYLIST_MAX_AGE'] = int(os.environ.get('HLS_PLAYLIST_MAX_AGE', 60))
+app.config['HLS_SEGMENT_MAX_AGE'] = int(os.environ.get('HLS_SEGMENT_MAX_AGE', 24 * 3600))
+
 app.config['APP_REDIS_DB_NUM'] = int(os.environ.get('APP_REDIS_DB_NUM', 0))
+app.config['REDIS_WORKER_POOL_MAX_CONNECTIONS'] = int(os.environ.get('REDIS_WORKER_POOL_MAX_CONNECTIONS', 32))  # Per worker process.
+app.config['REDIS_HEALTH_CHECK_INTERVAL'] = int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30))  # Seconds idle before a pooled connection is PINGed on checkout.
+app.config['BOOTSTRAP_RETRY_SECONDS'] = int(os.environ.get('BOOTSTRAP_RETRY_SECONDS', 30))  # Min. wait before retrying a failed first-request bootstrap.
+app.config['STARTUP_BUDGET_MS'] = int(os.environ.get('STARTUP_BUDGET_MS', 200))  # Warn when the module body takes longer than this to import.
+
+# --- Resumable Upload Configuration ---
+app.config['RESUMABLE_UPLOAD_MAX_BYTES'] = int(os.environ.get('RESUMABLE_UPLOAD_MAX_BYTES', 64 * 1024 * 1024 * 1024))
+app.config['RESUMABLE_UPLOAD_CHUNK_SIZE'] = int(os.environ.get('RESUMABLE_UPLOAD_CHUNK_SIZE', 16 * 1024 * 1024))
+app.config['RESUMABLE_UPLOAD_SESSION_TTL'] = int(os.environ.get('RESUMABLE_UPLOAD_SESSION_TTL', 24 * 3600))
+app.config['RESUMABLE_UPLOAD_LOCK_TTL'] = int(os.environ.get('RESUMABLE_UPLOAD_LOCK_TTL', 600))
+# Upper bound on concurrent storage writes for one multi-file upload request.
+app.config['UPLOAD_IO_WORKERS'] = int(os.environ.get('UPLOAD_IO_WORKERS', 8))
+app.config['BULK_MEDIA_MAX_IDS'] = int(os.environ.get('BULK_MEDIA_MAX_IDS', 500))  # Per bulk status/mutation request.
+# Batch details and public listings are compressed when larger than this and the client accepts br or gzip.
+# Mid levels: JSON listings still shrink ~10x, at a fraction of the CPU of gzip 9 / brotli 11.
+app.config['LISTING_COMPRESS_MIN_BYTES'] = int(os.environ.get('LISTING_COMPRESS_MIN_BYTES', 16 * 1024))
+app.config['LISTING_GZIP_LEVEL'] = int(os.environ.get('LISTING_GZIP_LEVEL', 5))
+app.config['LISTING_BROTLI_QUALITY'] = int(os.environ.get('LISTING_BROTLI_QUALITY', 4))
+app.config['USER_QUOTA_BYTES'] = int(os.environ.get('USER_QUOTA_BYTES', 0))  # Default per-user storage quota; 0 = unlimited. Per-user 'quota_bytes' overrides.
+app.config['BATCH_REAP_CHUNK_SIZE'] = int(os.environ.get('BATCH_REAP_CHUNK_SIZE', 200))  # Items per Redis round trip when reaping a deleted batch.
+app.config['BATCH_REAP_CHUNKS_PER_RUN'] = int(os.environ.get('BATCH_REAP_CHUNKS_PER_RUN', 25))  # Then the reaper re-queues itself.
+app.config['BATCH_REAP_LOCK_TTL'] = int(os.environ.get('BATCH_REAP_LOCK_TTL', 1800))
+
+# --- Garbage Collection Configuration ---
+app.config['GC_INTERVAL_SECONDS'] = int(os.environ.get('GC_INTERVAL_SECONDS', 3600))  # Celery beat schedule; 0 disables.
+app.config['GC_KEY_BUDGET'] = int(os.environ.get('GC_KEY_BUDGET', 20000))  # Redis keys examined per run.
+app.config['GC_FILE_BUDGET'] = int(os.environ.get('GC_FILE_BUDGET', 20000))  # Storage keys examined per run.
+app.config['GC_SCAN_COUNT'] = int(os.environ.get('GC_SCAN_COUNT', 500))  # SCAN COUNT hint and chunk size.
+app.config['GC_THROTTLE_SECONDS'] = float(os.environ.get('GC_THROTTLE_SECONDS', 0.05))  # Pause between chunks.
+app.config['GC_GRACE_SECONDS'] = int(os.environ.get('GC_GRACE_SECONDS', 6 * 3600))  # Never touch anything younger than this.
+app.config['GC_STALE_PROCESSING_SECONDS'] = int(os.environ.get('GC_STALE_PROCESSING_SECONDS', 24 * 3600))  # Queued/processing this long = interrupted.
+
+# --- Batch Event Stream Configuration ---
+app.config['BATCH_EVENTS_MAXLEN'] = int(os.environ.get('BATCH_EVENTS_MAXLEN', 1000))  # Approximate per-batch stream length.
+app.config['BATCH_EVENTS_TTL'] = int(os.environ.get('BATCH_EVENTS_TTL', 24 * 3600))
+app.config['SSE_BLOCK_MS'] = int(os.environ.get('SSE_BLOCK_MS', 15000))  # Also the keepalive interval.
+app.config['SSE_MAX_STREAM_SECONDS'] = int(os.environ.get('SSE_MAX_STREAM_SECONDS', 300))  # Clients reconnect with Last-Event-ID.
+app.config['SSE_RETRY_MS'] = int(os.environ.get('SSE_RETRY_MS', 3000))
+app.config['PROGRESS_EVENT_INTERVAL'] = float(os.environ.get('PROGRESS_EVENT_INTERVAL', 1.0))
+
+# --- Metrics Configuration ---
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+app.config['METRICS_FLUSH_SECONDS'] = float(os.environ.get('METRICS_FLUSH_SECONDS', 5))  # Per-process buffer -> Redis interval.
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')  # If set, /metrics requires 'Authorization: Bearer <token>'.
+app.config['TASK_STATS_BUCKET_SECONDS'] = int(os.environ.get('TASK_STATS_BUCKET_SECONDS', 3600))  # Width of one task stats time bucket.
+app.config['TASK_STATS_RETENTION_HOURS'] = int(os.environ.get('TASK_STATS_RETENTION_HOURS', 24 * 14))
+
+# --- Rate Limiting Configuration ---
+# Token buckets, 'count/seconds[:burst]': refill `count` tokens every `seconds`, hold at most `burst` (default `count`).
+app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+app.config['RATE_LIMIT_TRUSTED_PROXIES'] = int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', 0))  # Reverse proxies appending to X-Forwarded-For.
+app.config['RATE_LIMITS'] = {
+    'login_ip': os.environ.get('RATE_LIMIT_LOGIN_IP', '10/60:20'),
+    'login_user': os.environ.get('RATE_LIMIT_LOGIN_USER', '5/60:10'),  # Per attempted username, whatever the source IP.
+    'register_ip': os.environ.get('RATE_LIMIT_REGISTER_IP', '5/3600:10'),
+    'public_ip': os.environ.get('RATE_LIMIT_PUBLIC_IP', '600/60:600'),  # A shared gallery page loads many thumbnails at once.
+    'public_token': os.environ.get('RATE_LIMIT_PUBLIC_TOKEN', '1200/60:1200'),
+    'upload_user': os.environ.get('RATE_LIMIT_UPLOAD_USER', '120/60:240'),
+    'upload_chunk_user': os.environ.get('RATE_LIMIT_UPLOAD_CHUNK_USER', '600/60:600'),
+}
 
 # --- Celery Configuration & Setup ---
 redis_password_for_celery = os.environ.get('REDIS_PASSWORD', None)
@@ -124,6 +273,8 @@ def make_celery(flask_app):
     celery_instance.Task = ContextTask
     return celery_instance
 celery = make_celery(app)
+if app.config['GC_INTERVAL_SECONDS'] > 0:
+    celery.conf.beat_schedule = {'garbage-collect': {'task': 'api_app.garbage_collect_task', 'schedule': app.config['GC_INTERVAL_SECONDS']}}
 
 # --- Logging Configuration ---
 log_level_str = os.environ.get('LOG_LEVEL', 'INFO' if not app.debug else 'DEBUG').upper()
@@ -138,27 +289,49 @@ if not app.logger.handlers:
 app.logger.info(f"Flask logger configured to level {log_level_str}.")
 
 # --- CORS Configuration (Crucial for Next.js) ---
+CORS_ORIGINS = [  # Also used by asgi_app.py for the routes it serves natively.
+    "http://localhost:3000",
+    "http://127.0.0.0:3000",
+    "https://lightbox.mine.nu",
+    "https://vibe.mine.nu",
+    "https://vibeapi.mine.nu"
+]
 CORS(
     app,
-    resources={r"/api/v1/*": {"origins": [
-        "http://localhost:3000",
-        "http://127.0.0.0:3000",
-        "https://lightbox.mine.nu",
-        "https://vibe.mine.nu",
-        "https://vibeapi.mine.nu"
-    ]}},
-    allow_headers=["Content-Type", "Authorization", "X-Requested-With"],
+    resources={r"/api/v1/*": {"origins": CORS_ORIGINS}},
+    allow_headers=["Content-Type", "Authorization", "X-Requested-With", "Content-Range", "Last-Event-ID"],
+    expose_headers=["X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset", "Retry-After"],
     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     supports_credentials=False,
     max_age=86400
 )
 app.logger.info("CORS configured for /api/v1/* with specified origins, headers, and methods.")
 
-# --- Redis Client Setup for Flask app ---
-redis_client = None
-redis_connection_message = "Redis client not initialized."
-try:
-    redis_client = redis.Redis(
+# --- Redis Connection Pools ---
+class CountingConnectionPool(redis.ConnectionPool):
+    # ConnectionPool that counts sockets it opened vs. checkouts served by an already-open connection.
+    # redis-py resets a pool on first use in a forked child, which also zeroes these counters.
+    def reset(self):
+        super().reset()
+        self.stats_lock = threading.Lock(); self.connections_opened = 0; self.checkouts = 0
+
+    def make_connection(self):
+        with self.stats_lock: self.connections_opened += 1
+        return super().make_connection()
+
+    def get_connection(self, *args, **kwargs):
+        connection = super().get_connection(*args, **kwargs)
+        with self.stats_lock: self.checkouts += 1
+        return connection
+
+    def stats(self):
+        with self.stats_lock: opened, checkouts = self.connections_opened, self.checkouts
+        return {'pid': self.pid, 'opened': opened, 'reused': max(0, checkouts - opened), 'checkouts': checkouts,
+                'in_use': len(self._in_use_connections), 'idle': len(self._available_connections)}
+
+def redis_connection_kwargs():
+    # Shared by the sync pools here and the redis.asyncio pool in asgi_app.py.
+    return dict(
         host=os.environ.get('REDIS_HOST', 'localhost'),
         port=int(os.environ.get('REDIS_PORT', 6379)),
         db=app.config['APP_REDIS_DB_NUM'],
@@ -166,32 +339,84 @@ try:
         decode_responses=True,
         socket_connect_timeout=5,
         socket_keepalive=True,
-        retry_on_timeout=True
+        retry_on_timeout=True,
+        health_check_interval=app.config['REDIS_HEALTH_CHECK_INTERVAL']
     )
-    redis_client.ping()
-    redis_connection_message = f"Successfully connected to Redis DB {app.config['APP_REDIS_DB_NUM']} at {redis_client.connection_pool.connection_kwargs.get('host')}:{redis_client.connection_pool.connection_kwargs.get('port')}."
-    app.logger.info(redis_connection_message)
-except Exception as e:
-    redis_connection_message = f"Could not connect to Redis: {e}"
-    app.logger.error(f"FATAL: Flask app could not connect to Redis DB {app.config['APP_REDIS_DB_NUM']}: {e}.")
-    redis_client = None
+
+# Redis commands issued by the current request: {'commands', 'roundtrips', 'seconds'}; None outside a request.
+request_redis_stats = contextvars.ContextVar('request_redis_stats', default=None)
+
+def _count_redis_call(commands, started):
+    stats = request_redis_stats.get()
+    if stats is not None:
+        stats['commands'] += commands; stats['roundtrips'] += 1; stats['seconds'] += time.perf_counter() - started
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        commands = len(self.command_stack); started = time.perf_counter()
+        try: return super().execute(raise_on_error)
+        finally: _count_redis_call(commands, started)
+
+class InstrumentedRedis(redis.Redis):
+    # Counts commands and round trips (a pipeline is one) against the request being served.
+    def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try: return super().execute_command(*args, **options)
+        finally: _count_redis_call(1, started)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+def build_redis_client(max_connections=None):
+    return InstrumentedRedis(connection_pool=CountingConnectionPool(max_connections=max_connections, **redis_connection_kwargs()))
+
+def redis_pool_stats(r_client):
+    pool = getattr(r_client, 'connection_pool', None)
+    return pool.stats() if isinstance(pool, CountingConnectionPool) else None
+
+class ProcessRedis:
+    # Lazily builds one pooled client per process and forwards attribute access to it. Nothing connects at import,
+    # so cold start does not depend on Redis being up, and a Redis outage only fails the requests made during it.
+    # Its own names must not collide with Redis commands: redis_client.get(key) has to reach the client.
+    def __init__(self, max_connections=None):
+        self.max_connections = max_connections
+        self._lock = threading.Lock(); self._client = None; self._pid = None
+
+    def client(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._client = build_redis_client(max_connections=self.max_connections); self._pid = pid
+        return self._client
+
+    def reset(self):
+        # Called in forked children: drop the parent's client and replace a lock that may have been held mid-fork.
+        self._lock = threading.Lock(); self._client = None; self._pid = None
+
+    def __getattr__(self, name):
+        return getattr(self.client(), name)
+
+# --- Redis Client Setup for Flask app ---
+redis_client = ProcessRedis()
+app.logger.info(f"Redis configured for DB {app.config['APP_REDIS_DB_NUM']} at {os.environ.get('REDIS_HOST', 'localhost')}:{os.environ.get('REDIS_PORT', 6379)} (connects on first use).")
 
 # --- Data Schemas & Mime Types ---
 ALLOWED_EXTENSIONS = {
-    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'heif', 'svg', 'avif', 'bmp', 'ico',
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'heif', 'svg', 'avif', 'bmp', 'ico', 'tif', 'tiff',
     'mp4', 'mkv', 'mov', 'webm', 'ogv', '3gp', '3g2', 'avi', 'wmv', 'flv', 'mpg', 'mpeg',
     'mp3', 'aac', 'wav', 'ogg', 'opus', 'flac', 'm4a', 'wma', 'pdf',
     'zip', 'tar', 'gz', 'tgz', '7z'
 }
 MEDIA_PROCESSING_EXTENSIONS = {
-    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'heif', 'svg', 'avif', 'bmp', 'ico',
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'heif', 'svg', 'avif', 'bmp', 'ico', 'tif', 'tiff',
     'mp4', 'mkv', 'mov', 'webm', 'ogv', '3gp', '3g2', 'avi', 'wmv', 'flv', 'mpg', 'mpeg',
     'mp3', 'aac', 'wav', 'ogg', 'opus', 'flac', 'm4a', 'wma', 'pdf'
 }
 MIME_TYPE_MAP = {
     '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.gif': 'image/gif',
     '.webp': 'image/webp', '.heic': 'image/heic', '.heif': 'image/heif', '.svg': 'image/svg+xml',
-    '.avif': 'image/avif', '.bmp': 'image/bmp', '.ico': 'image/x-icon',
+    '.avif': 'image/avif', '.bmp': 'image/bmp', '.ico': 'image/x-icon', '.tif': 'image/tiff', '.tiff': 'image/tiff',
     '.mp4': 'video/mp4', '.mov': 'video/quicktime', '.mkv': 'video/x-matroska', '.webm': 'video/webm',
     '.ogv': 'video/ogg', '.3gp': 'video/3gpp', '.3g2': 'video/3gpp2', '.avi': 'video/x-msvideo',
     '.wmv': 'video/x-ms-wmv', '.flv': 'video/x-flv', '.mpg': 'video/mpeg', '.mpeg': 'video/mpeg',
@@ -208,43 +433,1042 @@ def allowed_file(filename):
 def is_media_for_processing(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in MEDIA_PROCESSING_EXTENSIONS
 
+DERIVATIVE_MIME_TYPES = {'image/svg+xml'}  # Excluded: vector, the original is already small and scalable.
+DERIVATIVE_CONTENT_TYPES = {'webp': 'image/webp', 'avif': 'image/avif'}
+RENDER_CONTENT_TYPES = {'webp': 'image/webp', 'avif': 'image/avif', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+def is_derivative_source(mimetype):
+    return bool(mimetype) and ((mimetype.startswith('image/') and mimetype not in DERIVATIVE_MIME_TYPES) or mimetype == 'application/pdf')
+
+VIDEO_PREVIEW_ASSETS = {  # Served name -> (media hash field, content type)
+    'poster.jpg': ('derivative_poster', 'image/jpeg'),
+    'sprite.jpg': ('derivative_sprite', 'image/jpeg'),
+    'sprite.vtt': ('derivative_sprite_vtt', 'text/vtt'),
+}
+
+def needs_image_normalization(mimetype):
+    return bool(mimetype) and mimetype in {MIME_TYPE_MAP.get(f'.{ext}') for ext in app.config['IMAGE_FORMATS_TO_NORMALIZE']}
+
+def display_source(mdata):
+    # (storage key, mimetype) to show in browsers: the normalized rendition when one exists, else the original.
+    if mdata.get('display_filepath'):
+        return mdata['display_filepath'], mdata.get('display_mimetype', 'image/jpeg')
+    return mdata.get('filepath'), mdata.get('mimetype', 'application/octet-stream')
+
+def media_storage_keys(mdata):
+    # Every storage key owned by a media item: the file itself, its display rendition and any generated derivatives.
+    keys = [mdata['filepath']] if mdata.get('filepath') else []
+    if mdata.get('display_filepath'): keys.append(mdata['display_filepath'])
+    keys.extend(v for k, v in mdata.items() if k.startswith('derivative_') and v)
+    return keys
+
+def pick_derivative_key(mdata, size_name, accept_header='', requested_format=None):
+    # Returns (storage key, format) of the best stored rendition for the client, or (None, None).
+    formats = [requested_format] if requested_format else (['avif', 'webp'] if 'image/avif' in (accept_header or '') else ['webp', 'avif'])
+    for fmt in formats:
+        key = mdata.get(f'derivative_{size_name}_{fmt}')
+        if key:
+            return key, fmt
+    return None, None
+
+# Task code shares one pooled client per process instead of opening a fresh connection (TCP + AUTH) per call.
+worker_redis = ProcessRedis(max_connections=app.config['REDIS_WORKER_POOL_MAX_CONNECTIONS'])
+
 def get_app_data_redis_client():
-    _app_context = current_app._get_current_object() if current_app else None
-    host = _app_context.config.get('REDIS_HOST', os.environ.get('REDIS_HOST', 'localhost')) if _app_context else os.environ.get('REDIS_HOST', 'localhost')
-    port = int(_app_context.config.get('REDIS_PORT', os.environ.get('REDIS_PORT', 6379))) if _app_context else int(os.environ.get('REDIS_PORT', 6379))
-    db_num = _app_context.config.get('APP_REDIS_DB_NUM', 0) if _app_context else int(os.environ.get('APP_REDIS_DB_NUM', 0))
-    password = _app_context.config.get('REDIS_PASSWORD', os.environ.get('REDIS_PASSWORD', None)) if _app_context else os.environ.get('REDIS_PASSWORD', None)
-    return redis.Redis(host=host, port=port, db=db_num, password=password, decode_responses=True, socket_connect_timeout=5, socket_keepalive=True, retry_on_timeout=True)
-
-def get_unique_disk_path_celery(directory, base_name, extension_with_dot, task_id_for_log=""):
-    counter = 0; filename = f"{base_name}{extension_with_dot}"; path = os.path.join(directory, filename)
-    _base = base_name
-    while os.path.exists(path):
-        counter += 1; filename = f"{_base}_{counter}{extension_with_dot}"; path = os.path.join(directory, filename)
-        if counter > 100:
-            _task_logger = current_app.logger if current_app else logging.getLogger(__name__)
-            _task_logger.error(f"[Task {task_id_for_log}] High collision finding unique path for {base_name}{extension_with_dot}. Using UUID.")
-            filename = f"{uuid.uuid4().hex}{extension_with_dot}"; path = os.path.join(directory, filename); break
-    return path, filename
-
-def get_unique_disk_path(directory, base, ext_dot):
-    ct = 0; fname = f"{base}{ext_dot}"; pth = os.path.join(directory, fname); _b = base
-    while os.path.exists(pth): ct += 1; fname = f"{_b}_{ct}{ext_dot}"; pth = os.path.join(directory, fname)
-    if ct > 100: fname = f"{_b}_{uuid.uuid4().hex[:8]}{ext_dot}"; pth = os.path.join(directory,fname)
-    return pth, fname
+    return worker_redis.client()
+
+def _reset_process_redis():
+    redis_client.reset(); worker_redis.reset()
+
+os.register_at_fork(after_in_child=_reset_process_redis)
+
+@worker_process_init.connect
+def _reset_worker_redis(**kwargs):
+    _reset_process_redis()
+
+@worker_process_shutdown.connect
+def _log_worker_redis_stats(**kwargs):
+    if worker_redis._client is not None and worker_redis._pid == os.getpid():
+        app.logger.info(f"Worker {os.getpid()} Redis pool: {redis_pool_stats(worker_redis._client)}")
+        metrics.flush(worker_redis._client, force=True)
+        worker_redis._client.connection_pool.disconnect()
+
+# --- Metrics ---
+# Samples are buffered per process and added to one Redis hash every METRICS_FLUSH_SECONDS, so /metrics reports the sum
+# over all web and worker processes. Hash fields are the Prometheus sample names, labels included.
+METRICS_KEY = 'metrics:samples'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+REDIS_COMMAND_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+HTTP_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH'}
+METRIC_FAMILIES = {  # name -> (type, help)
+    'froogle_http_requests_total': ('counter', 'HTTP requests by endpoint, method and status.'),
+    'froogle_http_request_duration_seconds': ('histogram', 'Time from request start to the last body byte.'),
+    'froogle_http_response_bytes_total': ('counter', 'Response body bytes sent.'),
+    'froogle_file_bytes_served_total': ('counter', 'Response body bytes of file responses (media, derivatives, renders).'),
+    'froogle_http_request_redis_commands': ('histogram', 'Redis commands issued while serving one request.'),
+    'froogle_redis_commands_total': ('counter', 'Redis commands issued while serving requests; pipelined commands count individually.'),
+    'froogle_redis_roundtrips_total': ('counter', 'Redis round trips while serving requests; a pipeline is one.'),
+    'froogle_redis_seconds_total': ('counter', 'Time spent waiting on Redis while serving requests.'),
+    'froogle_redis_pool_connections_opened_total': ('counter', 'Redis connections opened by the instrumented pools.'),
+    'froogle_redis_pool_checkouts_total': ('counter', 'Redis connections taken from the instrumented pools.'),
+    'froogle_task_runs_total': ('counter', 'Celery task runs by task, queue and outcome (succeeded, failed, retried).'),
+    'froogle_task_errors_total': ('counter', 'Failed or retried Celery task runs by reason.'),
+    'froogle_task_queue_wait_seconds': ('histogram', 'Time from enqueue (or ETA, for retries) to the task starting.'),
+    'froogle_task_run_seconds': ('histogram', 'Celery task run time.'),
+    'froogle_task_input_bytes_total': ('counter', 'Input bytes read by conversion and import tasks.'),
+    'froogle_task_output_bytes_total': ('counter', 'Output bytes written by conversion tasks.'),
+    'froogle_task_media_seconds_total': ('counter', 'Media duration processed by successful transcodes.'),
+    'froogle_task_realtime_factor': ('histogram', 'Media seconds transcoded per second of run time, per successful transcode.'),
+}
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _metric_sample(name, labels):
+    if not labels: return name
+    return name + '{' + ','.join(f'{k}="{_escape_label_value(v)}"' for k, v in labels.items()) + '}'
+
+class MetricsBuffer:
+    def __init__(self):
+        self.lock = threading.Lock(); self.samples = {}; self.last_flush = time.monotonic(); self.pool_reported = {}
+
+    def inc(self, name, labels=None, value=1):
+        if not app.config['METRICS_ENABLED'] or not value: return
+        key = _metric_sample(name, labels)
+        with self.lock: self.samples[key] = self.samples.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets):
+        if not app.config['METRICS_ENABLED']: return
+        with self.lock:
+            for le in list(buckets) + ['+Inf']:  # Every bucket, even at 0, so each series exists from the first observation.
+                key = _metric_sample(f"{name}_bucket", {**labels, 'le': le}); self.samples[key] = self.samples.get(key, 0) + (le == '+Inf' or value <= le)
+            for suffix, amount in (('_sum', value), ('_count', 1)):
+                key = _metric_sample(f"{name}{suffix}", labels); self.samples[key] = self.samples.get(key, 0) + amount
+
+    def _queue_pool_deltas(self):
+        # Pool counters are per process and restart at zero after a fork or pool reset.
+        for role, proc_redis in (('web', redis_client), ('worker', worker_redis)):
+            if not isinstance(proc_redis, ProcessRedis) or proc_redis._client is None or proc_redis._pid != os.getpid(): continue
+            stats = redis_pool_stats(proc_redis._client)
+            if not stats: continue
+            last = self.pool_reported.get(role, (0, 0))
+            opened, checkouts = stats['opened'], stats['checkouts']
+            self.inc('froogle_redis_pool_connections_opened_total', {'role': role}, opened - last[0] if opened >= last[0] else opened)
+            self.inc('froogle_redis_pool_checkouts_total', {'role': role}, checkouts - last[1] if checkouts >= last[1] else checkouts)
+            self.pool_reported[role] = (opened, checkouts)
+
+    def flush(self, r_client, force=False):
+        if not force and time.monotonic() - self.last_flush < app.config['METRICS_FLUSH_SECONDS']: return
+        self._queue_pool_deltas()
+        with self.lock:
+            pending, self.samples = self.samples, {}; self.last_flush = time.monotonic()
+        if not pending: return
+        try:
+            redis_pipe = r_client.pipeline(transaction=False)
+            for key, value in pending.items(): redis_pipe.hincrbyfloat(METRICS_KEY, key, value)
+            redis_pipe.execute()
+        except redis.exceptions.RedisError as e:
+            app.logger.warning(f"Metrics flush failed, keeping {len(pending)} sample(s) for the next one: {e}")
+            with self.lock:
+                for key, value in pending.items(): self.samples[key] = self.samples.get(key, 0) + value
+
+    def reset(self):
+        self.lock = threading.Lock(); self.samples = {}; self.pool_reported = {}
+
+metrics = MetricsBuffer()
+os.register_at_fork(after_in_child=metrics.reset)  # A child must not re-report its parent's buffered samples.
+
+def record_request_metrics(endpoint, method, status, seconds, body_bytes, is_file, redis_stats):
+    labels = {'endpoint': endpoint}
+    metrics.inc('froogle_http_requests_total', {'endpoint': endpoint, 'method': method if method in HTTP_METHODS else 'other', 'status': status})
+    metrics.observe('froogle_http_request_duration_seconds', labels, seconds, LATENCY_BUCKETS)
+    metrics.inc('froogle_http_response_bytes_total', labels, body_bytes)
+    if is_file: metrics.inc('froogle_file_bytes_served_total', labels, body_bytes)
+    if redis_stats is not None:
+        metrics.observe('froogle_http_request_redis_commands', labels, redis_stats['commands'], REDIS_COMMAND_BUCKETS)
+        metrics.inc('froogle_redis_commands_total', labels, redis_stats['commands'])
+        metrics.inc('froogle_redis_roundtrips_total', labels, redis_stats['roundtrips'])
+        metrics.inc('froogle_redis_seconds_total', labels, redis_stats['seconds'])
+
+class _MeteredBody:
+    # Wraps a WSGI response body to count the bytes actually sent and record the request once the server closes it.
+    def __init__(self, body, on_close):
+        self.body = body; self.on_close = on_close; self.sent = 0
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'): self.body.close()
+        finally:
+            self.on_close(self.sent)
+
+class MetricsMiddleware:
+    # Outermost WSGI layer, so timings include streaming the body. Flask fills in the endpoint from after_request.
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        if not app.config['METRICS_ENABLED']: return self.wsgi_app(environ, start_response)
+        started = time.perf_counter(); redis_stats = {'commands': 0, 'roundtrips': 0, 'seconds': 0.0}
+        request_redis_stats.set(redis_stats); response_meta = {}
+
+        def metered_start_response(status, headers, exc_info=None):
+            response_meta['status'] = status.split(' ', 1)[0]
+            response_meta['length'] = next((int(v) for k, v in headers if k.lower() == 'content-length' and v.isdigit()), None)
+            return start_response(status, headers, exc_info)
+
+        def finish(body_bytes):
+            request_redis_stats.set(None)
+            info = environ.get('froogle.metrics', {})
+            record_request_metrics(info.get('endpoint', 'unmatched'), environ.get('REQUEST_METHOD', ''), response_meta.get('status', '500'),
+                                   time.perf_counter() - started, body_bytes, info.get('file', False), redis_stats)
+            metrics.flush(redis_client)
+
+        try: body = self.wsgi_app(environ, metered_start_response)
+        except BaseException:
+            finish(0); raise
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None and isinstance(file_wrapper, type) and isinstance(body, file_wrapper):
+            # Left unwrapped so the server can still sendfile(); timed to the first byte, sized from Content-Length.
+            finish(response_meta.get('length') or 0); return body
+        return _MeteredBody(body, finish)
+
+app.wsgi_app = MetricsMiddleware(app.wsgi_app)
+
+@app.after_request
+def tag_request_metrics(response):
+    request.environ['froogle.metrics'] = {'endpoint': request.endpoint or 'unmatched', 'file': bool(response.direct_passthrough)}
+    return response
+
+def render_metrics(samples):
+    # Prometheus text format, one HELP/TYPE header per family, histogram buckets in 'le' order.
+    def family_of(sample_name):
+        base = sample_name.split('{', 1)[0]
+        for suffix in ('_bucket', '_sum', '_count'):
+            if base.endswith(suffix) and base[:-len(suffix)] in METRIC_FAMILIES: return base[:-len(suffix)]
+        return base
+    def sort_key(item):
+        name = item[0]; le = re.search(r'[{,]le="([^"]+)"', name)  # Not 'role="..."'.
+        return (family_of(name), re.sub(r',le="[^"]+"', '', name), float(le.group(1)) if le else 0.0)
+    lines = []; current = None
+    for name, value in sorted(samples.items(), key=sort_key):
+        family = family_of(name)
+        if family != current:
+            current = family; kind, help_text = METRIC_FAMILIES.get(family, ('untyped', ''))
+            lines += [f"# HELP {family} {help_text}", f"# TYPE {family} {kind}"]
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+# --- Task Telemetry ---
+# Celery signals time every task run; tasks add bytes, media duration or a handled failure via note_task_run().
+# Each finished run goes to the Prometheus buffer and to an hourly hash (task_stats:<bucket start>) whose fields are
+# '<queue>|<task>|<stat>', summed over a time window by the admin task-stats API.
+TASK_STATS_KEY_PREFIX = 'task_stats:'
+TASK_WAIT_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 300, 900, 1800, 3600)
+TASK_RUN_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 300, 900, 1800, 3600, 10800)
+REALTIME_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+TASK_OUTCOMES = {'SUCCESS': 'succeeded', 'RETRY': 'retried'}  # Celery state -> outcome; anything else is 'failed'.
+_task_runs = {}  # task id -> the in-progress run in this process
+
+def note_task_run(task, **values):
+    # Called from inside a task: input_bytes=, output_bytes=, media_seconds=, or failure=<reason> for errors it handles itself.
+    run = _task_runs.get(task.request.id)
+    if run is not None: run.update(values)
+
+def task_error_reason(exc):
+    # Low-cardinality label: ffmpeg exit codes and timeouts by name, anything else by exception class.
+    exc = getattr(exc, 'exc', None) or exc  # Retry wraps the exception that caused it.
+    if isinstance(exc, subprocess.CalledProcessError): return f"exit_{exc.returncode}"
+    if isinstance(exc, subprocess.TimeoutExpired): return 'timeout'
+    return type(exc).__name__ if isinstance(exc, BaseException) else 'retry'
+
+def task_stats_key(timestamp):
+    width = app.config['TASK_STATS_BUCKET_SECONDS']
+    return f"{TASK_STATS_KEY_PREFIX}{int(timestamp // width * width)}"
+
+@before_task_publish.connect
+def _stamp_task_enqueue_time(headers=None, **kwargs):
+    # Custom message headers come back as attributes of task.request on the worker; a retry is re-published and re-stamped.
+    if headers is not None: headers['froogle_enqueued_at'] = time.time()
+
+@task_prerun.connect
+def _start_task_run(task_id=None, task=None, **kwargs):
+    run = {'started': time.perf_counter(), 'queue': (task.request.delivery_info or {}).get('routing_key') or task.app.conf.task_default_queue}
+    enqueued_at = task.request.get('froogle_enqueued_at')
+    if enqueued_at:
+        try: ready_at = max(float(enqueued_at), datetime.datetime.fromisoformat(task.request.eta).timestamp() if task.request.eta else 0)
+        except (TypeError, ValueError): ready_at = float(enqueued_at)
+        run['queue_wait'] = max(0.0, time.time() - ready_at)  # A countdown is deliberate delay, not queueing.
+    _task_runs[task_id] = run
+
+@task_retry.connect
+def _note_task_retry(request=None, reason=None, **kwargs):
+    if request is not None and request.id in _task_runs: _task_runs[request.id]['reason'] = task_error_reason(reason)
+
+@task_failure.connect
+def _note_task_failure(task_id=None, exception=None, **kwargs):
+    if task_id in _task_runs: _task_runs[task_id]['reason'] = task_error_reason(exception)
+
+@task_postrun.connect
+def _finish_task_run(task_id=None, task=None, state=None, **kwargs):
+    run = _task_runs.pop(task_id, None)
+    if run is None: return
+    seconds = time.perf_counter() - run['started']
+    outcome = TASK_OUTCOMES.get(state, 'failed')
+    if outcome == 'succeeded' and run.get('failure'): outcome = 'failed'; run['reason'] = run['failure']
+    try:
+        r_client = get_app_data_redis_client()
+        record_task_run(r_client, task.name.rsplit('.', 1)[-1], run['queue'], outcome, seconds, run)
+        metrics.flush(r_client)
+    except redis.exceptions.RedisError as e:
+        app.logger.warning(f"Could not record task stats for {task.name} {task_id}: {e}")
+
+def record_task_run(r_client, task_name, queue, outcome, seconds, run):
+    labels = {'task': task_name, 'queue': queue}
+    media_seconds = (run.get('media_seconds') or 0) if outcome == 'succeeded' else 0
+    metrics.inc('froogle_task_runs_total', {**labels, 'outcome': outcome})
+    metrics.observe('froogle_task_run_seconds', labels, seconds, TASK_RUN_BUCKETS)
+    if 'queue_wait' in run: metrics.observe('froogle_task_queue_wait_seconds', labels, run['queue_wait'], TASK_WAIT_BUCKETS)
+    if outcome != 'succeeded': metrics.inc('froogle_task_errors_total', {**labels, 'outcome': outcome, 'reason': run.get('reason', 'unknown')})
+    metrics.inc('froogle_task_input_bytes_total', labels, run.get('input_bytes') or 0)
+    metrics.inc('froogle_task_output_bytes_total', labels, run.get('output_bytes') or 0)
+    metrics.inc('froogle_task_media_seconds_total', labels, media_seconds)
+    if media_seconds and seconds > 0: metrics.observe('froogle_task_realtime_factor', labels, media_seconds / seconds, REALTIME_BUCKETS)
+
+    stats = {'runs': 1, outcome: 1, 'run_seconds': seconds, 'input_bytes': run.get('input_bytes') or 0, 'output_bytes': run.get('output_bytes') or 0}
+    if 'queue_wait' in run: stats.update(queue_waits=1, queue_wait_seconds=run['queue_wait'])
+    if media_seconds: stats.update(media_seconds=media_seconds, media_run_seconds=seconds)
+    if outcome != 'succeeded': stats[f"{outcome}:{run.get('reason', 'unknown')}"] = 1
+    key = task_stats_key(time.time())
+    redis_pipe = r_client.pipeline(transaction=False)
+    for stat, value in stats.items():
+        if value: redis_pipe.hincrbyfloat(key, f"{queue}|{task_name}|{stat}", value)
+    redis_pipe.expire(key, app.config['TASK_STATS_RETENTION_HOURS'] * 3600 + app.config['TASK_STATS_BUCKET_SECONDS'])
+    redis_pipe.execute()
+
+def task_stats_summary(r_client, hours):
+    # Sums the hourly buckets covering the last `hours` into {queue: {totals..., 'tasks': {task: stats}}}.
+    width = app.config['TASK_STATS_BUCKET_SECONDS']; now = time.time()
+    redis_pipe = r_client.pipeline(transaction=False)
+    for i in range(max(1, int(math.ceil(hours * 3600 / width)))): redis_pipe.hgetall(task_stats_key(now - i * width))
+    queues = {}
+    for bucket in redis_pipe.execute():
+        for field, value in bucket.items():
+            queue, task_name, stat = field.split('|', 2)
+            task_stats = queues.setdefault(queue, {}).setdefault(task_name, {})
+            task_stats[stat] = task_stats.get(stat, 0) + float(value)
+    window_seconds = hours * 3600; summary = {}
+    for queue, tasks in sorted(queues.items()):
+        rendered = {task_name: summarize_task_stats(raw) for task_name, raw in sorted(tasks.items())}
+        busy_seconds = sum(raw.get('run_seconds', 0) for raw in tasks.values())
+        summary[queue] = {'runs': sum(t['runs'] for t in rendered.values()), 'failed': sum(t['failed'] for t in rendered.values()),
+                          'retried': sum(t['retried'] for t in rendered.values()), 'busy_seconds': round(busy_seconds, 3),
+                          'avg_busy_workers': round(busy_seconds / window_seconds, 3),  # Mean concurrently running tasks.
+                          'tasks': rendered}
+    return summary
+
+def summarize_task_stats(raw):
+    runs = int(raw.get('runs', 0)); waits = raw.get('queue_waits', 0); media_run = raw.get('media_run_seconds', 0)
+    return {
+        'runs': runs, 'succeeded': int(raw.get('succeeded', 0)), 'failed': int(raw.get('failed', 0)), 'retried': int(raw.get('retried', 0)),
+        'failure_reasons': {k.split(':', 1)[1]: int(v) for k, v in raw.items() if k.startswith('failed:')},
+        'retry_reasons': {k.split(':', 1)[1]: int(v) for k, v in raw.items() if k.startswith('retried:')},
+        'avg_queue_wait_seconds': round(raw.get('queue_wait_seconds', 0) / waits, 3) if waits else None,
+        'avg_run_seconds': round(raw.get('run_seconds', 0) / runs, 3) if runs else None,
+        'input_bytes': int(raw.get('input_bytes', 0)), 'output_bytes': int(raw.get('output_bytes', 0)),
+        'media_seconds': round(raw.get('media_seconds', 0), 3),
+        'realtime_factor': round(raw.get('media_seconds', 0) / media_run, 2) if media_run else None,
+    }
+
+# --- Storage Backends ---
+# Every stored object is addressed by a storage key: a '/'-separated path relative to the storage root, e.g.
+# '<owner>/<batch_id>/ab/cd/<media_id>.jpg'. The key is what Redis keeps in a media item's 'filepath'.
+def storage_key(batch_segment, filename):
+    # Two hash-derived shard levels keep any single directory/prefix to a few hundred entries even in huge batches.
+    digest = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+    return '/'.join([batch_segment.replace(os.sep, '/'), digest[:2], digest[2:4], filename])
+
+def _content_disposition(as_attachment, download_name):
+    disposition = 'attachment' if as_attachment else 'inline'
+    ascii_name = download_name.encode('ascii', 'ignore').decode('ascii').replace('"', '').replace('\\', '') or 'download'
+    return f"{disposition}; filename=\"{ascii_name}\"; filename*=UTF-8''{url_quote(download_name, safe='')}"
+
+class LocalStorage:
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(os.path.abspath(self.root) + os.sep):
+            raise ValueError(f"Storage key escapes storage root: {key}")
+        return path
+
+    def _prepare(self, key):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def reserve(self, key):
+        os.close(os.open(self._prepare(key), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+
+    def save_upload(self, key, file_storage):
+        file_storage.save(self._prepare(key))
+
+    def put_file(self, key, local_path, move=False):
+        dest = self._prepare(key)
+        if os.path.abspath(local_path) == dest: return
+        if move: os.replace(local_path, dest)
+        else: shutil.copyfile(local_path, dest)
+
+    def move(self, src_key, dest_key):
+        os.replace(self.path(src_key), self._prepare(dest_key))
+
+    def copy(self, src_key, dest_key):
+        # Hard link where possible (same filesystem); the temp name + replace keeps re-runs idempotent.
+        dest = self._prepare(dest_key); tmp = f"{dest}.{uuid.uuid4().hex}.tmp"
+        try: os.link(self.path(src_key), tmp)
+        except OSError: shutil.copyfile(self.path(src_key), tmp)
+        os.replace(tmp, dest)
+
+    @contextlib.contextmanager
+    def fetch(self, key):
+        yield self.path(key)
+
+    @contextlib.contextmanager
+    def produce(self, key):
+        path = self._prepare(key)
+        try:
+            yield path
+        except BaseException:
+            if os.path.exists(path): os.remove(path)
+            raise
+
+    def exists(self, key):
+        return os.path.isfile(self.path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def stat(self, key):
+        # (size, etag) or None; the etag changes whenever the file is rewritten.
+        try: st = os.stat(self.path(key))
+        except FileNotFoundError: return None
+        return st.st_size, f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+    def delete(self, key):
+        try:
+            path = self.path(key); freed = os.path.getsize(path); os.remove(path)
+            return freed
+        except FileNotFoundError:
+            return 0
+
+    def delete_prefix(self, prefix):
+        path = self.path(prefix)
+        if os.path.isdir(path): shutil.rmtree(path)
+
+    def iter_keys(self, prefix='', start_after=''):
+        # Yields (key, size, mtime) in lexicographic key order, like S3 listings, so callers can checkpoint with start_after.
+        base = self.path(prefix) if prefix else self.root
+        base_key = os.path.relpath(base, self.root).replace(os.sep, '/') if prefix else ''
+        def walk(dir_path, dir_key):
+            try: entries = list(os.scandir(dir_path))
+            except (FileNotFoundError, NotADirectoryError): return
+            # Sorting directories as 'name/' orders siblings exactly as their full keys compare.
+            for entry in sorted(entries, key=lambda e: e.name + '/' if e.is_dir(follow_symlinks=False) else e.name):
+                key = f"{dir_key}/{entry.name}" if dir_key else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if start_after and key + '/' < start_after and not start_after.startswith(key + '/'): continue
+                    yield from walk(entry.path, key)
+                elif not start_after or key > start_after:
+                    try: st = entry.stat()
+                    except FileNotFoundError: continue
+                    yield key, st.st_size, st.st_mtime
+        yield from walk(base, base_key)
+
+    def open_range(self, key, start=0, end=None, chunk_size=256 * 1024):
+        with open(self.path(key), 'rb') as f:
+            f.seek(start); remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                buf = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not buf: break
+                if remaining is not None: remaining -= len(buf)
+                yield buf
+
+    def serve(self, key, mimetype, as_attachment, download_name, max_age=None):
+        try:
+            return send_file(self.path(key), mimetype=mimetype, as_attachment=as_attachment, download_name=download_name, conditional=True, max_age=max_age)
+        except FileNotFoundError:
+            abort(404, description="File not found in storage.")
+
+    # Resumable uploads append straight into the destination file.
+    def open_append(self, key):
+        self.reserve(key)
+        return {}
+
+    def append_chunk(self, key, state, offset, stream, length, is_final):
+        written = 0
+        with open(self.path(key), 'r+b') as dest:
+            # Drop any tail left behind by an interrupted chunk before appending.
+            dest.seek(offset); dest.truncate()
+            try:
+                while written < length:
+                    buf = stream.read(min(1024 * 1024, length - written))
+                    if not buf: break
+                    dest.write(buf); written += len(buf)
+            except ClientDisconnected:
+                pass
+        return written, state
+
+    def complete_append(self, key, state):
+        pass
+
+    def abort_append(self, key, state):
+        self.delete(key)
+
+class S3Storage:
+    name = 's3'
+    MIN_PART_SIZE = 5 * 1024 * 1024
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, access_key=None, secret_key=None, addressing_style='auto', scratch_dir=None, multipart_threshold=64 * 1024 * 1024, multipart_chunksize=16 * 1024 * 1024):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.config import Config as BotoConfig
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the 'boto3' package.") from e
+        self.bucket = bucket; self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.scratch_dir = scratch_dir or tempfile.gettempdir()
+        self._boto3 = boto3
+        self._client_kwargs = {
+            'endpoint_url': endpoint_url or None, 'region_name': region or None,
+            'aws_access_key_id': access_key or None, 'aws_secret_access_key': secret_key or None,
+            'config': BotoConfig(s3={'addressing_style': addressing_style}, retries={'max_attempts': 5, 'mode': 'standard'})
+        }
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_threshold, multipart_chunksize=multipart_chunksize)
+        self._client = None; self._client_pid = None
+
+    @property
+    def client(self):
+        # boto3 clients are not fork-safe; build one per process on first use.
+        if self._client is None or self._client_pid != os.getpid():
+            self._client = self._boto3.session.Session().client('s3', **self._client_kwargs); self._client_pid = os.getpid()
+        return self._client
+
+    def _k(self, key):
+        return f"{self.prefix}{key}"
+
+    def _is_missing(self, e):
+        return getattr(e, 'response', {}).get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def _head(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._k(key))
+        except Exception as e:
+            if self._is_missing(e): return None
+            raise
+
+    def reserve(self, key):
+        # Keys are derived from unique item IDs, so there is nothing to race on in an object store.
+        pass
+
+    def save_upload(self, key, file_storage):
+        self.client.upload_fileobj(file_storage.stream, self.bucket, self._k(key), ExtraArgs={'ContentType': file_storage.mimetype or 'application/octet-stream'}, Config=self.transfer_config)
+
+    def put_file(self, key, local_path, move=False):
+        self.client.upload_file(local_path, self.bucket, self._k(key), Config=self.transfer_config)
+        if move: os.remove(local_path)
+
+    def copy(self, src_key, dest_key):
+        self.client.copy({'Bucket': self.bucket, 'Key': self._k(src_key)}, self.bucket, self._k(dest_key), Config=self.transfer_config)
+
+    def move(self, src_key, dest_key):
+        self.copy(src_key, dest_key); self.client.delete_object(Bucket=self.bucket, Key=self._k(src_key))
+
+    def _scratch_path(self, key):
+        os.makedirs(self.scratch_dir, exist_ok=True)
+        return os.path.join(self.scratch_dir, f"s3_{uuid.uuid4().hex}{os.path.splitext(key)[1]}")
+
+    @contextlib.contextmanager
+    def fetch(self, key):
+        local = self._scratch_path(key)
+        try:
+            self.client.download_file(self.bucket, self._k(key), local, Config=self.transfer_config)
+            yield local
+        finally:
+            if os.path.exists(local): os.remove(local)
+
+    @contextlib.contextmanager
+    def produce(self, key):
+        local = self._scratch_path(key)
+        try:
+            yield local
+            self.client.upload_file(local, self.bucket, self._k(key), Config=self.transfer_config)
+        finally:
+            if os.path.exists(local): os.remove(local)
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def size(self, key):
+        head = self._head(key)
+        if head is None: raise FileNotFoundError(key)
+        return head['ContentLength']
+
+    def stat(self, key):
+        head = self._head(key)
+        return (head['ContentLength'], head.get('ETag', '').strip('"')) if head is not None else None
+
+    def delete(self, key):
+        head = self._head(key)
+        if head is None: return 0
+        self.client.delete_object(Bucket=self.bucket, Key=self._k(key))
+        return head['ContentLength']
+
+    def delete_prefix(self, prefix):
+        batch = []
+        for key, _size, _mtime in self.iter_keys(prefix):
+            batch.append({'Key': self._k(key)})
+            if len(batch) == 1000:
+                self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': batch, 'Quiet': True}); batch = []
+        if batch: self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': batch, 'Quiet': True})
+
+    def iter_keys(self, prefix='', start_after=''):
+        list_prefix = self._k(prefix.rstrip('/') + '/') if prefix else self.prefix
+        paginate_args = {'StartAfter': self._k(start_after)} if start_after else {}
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=list_prefix, **paginate_args):
+            for obj in page.get('Contents', []):
+                yield obj['Key'][len(self.prefix):], obj['Size'], obj['LastModified'].timestamp()
+
+    def open_range(self, key, start=0, end=None, chunk_size=256 * 1024):
+        resp = self.client.get_object(Bucket=self.bucket, Key=self._k(key), Range=f"bytes={start}-{'' if end is None else end}")
+        try:
+            yield from resp['Body'].iter_chunks(chunk_size)
+        finally:
+            resp['Body'].close()
+
+    def serve(self, key, mimetype, as_attachment, download_name, max_age=None):
+        head = self._head(key)
+        if head is None: abort(404, description="File not found in storage.")
+        size = head['ContentLength']; etag = head.get('ETag', '').strip('"')
+        headers = {'Accept-Ranges': 'bytes', 'Content-Disposition': _content_disposition(as_attachment, download_name), 'ETag': f'"{etag}"'}
+        if max_age is not None: headers['Cache-Control'] = f"public, max-age={max_age}"
+        if etag and request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+        byte_range = request.range.range_for_length(size) if request.range else None
+        if request.range and byte_range is None:
+            return Response(status=416, headers={**headers, 'Content-Range': f"bytes */{size}"})
+        if byte_range:
+            start, stop = byte_range
+            headers.update({'Content-Range': f"bytes {start}-{stop - 1}/{size}", 'Content-Length': str(stop - start)})
+            return Response(stream_with_context(self.open_range(key, start, stop - 1)), status=206, mimetype=mimetype, headers=headers, direct_passthrough=True)
+        headers['Content-Length'] = str(size)
+        return Response(stream_with_context(self.open_range(key)), status=200, mimetype=mimetype, headers=headers, direct_passthrough=True)
+
+    # Resumable uploads: each session chunk becomes one part of an S3 multipart upload, so any web node can take any chunk.
+    def open_append(self, key):
+        upload = self.client.create_multipart_upload(Bucket=self.bucket, Key=self._k(key))
+        return {'upload_id': upload['UploadId'], 'parts': []}
+
+    def append_chunk(self, key, state, offset, stream, length, is_final):
+        if not is_final and length < self.MIN_PART_SIZE:
+            raise ValueError(f"Chunks other than the last must be at least {self.MIN_PART_SIZE} bytes.")
+        spool = tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024, dir=self.scratch_dir)
+        try:
+            written = 0
+            try:
+                while written < length:
+                    buf = stream.read(min(1024 * 1024, length - written))
+                    if not buf: break
+                    spool.write(buf); written += len(buf)
+            except ClientDisconnected:
+                pass
+            if written < length:
+                return 0, state  # An incomplete part cannot be kept; the client resends the whole chunk.
+            spool.seek(0)
+            part_number = len(state['parts']) + 1
+            part = self.client.upload_part(Bucket=self.bucket, Key=self._k(key), UploadId=state['upload_id'], PartNumber=part_number, Body=spool, ContentLength=length)
+            state['parts'].append({'PartNumber': part_number, 'ETag': part['ETag']})
+            return written, state
+        finally:
+            spool.close()
+
+    def complete_append(self, key, state):
+        if state.get('completed'): return
+        self.client.complete_multipart_upload(Bucket=self.bucket, Key=self._k(key), UploadId=state['upload_id'], MultipartUpload={'Parts': state['parts']})
+
+    def abort_append(self, key, state):
+        if state.get('completed'): self.delete(key); return
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=self._k(key), UploadId=state['upload_id'])
+
+def make_storage(config):
+    backend = config['STORAGE_BACKEND']
+    if backend == 'local':
+        return LocalStorage(config['UPLOAD_FOLDER'])
+    if backend == 's3':
+        return S3Storage(
+            bucket=config['STORAGE_S3_BUCKET'], prefix=config['STORAGE_S3_PREFIX'], endpoint_url=config['STORAGE_S3_ENDPOINT_URL'],
+            region=config['STORAGE_S3_REGION'], access_key=config['STORAGE_S3_ACCESS_KEY_ID'], secret_key=config['STORAGE_S3_SECRET_ACCESS_KEY'],
+            addressing_style=config['STORAGE_S3_ADDRESSING_STYLE'], scratch_dir=config['SCRATCH_FOLDER'],
+            multipart_threshold=config['STORAGE_S3_MULTIPART_THRESHOLD'], multipart_chunksize=config['STORAGE_S3_MULTIPART_CHUNKSIZE']
+        )
+    raise RuntimeError(f"Unknown STORAGE_BACKEND '{backend}' (expected 'local' or 's3').")
+
+storage = make_storage(app.config)
+app.logger.info(f"Storage backend: {storage.name}")
+
+def item_storage_key(batch_segment, item_id, extension_with_dot):
+    # Stored files are named after their media item ID; the user's filename only lives in Redis ('original_filename').
+    filename = f"{item_id}{extension_with_dot}"
+    return storage_key(batch_segment, filename), filename
+
+def reserve_item_storage_key(batch_segment, item_id, extension_with_dot):
+    # Atomic create (O_EXCL on local disk) instead of probing: a collision can only mean a reused item ID.
+    key, filename = item_storage_key(batch_segment, item_id, extension_with_dot)
+    storage.reserve(key)
+    return key, filename
+
+# --- On-demand Render Cache ---
+# Renders live on node-local disk under RENDER_CACHE_DIR; their LRU order (zset, score = last access),
+# per-entry sizes and the running byte total are kept in Redis under a per-host prefix.
+RENDER_CACHE_NODE = socket.gethostname()
+
+def _render_cache_redis_key(suffix):
+    return f'render_cache:{RENDER_CACHE_NODE}:{suffix}'
+
+def render_cache_path(cache_key, fmt):
+    return os.path.join(app.config['RENDER_CACHE_DIR'], cache_key[:2], f"{cache_key}.{fmt}")
+
+def snap_render_width(requested_width):
+    step = max(1, app.config['RENDER_WIDTH_STEP'])
+    width = int(math.ceil(requested_width / step) * step)
+    return max(app.config['RENDER_MIN_WIDTH'], min(app.config['RENDER_MAX_WIDTH'], width))
+
+def negotiate_render_format(requested_format, accept_header):
+    if requested_format:
+        requested_format = 'jpeg' if requested_format == 'jpg' else requested_format
+        return requested_format if requested_format in RENDER_CONTENT_TYPES else None
+    for fmt in ('avif', 'webp'):
+        if RENDER_CONTENT_TYPES[fmt] in (accept_header or '') and pil_features and pil_features.check(fmt):
+            return fmt
+    return 'jpeg'
+
+def _render_cache_admit(cache_key, size):
+    # Record the new entry, then evict least-recently-used entries until the cache fits its budget again.
+    # The entry just admitted is never evicted by its own admission, even if it alone exceeds the budget.
+    pipe = redis_client.pipeline()
+    pipe.zadd(_render_cache_redis_key('lru'), {cache_key: time.time()})
+    pipe.hset(_render_cache_redis_key('sizes'), cache_key, size)
+    pipe.incrby(_render_cache_redis_key('bytes'), size)
+    total_bytes = pipe.execute()[-1]
+    while total_bytes > app.config['RENDER_CACHE_MAX_BYTES']:
+        victims = redis_client.zpopmin(_render_cache_redis_key('lru'), 16)
+        if not victims:
+            break
+        victim_keys = [victim for victim, _ in victims if victim != cache_key]
+        if len(victim_keys) != len(victims):
+            redis_client.zadd(_render_cache_redis_key('lru'), {cache_key: time.time()})
+        if not victim_keys:
+            break
+        victim_sizes = redis_client.hmget(_render_cache_redis_key('sizes'), victim_keys)
+        freed = 0
+        for victim, victim_size in zip(victim_keys, victim_sizes):
+            for fmt in RENDER_CONTENT_TYPES:
+                with contextlib.suppress(FileNotFoundError): os.remove(render_cache_path(victim, fmt))
+            freed += int(victim_size or 0)
+        pipe = redis_client.pipeline()
+        pipe.hdel(_render_cache_redis_key('sizes'), *victim_keys)
+        pipe.decrby(_render_cache_redis_key('bytes'), freed)
+        total_bytes = pipe.execute()[-1]
+        app.logger.info(f"API: Render cache evicted {len(victim_keys)} entr(ies), {freed} bytes.")
+
+def _render_image_to_cache(mdata, width, fmt, cache_path):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    source_key, source_mimetype = display_source(mdata)
+    with storage.fetch(source_key) as local_path, tempfile.TemporaryDirectory(dir=app.config['SCRATCH_FOLDER']) as work_dir:
+        img = _open_derivative_source(local_path, source_mimetype, width, work_dir, fit_width=True)
+        if img.width > width:  # Never upscale.
+            img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+        if fmt == 'jpeg' and img.mode != 'RGB':
+            img = img.convert('RGB')
+        tmp_path = os.path.join(work_dir, f"render.{fmt}")
+        save_kwargs = {'quality': app.config['DERIVATIVE_QUALITY'].get(fmt, 85)} if fmt != 'png' else {'optimize': True}
+        img.save(tmp_path, format=fmt.upper(), **save_kwargs)
+        # Publish atomically so concurrent readers never see a partial file.
+        staged_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+        shutil.move(tmp_path, staged_path)
+        os.replace(staged_path, cache_path)
+    return os.path.getsize(cache_path)
+
+def _open_cached_render(cache_path):
+    # Open before returning so a concurrent eviction (unlink) cannot pull the file out from under send_file.
+    try:
+        return open(cache_path, 'rb')
+    except FileNotFoundError:
+        return None
+
+# Deletes a lock only while it still holds our token, so a holder that outlived its TTL cannot release a successor's lock.
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+def get_or_render_image(media_id, mdata, width, fmt):
+    # Returns (open cache file, cache key). Concurrent identical requests are single-flighted on a Redis lock:
+    # one renders, the rest wait for the file to appear.
+    cache_key = hashlib.sha1(f"{display_source(mdata)[0]}|{width}|{fmt}|{app.config['DERIVATIVE_QUALITY'].get(fmt, 85)}".encode('utf-8')).hexdigest()
+    cache_path = render_cache_path(cache_key, fmt)
+    lock_key = _render_cache_redis_key(f'lock:{cache_key}')
+    deadline = time.monotonic() + app.config['RENDER_LOCK_WAIT']
+    while True:
+        cached_file = _open_cached_render(cache_path)
+        if cached_file:
+            redis_client.zadd(_render_cache_redis_key('lru'), {cache_key: time.time()})
+            return cached_file, cache_key
+        lock_token = uuid.uuid4().hex
+        if redis_client.set(lock_key, lock_token, nx=True, ex=app.config['RENDER_LOCK_TTL']):
+            try:
+                cached_file = _open_cached_render(cache_path)  # Another worker may have finished between our check and the lock.
+                if not cached_file:
+                    started = time.monotonic()
+                    size = _render_image_to_cache(mdata, width, fmt, cache_path)
+                    cached_file = open(cache_path, 'rb')
+                    _render_cache_admit(cache_key, size)
+                    app.logger.info(f"API: Rendered {media_id} at w={width} as {fmt} ({size} bytes) in {time.monotonic() - started:.2f}s.")
+                return cached_file, cache_key
+            finally:
+                redis_client.register_script(RELEASE_LOCK_SCRIPT)(keys=[lock_key], args=[lock_token])
+        if time.monotonic() > deadline:
+            abort(503, description="Render in progress; retry shortly.")
+        time.sleep(0.05)
+
+def _serve_render(media_id, mdata, cache_scope):
+    if Image is None:
+        abort(503, description="Image rendering is not available on this server.")
+    if mdata.get('processing_status') != 'completed' or not mdata.get('filepath') or not is_derivative_source(mdata.get('mimetype')):
+        abort(400, description="This item cannot be rendered as an image.")
+    try:
+        requested_width = int(request.args.get('w', ''))
+    except ValueError:
+        abort(400, description="Query parameter 'w' (width in pixels) is required.")
+    if requested_width <= 0:
+        abort(400, description="Width must be positive.")
+    requested_format = request.args.get('fmt', '').lower() or None
+    fmt = negotiate_render_format(requested_format, request.headers.get('Accept', ''))
+    if not fmt or not pil_features.check({'jpeg': 'jpg', 'png': 'zlib'}.get(fmt, fmt)):
+        abort(400, description="Unsupported render format.")
+    width = snap_render_width(requested_width)
+
+    cached_file, cache_key = get_or_render_image(media_id, mdata, width, fmt)
+    response = send_file(cached_file, mimetype=RENDER_CONTENT_TYPES[fmt], conditional=True, etag=cache_key, max_age=31536000)
+    # The cache key covers the source key (never rewritten in place) and every render parameter.
+    response.headers['Cache-Control'] = f"{cache_scope}, max-age=31536000, immutable"
+    if not requested_format:
+        response.headers.add('Vary', 'Accept')
+    return response
+
+# --- Storage Accounting ---
+# 'usage:user:<username>' and 'usage:batch:<batch_id>' hashes hold running 'bytes' and 'items' totals, and each media
+# hash keeps 'stored_bytes' (its file plus renditions) so removal can subtract exactly what was added. Usage is
+# attributed to the item's uploader. 'flask reconcile-usage' rebuilds everything from storage if counters drift.
+def queue_usage_delta(redis_pipe, user_id, batch_id, bytes_delta, items_delta=0):
+    for usage_key in ([f'usage:user:{user_id}'] if user_id else []) + ([f'usage:batch:{batch_id}'] if batch_id else []):
+        if bytes_delta: redis_pipe.hincrby(usage_key, 'bytes', bytes_delta)
+        if items_delta: redis_pipe.hincrby(usage_key, 'items', items_delta)
+
+def queue_media_removal_usage(redis_pipe, mdata):
+    queue_usage_delta(redis_pipe, mdata.get('uploader_user_id'), mdata.get('batch_id'), -int(mdata.get('stored_bytes') or 0), -1)
+
+MEDIA_BYTES_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+redis.call('HINCRBY', KEYS[1], 'stored_bytes', ARGV[1])
+for i = 2, #KEYS do redis.call('HINCRBY', KEYS[i], 'bytes', ARGV[1]) end
+return 1
+"""
+
+def record_media_bytes(r_client, media_id, mdata, bytes_delta):
+    # Renditions written (or inputs removed) after the item was recorded. Atomically a no-op if the item has been
+    # deleted meanwhile: its removal already subtracted stored_bytes, so charging the owner now would never be undone.
+    if not bytes_delta: return
+    usage_keys = ([f"usage:user:{mdata['uploader_user_id']}"] if mdata.get('uploader_user_id') else []) + ([f"usage:batch:{mdata['batch_id']}"] if mdata.get('batch_id') else [])
+    r_client.register_script(MEDIA_BYTES_SCRIPT)(keys=[f'media:{media_id}', *usage_keys], args=[bytes_delta])
+
+# Each rendition task records the total size of what it wrote in its own field, so a rerun (--force, retry) that
+# rewrites the same keys charges only the difference. Reconciliation drops these fields on items it corrects.
+RENDITION_BYTES_FIELDS = ('derivatives_bytes', 'video_previews_bytes', 'hls_bytes', 'display_bytes')
+
+def previous_rendition_bytes(mdata, bytes_field, keys=(), prefix=None):
+    # Bytes this rendition group already contributes to stored_bytes. Call before overwriting anything: items
+    # recorded before per-group fields existed are measured from the keys (or prefix) the hash references.
+    if mdata.get(bytes_field) is not None: return int(mdata[bytes_field] or 0)
+    total = sum((storage.stat(key) or (0,))[0] for key in keys if key)
+    if prefix: total += sum(size for _, size, _ in storage.iter_keys(prefix))
+    return total
+
+def read_usage(usage_key, r_client=None):
+    used_bytes, items = (r_client or redis_client).hmget(usage_key, ['bytes', 'items'])
+    return {'bytes': int(used_bytes or 0), 'items': int(items or 0)}
+
+def user_quota_bytes(username, user_quota_field=None):
+    # Per-user override ('quota_bytes' on the user hash, '0' = unlimited) or the USER_QUOTA_BYTES default.
+    if user_quota_field is None: user_quota_field = redis_client.hget(f'user:{username}', 'quota_bytes')
+    return int(user_quota_field) if user_quota_field not in (None, '') else app.config['USER_QUOTA_BYTES']
+
+def check_upload_quota(username, incoming_bytes):
+    # Returns an error response if incoming_bytes would take the user past their quota, else None.
+    quota_field, used_bytes = redis_client.pipeline(transaction=False).hget(f'user:{username}', 'quota_bytes').hget(f'usage:user:{username}', 'bytes').execute()
+    quota = user_quota_bytes(username, quota_field)
+    if quota and int(used_bytes or 0) + (incoming_bytes or 0) > quota:
+        app.logger.warning(f"API: Upload by '{username}' rejected: {int(used_bytes or 0)} + {incoming_bytes} bytes exceeds quota {quota}.")
+        return jsonify(success=False, message="Storage quota exceeded.", used_bytes=int(used_bytes or 0), quota_bytes=quota), 413
+    return None
+
+def storage_bytes_for(mdata):
+    # What an item actually occupies in storage now; used by reconciliation. Keys whose file is gone count as 0.
+    total = sum((storage.stat(key) or (0,))[0] for key in media_storage_keys(mdata))
+    if mdata.get('hls_prefix'): total += sum(size for _, size, _ in storage.iter_keys(mdata['hls_prefix']))
+    return total
+
+# --- Batch Event Stream ---
+# Status transitions and progress for a batch's items are appended to a capped Redis stream, 'batch_events:<batch_id>'.
+# Stream IDs double as SSE event IDs, so a reconnecting client resumes exactly where it left off.
+def queue_media_event(redis_pipe, batch_id, media_id, kind, **fields):
+    stream_key = f'batch_events:{batch_id}'
+    event = {'media_id': media_id, 'kind': kind, 'ts': f"{time.time():.3f}", **{k: str(v) for k, v in fields.items() if v is not None}}
+    redis_pipe.xadd(stream_key, event, maxlen=app.config['BATCH_EVENTS_MAXLEN'], approximate=True)
+    redis_pipe.expire(stream_key, app.config['BATCH_EVENTS_TTL'])
+
+def publish_media_event(r_client, batch_id, media_id, kind, **fields):
+    # Best effort: a lost event only costs the client a refresh, so it must never fail the caller.
+    if not batch_id:
+        return
+    try:
+        redis_pipe = r_client.pipeline(transaction=False)
+        queue_media_event(redis_pipe, batch_id, media_id, kind, **fields)
+        redis_pipe.execute()
+    except redis.exceptions.RedisError as e:
+        app.logger.warning(f"Could not publish {kind} event for media {media_id} in batch {batch_id}: {e}")
+
+def latest_batch_event_id(batch_id):
+    latest = redis_client.xrevrange(f'batch_events:{batch_id}', count=1)
+    return latest[0][0] if latest else '0-0'
+
+def _stream_id_tuple(stream_id):
+    ms, _, seq = stream_id.partition('-')
+    return int(ms), int(seq or 0)
+
+# HSET only if the hash still exists, so a task finishing after its item was deleted cannot recreate it.
+SET_IF_EXISTS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+redis.call('HSET', KEYS[1], unpack(ARGV))
+return 1
+"""
+
+def set_media_status(r_client, media_id, batch_id, status_update):
+    # Task-side status transition plus its status event. Returns False (and publishes nothing) if the item is gone.
+    args = [str(v) for kv in status_update.items() for v in kv]
+    if not r_client.register_script(SET_IF_EXISTS_SCRIPT)(keys=[f'media:{media_id}'], args=args): return False
+    if batch_id:
+        publish_media_event(r_client, batch_id, media_id, 'status', status=status_update.get('processing_status'), error=status_update.get('error_message') or None)
+    return True
+
+# --- Bulk Media Scripts ---
+# Each script re-checks that an item still exists in the batch it was authorized in, so a concurrent delete or
+# move between the authorization read and the write is skipped rather than resurrected. Returns 1/0 per item.
+BULK_SET_FIELD_SCRIPT = """
+local applied = {}
+for i, key in ipairs(KEYS) do
+  if redis.call('HGET', key, 'batch_id') == ARGV[i + 2] then
+    redis.call('HSET', key, ARGV[1], ARGV[2]); applied[i] = 1
+  else applied[i] = 0 end
+end
+return applied
+"""
+BULK_DELETE_SCRIPT = """
+local applied = {}
+for i, key in ipairs(KEYS) do
+  local batch_id, media_id, tracker = ARGV[3 * i - 2], ARGV[3 * i - 1], ARGV[3 * i]
+  if redis.call('HGET', key, 'batch_id') == batch_id then
+    redis.call('LREM', 'batch:' .. batch_id .. ':media_ids', 0, media_id)
+    redis.call('DEL', key)
+    if tracker ~= '' then redis.call('DEL', tracker) end
+    applied[i] = 1
+  else applied[i] = 0 end
+end
+return applied
+"""
+BULK_MOVE_SCRIPT = """
+local target = ARGV[1]
+local applied = {}
+for i, key in ipairs(KEYS) do
+  local batch_id, media_id = ARGV[2 * i], ARGV[2 * i + 1]
+  if redis.call('HGET', key, 'batch_id') == batch_id and redis.call('EXISTS', 'batch:' .. target) == 1 then
+    redis.call('LREM', 'batch:' .. batch_id .. ':media_ids', 0, media_id)
+    redis.call('RPUSH', 'batch:' .. target .. ':media_ids', media_id)
+    redis.call('HSET', key, 'batch_id', target)
+    applied[i] = 1
+  else applied[i] = 0 end
+end
+return applied
+"""
+
+# --- User Index ---
+# 'users' (set) stays the membership source of truth; 'users_index' is a sorted set of '<lowercased>\x00<username>'
+# members, all with score 0, so ZRANGEBYLEX gives case-insensitive ordering, prefix search and cursor pagination.
+USERS_INDEX_KEY = 'users_index'
+USERS_INDEX_MAX = '\U0010ffff'  # Sorts after every UTF-8 encoded character, closing prefix ranges.
+
+def user_index_member(username):
+    return f"{username.lower()}\x00{username}"
+
+def queue_user_index_add(redis_pipe, username):
+    redis_pipe.zadd(USERS_INDEX_KEY, {user_index_member(username): 0})
+
+def backfill_user_index(r_client):
+    # Indexes users created before the index existed (or by tools that only touch 'users'). Idempotent.
+    added = 0; redis_pipe = r_client.pipeline(transaction=False)
+    for username in r_client.sscan_iter('users', count=1000):
+        queue_user_index_add(redis_pipe, username); added += 1
+        if added % 1000 == 0: redis_pipe.execute()
+    redis_pipe.execute()
+    return added
 
 # --- Initial Admin User Setup ---
-if redis_client:
-    try:
-        if not redis_client.sismember('users', 'admin'):
-            admin_password = os.environ.get('LIGHTBOX_ADMIN_PASSWORD', 'ChangeThisDefaultAdminPassw0rd!')
-            if admin_password == 'ChangeThisDefaultAdminPassw0rd!':
-                 app.logger.warning("SECURITY WARNING: Using default admin password 'ChangeThisDefaultAdminPassw0rd!'. Change it immediately in .env or via admin panel.")
-            redis_client.sadd('users', 'admin')
-            redis_client.hset('user:admin', mapping={'password_hash': generate_password_hash(admin_password), 'is_admin': '1'})
-            app.logger.info("Admin user 'admin' created/verified.")
-    except redis.exceptions.RedisError as e: app.logger.error(f"Redis error during admin user setup: {e}.")
-else: app.logger.warning("Redis not connected during startup. Admin user setup skipped.")
+# Deferred to the first request (or `flask bootstrap`) so importing the module never touches Redis.
+_bootstrap_state = {'done': False, 'last_attempt': 0.0}
+_bootstrap_lock = threading.Lock()
+
+def bootstrap_app_data(r_client):
+    if not r_client.sismember('users', 'admin'):
+        admin_password = os.environ.get('LIGHTBOX_ADMIN_PASSWORD', 'ChangeThisDefaultAdminPassw0rd!')
+        if admin_password == 'ChangeThisDefaultAdminPassw0rd!':
+             app.logger.warning("SECURITY WARNING: Using default admin password 'ChangeThisDefaultAdminPassw0rd!'. Change it immediately in .env or via admin panel.")
+        redis_pipe = r_client.pipeline()
+        redis_pipe.sadd('users', 'admin')
+        redis_pipe.hset('user:admin', mapping={'password_hash': generate_password_hash(admin_password), 'is_admin': '1'})
+        queue_user_index_add(redis_pipe, 'admin')
+        redis_pipe.execute()
+        app.logger.info("Admin user 'admin' created/verified.")
+    if r_client.zcard(USERS_INDEX_KEY) < r_client.scard('users'):
+        app.logger.info(f"User index backfilled: {backfill_user_index(r_client)} user(s).")
+
+@app.before_request
+def ensure_bootstrapped():
+    # Once per process; a failure (Redis down) is retried on a later request, at most every BOOTSTRAP_RETRY_SECONDS.
+    if _bootstrap_state['done'] or time.monotonic() - _bootstrap_state['last_attempt'] < app.config['BOOTSTRAP_RETRY_SECONDS']: return
+    if not _bootstrap_lock.acquire(blocking=False): return
+    try:
+        if _bootstrap_state['done']: return
+        _bootstrap_state['last_attempt'] = time.monotonic()
+        bootstrap_app_data(redis_client)
+        _bootstrap_state['done'] = True
+    except redis.exceptions.RedisError as e: app.logger.error(f"Redis error during admin user setup (will retry): {e}.")
+    finally: _bootstrap_lock.release()
 
 # --- API Prefix ---
 API_PREFIX = '/api/v1'
@@ -337,7 +1561,7 @@ def owner_or_admin_access_required_api(item_type='batch'):
                 app.logger.error(f"API: Redis error fetching '{item_data_key}': {e}")
                 return jsonify(success=False, message="Database error during ownership check."), 500
             
-            if not item_data:
+            if not item_data or (item_type == 'batch' and item_data.get('deleting') == '1'):
                 app.logger.warning(f"API: {item_type.capitalize()} '{item_id_to_check_str}' not found.")
                 return jsonify(success=False, message=f"{item_type.capitalize()} not found."), 404
 
@@ -358,95 +1582,322 @@ def owner_or_admin_access_required_api(item_type='batch'):
         return decorated_function
     return decorator
 
+# --- Rate Limiting ---
+# Checks every policy of a request in one EVALSHA. A request is admitted only if all buckets hold `cost` tokens, and
+# then takes them from all of them; a denied request takes nothing. Clock is Redis TIME, so all web nodes agree.
+TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local cost = tonumber(ARGV[1])
+local levels = {}
+local allowed = 1
+for i, key in ipairs(KEYS) do
+    local rate, burst = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local elapsed = math.max(0, now - (tonumber(state[2]) or now))
+    levels[i] = math.min(burst, tokens + elapsed * rate)
+    if levels[i] < cost then allowed = 0 end
+end
+local results = {}
+for i, key in ipairs(KEYS) do
+    local rate, burst = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+    local tokens = levels[i]
+    if allowed == 1 then tokens = tokens - cost end
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', now)
+    local full_in = math.ceil((burst - tokens) / rate)
+    redis.call('PEXPIRE', key, full_in + 1000)
+    local retry_in = 0
+    if tokens < cost then retry_in = math.ceil((cost - tokens) / rate) end
+    results[i] = {math.floor(tokens), retry_in, full_in}
+end
+return {allowed, results}
+"""
+
+RATE_LIMIT_SUBJECTS = {  # Policy -> what it is keyed on.
+    'login_ip': 'ip', 'login_user': 'login_username', 'register_ip': 'ip', 'public_ip': 'ip',
+    'public_token': 'share_token', 'upload_user': 'user', 'upload_chunk_user': 'user',
+}
+
+def parse_rate_limit(spec):
+    # 'count/seconds[:burst]' -> (tokens per millisecond, burst).
+    rate_part, _, burst = spec.partition(':')
+    count, seconds = (float(x) for x in rate_part.split('/'))
+    return count / (seconds * 1000), float(burst or count)
+
+RATE_LIMIT_POLICIES = {name: parse_rate_limit(spec) for name, spec in app.config['RATE_LIMITS'].items()}
+
+def client_ip(remote_addr, forwarded_for):
+    # With N trusted proxies, the client is the Nth address from the right of X-Forwarded-For.
+    hops = [h.strip() for h in (forwarded_for or '').split(',') if h.strip()]
+    trusted = app.config['RATE_LIMIT_TRUSTED_PROXIES']
+    return hops[-trusted] if trusted and len(hops) >= trusted else (remote_addr or 'unknown')
+
+def rate_limit_request(checks, cost=1):
+    # checks: [(policy, subject)] -> (keys, args) for TOKEN_BUCKET_SCRIPT.
+    keys = [f'ratelimit:{policy}:{subject}' for policy, subject in checks]
+    args = [cost] + [v for policy, _ in checks for v in RATE_LIMIT_POLICIES[policy]]
+    return keys, args
+
+def rate_limit_outcome(checks, reply):
+    # Script reply -> (allowed, headers). The headers describe the tightest bucket; Retry-After the longest wait.
+    allowed, results = reply
+    (policy, _), (remaining, retry_ms, full_ms) = min(zip(checks, results), key=lambda pair: pair[1][0])
+    headers = {'X-RateLimit-Limit': str(int(RATE_LIMIT_POLICIES[policy][1])), 'X-RateLimit-Remaining': str(max(0, remaining)),
+               'X-RateLimit-Reset': str(math.ceil(full_ms / 1000)), 'X-RateLimit-Policy': policy}
+    if not allowed: headers['Retry-After'] = str(max(1, math.ceil(max(r[1] for r in results) / 1000)))
+    return bool(allowed), headers
+
+def check_rate_limits(checks, cost=1):
+    # Fails open: a Redis problem must not lock everyone out of login.
+    if not checks or not app.config['RATE_LIMIT_ENABLED']: return True, {}
+    keys, args = rate_limit_request(checks, cost)
+    try: reply = redis_client.register_script(TOKEN_BUCKET_SCRIPT)(keys=keys, args=args)
+    except redis.exceptions.RedisError as e:
+        app.logger.warning(f"API: Rate limit check skipped (Redis error): {e}")
+        return True, {}
+    return rate_limit_outcome(checks, reply)
+
+def _rate_limit_subject(kind):
+    if kind == 'ip': return client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'))
+    if kind == 'user': return getattr(request, 'current_identity', None)
+    if kind == 'share_token': return (request.view_args or {}).get('share_token')
+    if kind == 'login_username': return ((request.get_json(silent=True) or {}).get('username') or '').strip().lower()[:128] or None
+    return None
+
+class RateLimitExceeded(TooManyRequests):
+    def __init__(self, headers):
+        super().__init__(description="Too many requests. Please slow down and try again later.")
+        self.headers = headers
+
+def rate_limited(*policies):
+    # Apply below login_required_api when a policy is keyed on the user. Rate-limit headers are added to every
+    # response of the endpoint; over the limit it raises a 429 with Retry-After.
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method == 'OPTIONS': return f(*args, **kwargs)
+            checks = [(policy, subject) for policy in policies if (subject := _rate_limit_subject(RATE_LIMIT_SUBJECTS[policy]))]
+            allowed, headers = check_rate_limits(checks)
+            if not allowed:
+                app.logger.warning(f"API: Rate limit '{headers.get('X-RateLimit-Policy')}' exceeded on {request.path} from {client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'))}.")
+                raise RateLimitExceeded(headers)
+            g.rate_limit_headers = headers
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+@app.after_request
+def add_rate_limit_headers(response):
+    for name, value in g.get('rate_limit_headers', {}).items(): response.headers.setdefault(name, value)
+    return response
+
+# --- FFmpeg Command Builders (shared by the Celery tasks and benchmarks) ---
+def build_video_mp4_command(config, input_path, output_path):
+    return [config.get('FFMPEG_PATH', 'ffmpeg'), '-hide_banner', '-loglevel', 'error', '-i', input_path,
+            '-c:v', config.get('VIDEO_MP4_VIDEO_CODEC'), '-preset', config.get('VIDEO_MP4_VIDEO_PRESET'), '-crf', config.get('VIDEO_MP4_VIDEO_CRF'),
+            '-c:a', config.get('VIDEO_MP4_AUDIO_CODEC'), '-b:a', config.get('VIDEO_MP4_AUDIO_BITRATE'),
+            '-movflags', '+faststart', '-f', 'mp4', '-y', output_path]
+
+def build_audio_mp3_command(config, input_path, output_path):
+    ffmpeg_command = [config.get('FFMPEG_PATH', 'ffmpeg'), '-hide_banner', '-loglevel', 'error', '-i', input_path, '-c:a', config.get('AUDIO_MP3_ENCODER')]
+    ffmpeg_command.extend(config.get('AUDIO_MP3_OPTIONS'))
+    if config.get('AUDIO_MP3_SAMPLE_RATE'): ffmpeg_command.extend(['-ar', config.get('AUDIO_MP3_SAMPLE_RATE')])
+    ffmpeg_command.extend(['-f', 'mp3', '-y', output_path])
+    return ffmpeg_command
+
+def hls_ladder_for(config, source_height):
+    # Rungs at or below the source height; a source smaller than every rung still gets one rendition at its own height.
+    rungs = sorted(((int(h), vb, ab) for h, vb, ab in config['HLS_LADDER']), reverse=True)
+    fitting = [r for r in rungs if r[0] <= source_height]
+    return fitting or [(source_height - source_height % 2, rungs[-1][1], rungs[-1][2])]
+
+def build_hls_command(config, input_path, output_dir, rungs, has_audio):
+    # One decode, split into every rung. Forced keyframes on segment boundaries keep renditions switchable.
+    n = len(rungs); seg = config['HLS_SEGMENT_SECONDS']
+    filter_graph = f"[0:v]split={n}" + ''.join(f"[s{i}]" for i in range(n)) + ';' + ';'.join(f"[s{i}]scale=-2:{h}[v{i}]" for i, (h, _, _) in enumerate(rungs))
+    command = [config.get('FFMPEG_PATH', 'ffmpeg'), '-hide_banner', '-loglevel', 'error', '-i', input_path, '-filter_complex', filter_graph]
+    for i, (_, v_bitrate, a_bitrate) in enumerate(rungs):
+        v_kbps = int(v_bitrate.rstrip('kK'))
+        command += ['-map', f'[v{i}]', f'-c:v:{i}', 'libx264', f'-b:v:{i}', v_bitrate, f'-maxrate:v:{i}', f'{int(v_kbps * 1.07)}k', f'-bufsize:v:{i}', f'{int(v_kbps * 1.5)}k']
+        if has_audio:
+            command += ['-map', 'a:0', f'-c:a:{i}', 'aac', f'-b:a:{i}', a_bitrate, '-ac', '2']
+    command += ['-preset', config['HLS_VIDEO_PRESET'], '-pix_fmt', 'yuv420p', '-sc_threshold', '0', '-force_key_frames', f"expr:gte(t,n_forced*{seg})",
+                '-f', 'hls', '-hls_time', str(seg), '-hls_playlist_type', 'vod', '-hls_flags', 'independent_segments',
+                '-hls_segment_filename', os.path.join(output_dir, 'v%v', 'seg_%05d.ts'), '-master_pl_name', 'master.m3u8',
+                '-var_stream_map', ' '.join(f"v:{i},a:{i}" if has_audio else f"v:{i}" for i in range(n)),
+                '-y', os.path.join(output_dir, 'v%v', 'index.m3u8')]
+    return command
+
+def run_ffmpeg_with_progress(command, duration, on_progress, timeout):
+    # subprocess.run(check=True, capture_output=True, text=True, timeout=...) semantics, plus percent-complete
+    # callbacks parsed from ffmpeg's machine-readable '-progress' output. on_progress is throttled by the caller.
+    command = [command[0], '-progress', 'pipe:1', '-nostats', *command[1:]]
+    timed_out = threading.Event()
+    with tempfile.TemporaryFile(mode='w+') as stderr_file:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file, text=True)
+        def kill_on_timeout():
+            timed_out.set(); proc.kill()
+        watchdog = threading.Timer(timeout, kill_on_timeout); watchdog.start()
+        try:
+            for line in proc.stdout:
+                key, _, value = line.strip().partition('=')
+                # Despite the name, out_time_ms is reported in microseconds (as is out_time_us).
+                if key in ('out_time_us', 'out_time_ms') and duration > 0 and value.isdigit():
+                    on_progress(min(99, int(int(value) / 1e6 / duration * 100)))
+            returncode = proc.wait()
+        finally:
+            watchdog.cancel()
+        stderr_file.seek(0); stderr_text = stderr_file.read()
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(command, timeout, stderr=stderr_text)
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, command, stderr=stderr_text)
+
+def progress_reporter(r_client, media_id, batch_id):
+    # Returns an on_progress callback that records progress on the media hash and the batch stream,
+    # at most once per PROGRESS_EVENT_INTERVAL and only when the percentage moves.
+    state = {'pct': -1, 'at': 0.0}
+    def report(pct):
+        now = time.monotonic()
+        if pct <= state['pct'] or now - state['at'] < app.config['PROGRESS_EVENT_INTERVAL']:
+            return
+        state.update(pct=pct, at=now)
+        try:
+            redis_pipe = r_client.pipeline(transaction=False)
+            redis_pipe.hset(f'media:{media_id}', 'progress', pct)
+            queue_media_event(redis_pipe, batch_id, media_id, 'progress', progress=pct)
+            redis_pipe.execute()
+        except redis.exceptions.RedisError as e:
+            app.logger.warning(f"Could not record progress for media {media_id}: {e}")
+    return report
+
+def probe_duration(config, local_path):
+    try:
+        return probe_video(config, local_path)['duration']
+    except (subprocess.SubprocessError, OSError, ValueError):
+        return 0.0
+
 # --- Celery Tasks ---
 @celery.task(bind=True, name='api_app.convert_video_to_mp4_task', max_retries=3, default_retry_delay=120)
-def convert_video_to_mp4_task(self, original_video_temp_path, target_mp4_disk_path, media_id_for_update, batch_id_for_update, original_filename_for_log, disk_path_segment_for_batch, uploader_username_for_log):
+def convert_video_to_mp4_task(self, original_video_input_key, target_mp4_storage_key, media_id_for_update, batch_id_for_update, original_filename_for_log, disk_path_segment_for_batch, uploader_username_for_log):
     task_id = self.request.id; logger = current_app.logger
     logger.info(f"[VideoTask {task_id}] User:{uploader_username_for_log} Video->MP4: {original_filename_for_log} (MediaID:{media_id_for_update})")
-    ffmpeg_path = current_app.config.get('FFMPEG_PATH', 'ffmpeg')
-    vid_codec = current_app.config.get('VIDEO_MP4_VIDEO_CODEC'); vid_preset = current_app.config.get('VIDEO_MP4_VIDEO_PRESET')
-    vid_crf = current_app.config.get('VIDEO_MP4_VIDEO_CRF'); aud_codec = current_app.config.get('VIDEO_MP4_AUDIO_CODEC')
-    aud_bitrate = current_app.config.get('VIDEO_MP4_AUDIO_BITRATE')
-    ffmpeg_command = [ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-i', original_video_temp_path, '-c:v', vid_codec, '-preset', vid_preset, '-crf', vid_crf, '-c:a', aud_codec, '-b:a', aud_bitrate, '-movflags', '+faststart', '-f', 'mp4', '-y', target_mp4_disk_path]
-    status_update = {'processing_status': 'failed', 'error_message': 'Unknown video conversion error.'}
-    try:
-        logger.info(f"[VideoTask {task_id}] Executing: {' '.join(ffmpeg_command)}")
-        subprocess.run(ffmpeg_command, check=True, capture_output=True, text=True, timeout=10800)
+    status_update = {'processing_status': 'failed', 'error_message': 'Unknown video conversion error.'}; remove_input = True
+    r_client = get_app_data_redis_client()
+    input_bytes = int(r_client.hget(f'media:{media_id_for_update}', 'file_size') or 0); output_bytes = 0
+    item_exists = True
+    try:
+        if not set_media_status(r_client, media_id_for_update, batch_id_for_update, {'processing_status': 'processing', 'progress': 0}):
+            item_exists = False; logger.info(f"[VideoTask {task_id}] MediaID {media_id_for_update} was deleted before conversion; skipping.")
+            return {'status': 'skipped', 'media_id': media_id_for_update}
+        with storage.fetch(original_video_input_key) as input_local_path, storage.produce(target_mp4_storage_key) as output_local_path:
+            ffmpeg_command = build_video_mp4_command(current_app.config, input_local_path, output_local_path)
+            logger.info(f"[VideoTask {task_id}] Executing: {' '.join(ffmpeg_command)}")
+            on_progress = progress_reporter(r_client, media_id_for_update, batch_id_for_update)
+            media_seconds = probe_duration(current_app.config, input_local_path)
+            note_task_run(self, input_bytes=input_bytes, media_seconds=media_seconds)
+            run_ffmpeg_with_progress(ffmpeg_command, media_seconds, on_progress, timeout=10800)
         logger.info(f"[VideoTask {task_id}] Success: {original_filename_for_log}")
-        final_name = os.path.basename(target_mp4_disk_path)
-        final_rpath = os.path.join(disk_path_segment_for_batch, final_name)
-        status_update = {'filename_on_disk': final_name, 'filepath': final_rpath, 'mimetype': 'video/mp4', 'processing_status': 'completed', 'error_message': ''}
-        get_app_data_redis_client().hmset(f'media:{media_id_for_update}', status_update)
+        final_name = target_mp4_storage_key.rsplit('/', 1)[-1]
+        final_rpath = target_mp4_storage_key
+        output_bytes = storage.size(target_mp4_storage_key) or 0; note_task_run(self, output_bytes=output_bytes)
+        status_update = {'filename_on_disk': final_name, 'filepath': final_rpath, 'mimetype': 'video/mp4', 'processing_status': 'completed', 'error_message': '', 'progress': 100, 'file_size': output_bytes}
+        if not set_media_status(r_client, media_id_for_update, batch_id_for_update, status_update):
+            item_exists = False; storage.delete(target_mp4_storage_key)
+            logger.info(f"[VideoTask {task_id}] MediaID {media_id_for_update} was deleted during conversion; output discarded.")
+            return {'status': 'skipped', 'media_id': media_id_for_update}
         logger.info(f"[VideoTask {task_id}] Redis updated for MediaID {media_id_for_update}.")
-        return {'status': 'success', 'output_path': target_mp4_disk_path, 'media_id': media_id_for_update}
+        for followup_task in followup_tasks_for('video/mp4'):
+            try: followup_task.apply_async(args=[media_id_for_update])
+            except Exception as e_enqueue: logger.error(f"[VideoTask {task_id}] Could not queue {followup_task.name}: {e_enqueue}")
+        return {'status': 'success', 'output_path': target_mp4_storage_key, 'media_id': media_id_for_update}
     except subprocess.CalledProcessError as e:
         err_out = e.stderr.strip() if e.stderr else "No stderr."; logger.error(f"[VideoTask {task_id}] FAILED (rc {e.returncode}): {original_filename_for_log}. Error: {err_out}")
         status_update.update({'error_message': f'Video conv. error (rc {e.returncode}): {err_out[:200]}'})
-        if self.request.retries < self.max_retries: logger.info(f"[VideoTask {task_id}] Retrying ({self.request.retries + 1}/{self.max_retries})"); raise self.retry(exc=e, countdown=int(self.default_retry_delay * (2**self.request.retries)))
+        if self.request.retries < self.max_retries: logger.info(f"[VideoTask {task_id}] Retrying ({self.request.retries + 1}/{self.max_retries})"); remove_input = False; status_update['processing_status'] = 'queued'; raise self.retry(exc=e, countdown=int(self.default_retry_delay * (2**self.request.retries)))
         raise
     except subprocess.TimeoutExpired as e:
         logger.error(f"[VideoTask {task_id}] TIMEOUT: {original_filename_for_log}"); status_update.update({'error_message': 'Video conversion timeout.'})
-        if self.request.retries < self.max_retries: logger.info(f"[VideoTask {task_id}] Retrying ({self.request.retries + 1}/{self.max_retries})"); raise self.retry(exc=e, countdown=int(self.default_retry_delay * (2**self.request.retries)))
+        if self.request.retries < self.max_retries: logger.info(f"[VideoTask {task_id}] Retrying ({self.request.retries + 1}/{self.max_retries})"); remove_input = False; status_update['processing_status'] = 'queued'; raise self.retry(exc=e, countdown=int(self.default_retry_delay * (2**self.request.retries)))
         raise
     except Exception as e:
         logger.error(f"[VideoTask {task_id}] Unexpected error: {e}", exc_info=True); status_update.update({'error_message': f'Unexpected error: {str(e)[:100]}'}); raise
     finally:
-        r_client = get_app_data_redis_client()
         try:
-            if r_client.hget(f'media:{media_id_for_update}', 'processing_status') not in ['completed', 'completed_import']:
-                r_client.hmset(f'media:{media_id_for_update}', status_update)
+            if item_exists and r_client.hget(f'media:{media_id_for_update}', 'processing_status') not in ['completed', 'completed_import']:
+                item_exists = set_media_status(r_client, media_id_for_update, batch_id_for_update, status_update)
             logger.info(f"[VideoTask {task_id}] Final Redis status for MediaID {media_id_for_update}: {status_update.get('processing_status', 'N/A')}")
         except Exception as e_redis: logger.error(f"[VideoTask {task_id}] CRITICAL: Failed Redis update in finally: {e_redis}")
-        if os.path.exists(original_video_temp_path):
-            try: os.remove(original_video_temp_path); logger.info(f"[VideoTask {task_id}] Cleaned temp: {original_video_temp_path}")
-            except OSError as e_rm: logger.error(f"[VideoTask {task_id}] Error removing temp: {e_rm}")
+        if remove_input:
+            try: storage.delete(original_video_input_key); logger.info(f"[VideoTask {task_id}] Cleaned temp: {original_video_input_key}")
+            except Exception as e_rm: logger.error(f"[VideoTask {task_id}] Error removing temp: {e_rm}")
+            try:
+                # The input's bytes are replaced by the output's (or by nothing, on final failure). A deleted item's
+                # removal already released its bytes.
+                if item_exists:
+                    record_media_bytes(r_client, media_id_for_update, {'uploader_user_id': uploader_username_for_log, 'batch_id': batch_id_for_update}, output_bytes - input_bytes)
+            except Exception as e_usage: logger.error(f"[VideoTask {task_id}] Could not update storage usage: {e_usage}")
 
 @celery.task(bind=True, name='api_app.transcode_audio_to_mp3_task', max_retries=3, default_retry_delay=60)
-def transcode_audio_to_mp3_task(self, original_audio_temp_path, target_mp3_disk_path, media_id_for_update, batch_id_for_update, original_filename_for_log, disk_path_segment_for_batch, uploader_username_for_log):
+def transcode_audio_to_mp3_task(self, original_audio_input_key, target_mp3_storage_key, media_id_for_update, batch_id_for_update, original_filename_for_log, disk_path_segment_for_batch, uploader_username_for_log):
     task_id = self.request.id; logger = current_app.logger
     logger.info(f"[AudioTask {task_id}] User:{uploader_username_for_log} Audio->MP3: {original_filename_for_log} (MediaID:{media_id_for_update})")
-    ffmpeg_path = current_app.config.get('FFMPEG_PATH', 'ffmpeg')
-    mp3_encoder = current_app.config.get('AUDIO_MP3_ENCODER'); mp3_options = current_app.config.get('AUDIO_MP3_OPTIONS')
-    mp3_sample_rate = current_app.config.get('AUDIO_MP3_SAMPLE_RATE')
-    ffmpeg_command = [ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-i', original_audio_temp_path, '-c:a', mp3_encoder]
-    ffmpeg_command.extend(mp3_options)
-    if mp3_sample_rate: ffmpeg_command.extend(['-ar', mp3_sample_rate])
-    ffmpeg_command.extend(['-f', 'mp3', '-y', target_mp3_disk_path])
-    status_update = {'processing_status': 'failed', 'error_message': 'Unknown audio to MP3 error.'}
-    try:
-        logger.info(f"[AudioTask {task_id}] Executing: {' '.join(ffmpeg_command)}")
-        subprocess.run(ffmpeg_command, check=True, capture_output=True, text=True, timeout=3600)
+    status_update = {'processing_status': 'failed', 'error_message': 'Unknown audio to MP3 error.'}; remove_input = True
+    r_client = get_app_data_redis_client()
+    input_bytes = int(r_client.hget(f'media:{media_id_for_update}', 'file_size') or 0); output_bytes = 0
+    item_exists = True
+    try:
+        if not set_media_status(r_client, media_id_for_update, batch_id_for_update, {'processing_status': 'processing', 'progress': 0}):
+            item_exists = False; logger.info(f"[AudioTask {task_id}] MediaID {media_id_for_update} was deleted before conversion; skipping.")
+            return {'status': 'skipped', 'media_id': media_id_for_update}
+        with storage.fetch(original_audio_input_key) as input_local_path, storage.produce(target_mp3_storage_key) as output_local_path:
+            ffmpeg_command = build_audio_mp3_command(current_app.config, input_local_path, output_local_path)
+            logger.info(f"[AudioTask {task_id}] Executing: {' '.join(ffmpeg_command)}")
+            on_progress = progress_reporter(r_client, media_id_for_update, batch_id_for_update)
+            media_seconds = probe_duration(current_app.config, input_local_path)
+            note_task_run(self, input_bytes=input_bytes, media_seconds=media_seconds)
+            run_ffmpeg_with_progress(ffmpeg_command, media_seconds, on_progress, timeout=3600)
         logger.info(f"[AudioTask {task_id}] Success: {original_filename_for_log}")
-        final_name = os.path.basename(target_mp3_disk_path)
-        final_rpath = os.path.join(disk_path_segment_for_batch, final_name)
-        status_update = {'filename_on_disk': final_name, 'filepath': final_rpath, 'mimetype': 'audio/mpeg', 'processing_status': 'completed', 'error_message': ''}
-        get_app_data_redis_client().hmset(f'media:{media_id_for_update}', status_update)
+        final_name = target_mp3_storage_key.rsplit('/', 1)[-1]
+        final_rpath = target_mp3_storage_key
+        output_bytes = storage.size(target_mp3_storage_key) or 0; note_task_run(self, output_bytes=output_bytes)
+        status_update = {'filename_on_disk': final_name, 'filepath': final_rpath, 'mimetype': 'audio/mpeg', 'processing_status': 'completed', 'error_message': '', 'progress': 100, 'file_size': output_bytes}
+        if not set_media_status(r_client, media_id_for_update, batch_id_for_update, status_update):
+            item_exists = False; storage.delete(target_mp3_storage_key)
+            logger.info(f"[AudioTask {task_id}] MediaID {media_id_for_update} was deleted during conversion; output discarded.")
+            return {'status': 'skipped', 'media_id': media_id_for_update}
         logger.info(f"[AudioTask {task_id}] Redis updated for MediaID {media_id_for_update}.")
-        return {'status': 'success', 'output_path': target_mp3_disk_path, 'media_id': media_id_for_update}
+        return {'status': 'success', 'output_path': target_mp3_storage_key, 'media_id': media_id_for_update}
     except subprocess.CalledProcessError as e:
         err_out = e.stderr.strip() if e.stderr else "No stderr."; logger.error(f"[AudioTask {task_id}] FAILED (rc {e.returncode}): {original_filename_for_log}. Error: {err_out}")
         status_update.update({'error_message': f'Audio conv. error (rc {e.returncode}): {err_out[:200]}'})
-        if self.request.retries < self.max_retries: logger.info(f"[AudioTask {task_id}] Retrying ({self.request.retries + 1}/{self.max_retries})"); raise self.retry(exc=e, countdown=int(self.default_retry_delay * (2**self.request.retries)))
+        if self.request.retries < self.max_retries: logger.info(f"[AudioTask {task_id}] Retrying ({self.request.retries + 1}/{self.max_retries})"); remove_input = False; status_update['processing_status'] = 'queued'; raise self.retry(exc=e, countdown=int(self.default_retry_delay * (2**self.request.retries)))
         raise
     except subprocess.TimeoutExpired as e:
         logger.error(f"[AudioTask {task_id}] TIMEOUT: {original_filename_for_log}"); status_update.update({'error_message': 'Audio conversion timeout.'})
-        if self.request.retries < self.max_retries: logger.info(f"[AudioTask {task_id}] Retrying ({self.request.retries + 1}/{self.max_retries})"); raise self.retry(exc=e, countdown=int(self.default_retry_delay * (2**self.request.retries)))
+        if self.request.retries < self.max_retries: logger.info(f"[AudioTask {task_id}] Retrying ({self.request.retries + 1}/{self.max_retries})"); remove_input = False; status_update['processing_status'] = 'queued'; raise self.retry(exc=e, countdown=int(self.default_retry_delay * (2**self.request.retries)))
         raise
     except Exception as e:
         logger.error(f"[AudioTask {task_id}] Unexpected error: {e}", exc_info=True); status_update.update({'error_message': f'Unexpected error: {str(e)[:100]}'}); raise
     finally:
-        r_client = get_app_data_redis_client()
         try:
-            if r_client.hget(f'media:{media_id_for_update}', 'processing_status') not in ['completed', 'completed_import']:
-                r_client.hmset(f'media:{media_id_for_update}', status_update)
+            if item_exists and r_client.hget(f'media:{media_id_for_update}', 'processing_status') not in ['completed', 'completed_import']:
+                item_exists = set_media_status(r_client, media_id_for_update, batch_id_for_update, status_update)
             logger.info(f"[AudioTask {task_id}] Final Redis status for MediaID {media_id_for_update}: {status_update.get('processing_status', 'N/A')}")
         except Exception as e_redis: logger.error(f"[AudioTask {task_id}] CRITICAL: Failed Redis update in finally: {e_redis}")
-        if os.path.exists(original_audio_temp_path):
-            try: os.remove(original_audio_temp_path); logger.info(f"[AudioTask {task_id}] Cleaned temp: {original_audio_temp_path}")
-            except OSError as e_rm: logger.error(f"[AudioTask {task_id}] Error removing temp: {e_rm}")
+        if remove_input:
+            try: storage.delete(original_audio_input_key); logger.info(f"[AudioTask {task_id}] Cleaned temp: {original_audio_input_key}")
+            except Exception as e_rm: logger.error(f"[AudioTask {task_id}] Error removing temp: {e_rm}")
+            try:
+                # The input's bytes are replaced by the output's (or by nothing, on final failure). A deleted item's
+                # removal already released its bytes.
+                if item_exists:
+                    record_media_bytes(r_client, media_id_for_update, {'uploader_user_id': uploader_username_for_log, 'batch_id': batch_id_for_update}, output_bytes - input_bytes)
+            except Exception as e_usage: logger.error(f"[AudioTask {task_id}] Could not update storage usage: {e_usage}")
 
 @celery.task(bind=True, name='api_app.handle_zip_import_task', max_retries=1, default_retry_delay=60)
-def handle_zip_import_task(self, uploaded_zip_filepath_on_disk, target_batch_id, uploader_username_for_log, original_zip_filename_for_log):
+def handle_zip_import_task(self, uploaded_zip_storage_key, target_batch_id, uploader_username_for_log, original_zip_filename_for_log):
     task_id = self.request.id; logger = current_app.logger; app_config = current_app.config; task_redis_client = get_app_data_redis_client()
     logger.info(f"[ZIPImportTask {task_id}] User:{uploader_username_for_log} Import: {original_zip_filename_for_log} for BatchID:{target_batch_id}")
     batch_owner_username = task_redis_client.hget(f'batch:{target_batch_id}', 'user_id')
@@ -454,21 +1905,21 @@ def handle_zip_import_task(self, uploaded_zip_filepath_on_disk, target_batch_id,
         logger.error(f"[ZIPImportTask {task_id}] No owner for batch {target_batch_id}. Aborting.");
         zip_item_id = task_redis_client.hget(f'batch_import_tracker:{target_batch_id}:{original_zip_filename_for_log}', 'zip_media_id')
         if zip_item_id: task_redis_client.hmset(f'media:{zip_item_id}', {'processing_status': 'failed_import', 'error_message': 'Batch owner not found.'})
+        note_task_run(self, failure='owner_missing')
         return {'status': 'error', 'message': 'Batch owner missing.'}
-    disk_path_segment_for_batch = os.path.join(batch_owner_username, target_batch_id)
-    full_disk_upload_dir_for_batch_contents = os.path.join(app_config['UPLOAD_FOLDER'], disk_path_segment_for_batch)
-    os.makedirs(full_disk_upload_dir_for_batch_contents, exist_ok=True)
-    
-    temp_extract_base_path = os.path.join(app_config['UPLOAD_FOLDER'], "temp_zip_extracts")
+    disk_path_segment_for_batch = f"{batch_owner_username}/{target_batch_id}"
+
+    temp_extract_base_path = os.path.join(app_config['SCRATCH_FOLDER'], "temp_zip_extracts")
     os.makedirs(temp_extract_base_path, exist_ok=True)
     temp_extract_path_for_this_zip = os.path.join(temp_extract_base_path, f"import_{target_batch_id}_{uuid.uuid4().hex}")
     os.makedirs(temp_extract_path_for_this_zip, exist_ok=True)
 
-    imported_media_count = 0; imported_blob_count = 0; manifest_data = None
+    imported_media_count = 0; imported_blob_count = 0; manifest_data = None; derivative_item_ids = []; conversion_jobs = []; extracted_bytes = 0
     zip_item_id_from_tracker = task_redis_client.hget(f'batch_import_tracker:{target_batch_id}:{original_zip_filename_for_log}', 'zip_media_id')
     
     try:
-        with zipfile.ZipFile(uploaded_zip_filepath_on_disk, 'r') as zip_ref:
+        with storage.fetch(uploaded_zip_storage_key) as zip_local_path, zipfile.ZipFile(zip_local_path, 'r') as zip_ref:
+            note_task_run(self, input_bytes=os.path.getsize(zip_local_path))
             if 'lightbox_manifest.json' in zip_ref.namelist():
                 with zip_ref.open('lightbox_manifest.json') as mf:
                     try: manifest_data = json.load(mf); logger.info(f"[ZIPImportTask {task_id}] Manifest loaded.")
@@ -477,67 +1928,636 @@ def handle_zip_import_task(self, uploaded_zip_filepath_on_disk, target_batch_id,
             for member in zip_ref.infolist():
                 if member.is_dir() or member.filename.startswith('__MACOSX') or member.filename.endswith('/'): continue
                 member_zip_path = member.filename
-                member_sane_basename = secure_filename(os.path.basename(member_zip_path))
-                if not member_sane_basename: logger.warning(f"[ZIPImportTask {task_id}] Skipped empty filename in ZIP: {member_zip_path}"); continue
-                
-                extracted_temp_path = os.path.join(temp_extract_path_for_this_zip, member_sane_basename)
-                if not os.path.abspath(extracted_temp_path).startswith(os.path.abspath(temp_extract_path_for_this_zip)):
-                    logger.error(f"[ZIPImportTask {task_id}] Path traversal attempt detected: {member_zip_path}. Skipping."); continue
-                
-                os.makedirs(os.path.dirname(extracted_temp_path), exist_ok=True)
-                with zip_ref.open(member) as src, open(extracted_temp_path, "wb") as dest: shutil.copyfileobj(src, dest)
-                
+                if not secure_filename(os.path.basename(member_zip_path)): logger.warning(f"[ZIPImportTask {task_id}] Skipped empty filename in ZIP: {member_zip_path}"); continue
+
                 orig_fname_redis = member_zip_path; desc_redis = ""; hidden_redis = '0'
                 if manifest_data and 'files' in manifest_data:
                     for item_mf in manifest_data.get('files', []):
                         if item_mf.get('zip_path') == member_zip_path:
                             orig_fname_redis = item_mf.get('original_filename', member_zip_path)
                             desc_redis = item_mf.get('description', ''); hidden_redis = '1' if item_mf.get('is_hidden', False) else '0'; break
-                
-                base_sane, ext_dot = os.path.splitext(orig_fname_redis); ext_dot = ext_dot.lower(); item_id = str(uuid.uuid4())
-                sec_base = secure_filename(base_sane) if base_sane else f"media_{item_id[:8]}"
-                
-                common_data = {'original_filename': orig_fname_redis, 'filename_on_disk': "", 'filepath': "", 'mimetype': MIME_TYPE_MAP.get(ext_dot, 'application/octet-stream'), 'is_hidden': hidden_redis, 'is_liked': '0', 'uploader_user_id': uploader_username_for_log, 'batch_id': target_batch_id, 'upload_timestamp': datetime.datetime.now().timestamp(), 'description': desc_redis, 'item_type': 'media'}
-                
+
+                ext_dot = os.path.splitext(orig_fname_redis)[1].lower(); item_id = str(uuid.uuid4()); item_status = 'completed'
+                # Extract under the item ID so same-named members in different ZIP folders cannot overwrite each other.
+                extracted_temp_path = os.path.join(temp_extract_path_for_this_zip, f"{item_id}{ext_dot}")
+                with zip_ref.open(member) as src, open(extracted_temp_path, "wb") as dest: shutil.copyfileobj(src, dest)
+                item_bytes = os.path.getsize(extracted_temp_path); extracted_bytes += item_bytes
+
+                common_data = {'original_filename': orig_fname_redis, 'filename_on_disk': "", 'filepath': "", 'mimetype': MIME_TYPE_MAP.get(ext_dot, 'application/octet-stream'), 'is_hidden': hidden_redis, 'is_liked': '0', 'uploader_user_id': uploader_username_for_log, 'batch_id': target_batch_id, 'upload_timestamp': datetime.datetime.now().timestamp(), 'description': desc_redis, 'item_type': 'media', 'file_size': item_bytes, 'stored_bytes': item_bytes}
+
                 if is_media_for_processing(orig_fname_redis):
-                    celery_input_path = extracted_temp_path
-                    if ext_dot.lstrip('.') in app_config['VIDEO_FORMATS_TO_CONVERT_TO_MP4']:
-                        target_path, _ = get_unique_disk_path_celery(full_disk_upload_dir_for_batch_contents, sec_base, ".mp4", task_id)
-                        redis_pipe.hmset(f'media:{item_id}', {**common_data, 'filename_on_disk': os.path.basename(celery_input_path), 'filepath': os.path.join(disk_path_segment_for_batch, os.path.basename(celery_input_path)), 'processing_status': 'queued'})
-                        convert_video_to_mp4_task.apply_async(args=[celery_input_path, target_path, item_id, target_batch_id, orig_fname_redis, disk_path_segment_for_batch, uploader_username_for_log])
-                        imported_media_count += 1
-                    elif ext_dot.lstrip('.') in app_config['AUDIO_FORMATS_TO_CONVERT_TO_MP3']:
-                        target_path, _ = get_unique_disk_path_celery(full_disk_upload_dir_for_batch_contents, sec_base, ".mp3", task_id)
-                        redis_pipe.hmset(f'media:{item_id}', {**common_data, 'filename_on_disk': os.path.basename(celery_input_path), 'filepath': os.path.join(disk_path_segment_for_batch, os.path.basename(celery_input_path)), 'processing_status': 'queued'})
-                        transcode_audio_to_mp3_task.apply_async(args=[celery_input_path, target_path, item_id, target_batch_id, orig_fname_redis, disk_path_segment_for_batch, uploader_username_for_log])
+                    if ext_dot.lstrip('.') in app_config['VIDEO_FORMATS_TO_CONVERT_TO_MP4'] or ext_dot.lstrip('.') in app_config['AUDIO_FORMATS_TO_CONVERT_TO_MP3']:
+                        # Conversion inputs must outlive the temp extract dir, which is removed when this task ends.
+                        celery_input_key, celery_input_name = reserve_item_storage_key(disk_path_segment_for_batch, f"{item_id}_input", ext_dot)
+                        storage.put_file(celery_input_key, extracted_temp_path, move=True)
+                        item_status = 'queued'
+                        redis_pipe.hmset(f'media:{item_id}', {**common_data, 'filename_on_disk': celery_input_name, 'filepath': celery_input_key, 'processing_status': 'queued'})
+                        # Queued after the pipeline below has written the hash, which the conversion reads its input size from.
+                        is_video = ext_dot.lstrip('.') in app_config['VIDEO_FORMATS_TO_CONVERT_TO_MP4']
+                        target_key, _ = item_storage_key(disk_path_segment_for_batch, item_id, ".mp4" if is_video else ".mp3")
+                        conversion_jobs.append((convert_video_to_mp4_task if is_video else transcode_audio_to_mp3_task,
+                                                [celery_input_key, target_key, item_id, target_batch_id, orig_fname_redis, disk_path_segment_for_batch, uploader_username_for_log]))
                         imported_media_count += 1
                     else:
-                        final_path, final_name = get_unique_disk_path_celery(full_disk_upload_dir_for_batch_contents, sec_base, ext_dot, task_id)
-                        shutil.move(extracted_temp_path, final_path)
-                        redis_pipe.hmset(f'media:{item_id}', {**common_data, 'filename_on_disk': final_name, 'filepath': os.path.join(disk_path_segment_for_batch, final_name), 'processing_status': 'completed'})
+                        final_key, final_name = reserve_item_storage_key(disk_path_segment_for_batch, item_id, ext_dot)
+                        storage.put_file(final_key, extracted_temp_path, move=True)
+                        redis_pipe.hmset(f'media:{item_id}', {**common_data, 'filename_on_disk': final_name, 'filepath': final_key, 'processing_status': 'completed'})
+                        if followup_tasks_for(common_data['mimetype']): derivative_item_ids.append((item_id, common_data['mimetype']))
                         imported_media_count += 1
                 else:
-                    final_path, final_name = get_unique_disk_path_celery(full_disk_upload_dir_for_batch_contents, member_sane_basename, ext_dot, task_id)
-                    shutil.move(extracted_temp_path, final_path)
-                    redis_pipe.hmset(f'media:{item_id}', {**common_data, 'filename_on_disk': final_name, 'filepath': os.path.join(disk_path_segment_for_batch, final_name), 'processing_status': 'completed', 'item_type': 'blob'})
+                    final_key, final_name = reserve_item_storage_key(disk_path_segment_for_batch, item_id, ext_dot)
+                    storage.put_file(final_key, extracted_temp_path, move=True)
+                    redis_pipe.hmset(f'media:{item_id}', {**common_data, 'filename_on_disk': final_name, 'filepath': final_key, 'processing_status': 'completed', 'item_type': 'blob'})
+                    if followup_tasks_for(common_data['mimetype']): derivative_item_ids.append((item_id, common_data['mimetype']))
                     imported_blob_count += 1
                 redis_pipe.rpush(f'batch:{target_batch_id}:media_ids', item_id)
-            redis_pipe.execute()
+                queue_usage_delta(redis_pipe, uploader_username_for_log, target_batch_id, item_bytes, 1)
+                queue_media_event(redis_pipe, target_batch_id, item_id, 'status', status=item_status)
+            redis_pipe.execute(); note_task_run(self, output_bytes=extracted_bytes)
+            for conversion_task, conversion_args in conversion_jobs: conversion_task.apply_async(args=conversion_args)
+            for item_id, item_mimetype in derivative_item_ids:
+                for followup_task in followup_tasks_for(item_mimetype): followup_task.apply_async(args=[item_id])
             logger.info(f"[ZIPImportTask {task_id}] Imported {imported_media_count} media, {imported_blob_count} blobs into batch {target_batch_id}.")
-            if zip_item_id_from_tracker: task_redis_client.hmset(f'media:{zip_item_id_from_tracker}', {'processing_status': 'completed_import', 'error_message': ''})
+            if zip_item_id_from_tracker: set_media_status(task_redis_client, zip_item_id_from_tracker, target_batch_id, {'processing_status': 'completed_import', 'error_message': ''})
     except zipfile.BadZipFile:
-        logger.error(f"[ZIPImportTask {task_id}] Bad ZIP file: {original_zip_filename_for_log}")
-        if zip_item_id_from_tracker: task_redis_client.hmset(f'media:{zip_item_id_from_tracker}', {'processing_status': 'failed_import', 'error_message': 'Corrupted ZIP file.'})
+        logger.error(f"[ZIPImportTask {task_id}] Bad ZIP file: {original_zip_filename_for_log}"); note_task_run(self, failure='BadZipFile')
+        if zip_item_id_from_tracker: set_media_status(task_redis_client, zip_item_id_from_tracker, target_batch_id, {'processing_status': 'failed_import', 'error_message': 'Corrupted ZIP file.'})
     except Exception as e:
-        logger.error(f"[ZIPImportTask {task_id}] Error processing ZIP {original_zip_filename_for_log}: {e}", exc_info=True)
-        if zip_item_id_from_tracker: task_redis_client.hmset(f'media:{zip_item_id_from_tracker}', {'processing_status': 'failed_import', 'error_message': f'Import error: {str(e)[:100]}'})
+        logger.error(f"[ZIPImportTask {task_id}] Error processing ZIP {original_zip_filename_for_log}: {e}", exc_info=True); note_task_run(self, failure=task_error_reason(e))
+        if zip_item_id_from_tracker: set_media_status(task_redis_client, zip_item_id_from_tracker, target_batch_id, {'processing_status': 'failed_import', 'error_message': f'Import error: {str(e)[:100]}'})
     finally:
         if os.path.exists(temp_extract_path_for_this_zip): shutil.rmtree(temp_extract_path_for_this_zip)
         if zip_item_id_from_tracker: task_redis_client.delete(f'batch_import_tracker:{target_batch_id}:{original_zip_filename_for_log}')
     return {'status': 'success', 'imported_media': imported_media_count, 'imported_blobs': imported_blob_count, 'batch_id': target_batch_id}
 
 
+def _open_derivative_source(local_path, mimetype, max_px, work_dir, fit_width=False):
+    # max_px bounds the longest edge, or only the width when fit_width is set.
+    if mimetype == 'application/pdf':
+        # Rasterize only the first page, already scaled to the largest rendition we need.
+        out_prefix = os.path.join(work_dir, 'page')
+        scale_args = ['-scale-to-x', str(max_px), '-scale-to-y', '-1'] if fit_width else ['-scale-to', str(max_px)]
+        subprocess.run([current_app.config['PDFTOPPM_PATH'], '-f', '1', '-l', '1', '-singlefile', '-png', *scale_args, local_path, out_prefix],
+                       check=True, capture_output=True, text=True, timeout=300)
+        local_path = f"{out_prefix}.png"
+    img = Image.open(local_path)
+    img.draft('RGB', (max_px, 1) if fit_width else (max_px, max_px))  # JPEG: decode at reduced scale instead of full resolution.
+    img = ImageOps.exif_transpose(img)
+    return img.convert('RGBA' if img.mode in ('RGBA', 'LA', 'P', 'PA') else 'RGB')
+
+@celery.task(bind=True, name='api_app.generate_derivatives_task', max_retries=2, default_retry_delay=60)
+def generate_derivatives_task(self, media_id):
+    task_id = self.request.id; logger = current_app.logger; app_config = current_app.config; task_redis_client = get_app_data_redis_client()
+    mdata = task_redis_client.hgetall(f'media:{media_id}')
+    if not mdata or mdata.get('processing_status') != 'completed' or not mdata.get('filepath'):
+        logger.info(f"[DerivTask {task_id}] MediaID {media_id} missing or not completed; skipping.")
+        return {'status': 'skipped', 'media_id': media_id}
+    if not is_derivative_source(mdata.get('mimetype')):
+        return {'status': 'skipped', 'media_id': media_id}
+    if Image is None:
+        logger.warning(f"[DerivTask {task_id}] Pillow not installed; cannot generate derivatives for MediaID {media_id}.")
+        task_redis_client.hset(f'media:{media_id}', 'derivatives_status', 'unavailable')
+        return {'status': 'unavailable', 'media_id': media_id}
+
+    formats = [f for f in app_config['DERIVATIVE_FORMATS'] if f in DERIVATIVE_CONTENT_TYPES and pil_features.check(f)]
+    sizes = sorted(app_config['DERIVATIVE_SIZES'].items(), key=lambda kv: kv[1], reverse=True)
+    source_key, source_mimetype = display_source(mdata); batch_segment = '/'.join(source_key.split('/')[:2])
+    video_preview_fields = {field for field, _ in VIDEO_PREVIEW_ASSETS.values()}
+    previous_bytes = previous_rendition_bytes(mdata, 'derivatives_bytes', [v for k, v in mdata.items() if k.startswith('derivative_') and k not in video_preview_fields])
+    produced = {}
+    try:
+        with storage.fetch(source_key) as local_path, tempfile.TemporaryDirectory(dir=app_config['SCRATCH_FOLDER']) as work_dir:
+            img = _open_derivative_source(local_path, source_mimetype, sizes[0][1], work_dir)
+            # Largest first, each step downscaling the previous one rather than the original.
+            for size_name, max_px in sizes:
+                img.thumbnail((max_px, max_px), Image.LANCZOS)
+                for fmt in formats:
+                    key, _ = item_storage_key(batch_segment, f"{media_id}_{size_name}", f".{fmt}")
+                    with storage.produce(key) as out_path:
+                        img.save(out_path, format=fmt.upper(), quality=app_config['DERIVATIVE_QUALITY'][fmt])
+                    produced[f'derivative_{size_name}_{fmt}'] = key
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        err_out = (getattr(e, 'stderr', None) or str(e)).strip()
+        logger.error(f"[DerivTask {task_id}] PDF rasterize failed for MediaID {media_id}: {err_out}")
+        task_redis_client.hset(f'media:{media_id}', mapping={'derivatives_status': 'failed', 'derivatives_error': err_out[:200]})
+        return {'status': 'failed', 'media_id': media_id}
+    except (UnidentifiedImageError, OSError) as e:
+        # Undecodable sources will not get better on retry; storage hiccups might.
+        if isinstance(e, UnidentifiedImageError) or self.request.retries >= self.max_retries:
+            logger.error(f"[DerivTask {task_id}] Failed for MediaID {media_id}: {e}")
+            task_redis_client.hset(f'media:{media_id}', mapping={'derivatives_status': 'failed', 'derivatives_error': str(e)[:200]})
+            for key in produced.values(): storage.delete(key)
+            return {'status': 'failed', 'media_id': media_id}
+        logger.info(f"[DerivTask {task_id}] Retrying ({self.request.retries + 1}/{self.max_retries}) after: {e}")
+        raise self.retry(exc=e, countdown=int(self.default_retry_delay * (2**self.request.retries)))
+
+    if not task_redis_client.exists(f'media:{media_id}'):
+        # Item was deleted while we were rendering; do not leave orphaned derivatives behind.
+        for key in produced.values(): storage.delete(key)
+        return {'status': 'skipped', 'media_id': media_id}
+    produced_bytes = sum(storage.size(key) or 0 for key in produced.values())
+    task_redis_client.hset(f'media:{media_id}', mapping={**produced, 'derivatives_status': 'completed', 'derivatives_error': '', 'derivatives_bytes': produced_bytes})
+    record_media_bytes(task_redis_client, media_id, mdata, produced_bytes - previous_bytes)
+    publish_media_event(task_redis_client, mdata.get('batch_id'), media_id, 'preview', asset='derivatives')
+    logger.info(f"[DerivTask {task_id}] Generated {len(produced)} derivative(s) for MediaID {media_id}.")
+    return {'status': 'success', 'media_id': media_id, 'derivatives': produced}
+
+def probe_video(config, local_path):
+    # Returns {'duration', 'width', 'height', 'has_audio'} for the first video stream.
+    out = subprocess.run([config['FFPROBE_PATH'], '-v', 'error', '-show_entries', 'stream=codec_type,width,height:format=duration',
+                          '-of', 'json', local_path], check=True, capture_output=True, text=True, timeout=120).stdout
+    info = json.loads(out or '{}'); streams = info.get('streams') or []
+    video = next((st for st in streams if st.get('codec_type') == 'video'), {})
+    return {'duration': float(info.get('format', {}).get('duration') or 0), 'width': int(video.get('width') or 0), 'height': int(video.get('height') or 0),
+            'has_audio': any(st.get('codec_type') == 'audio' for st in streams)}
+
+def _vtt_timestamp(seconds):
+    ms = int(round(seconds * 1000)); h, ms = divmod(ms, 3600000); m, ms = divmod(ms, 60000); sec, ms = divmod(ms, 1000)
+    return f"{h:02d}:{m:02d}:{sec:02d}.{ms:03d}"
+
+def build_sprite_vtt(duration, tile_count, columns, tile_w, tile_h, sprite_ref='sprite.jpg'):
+    # The sprite is referenced relative to the VTT's own URL, so one file works for private and public routes.
+    interval = duration / tile_count
+    cues = ["WEBVTT", ""]
+    for i in range(tile_count):
+        x, y = (i % columns) * tile_w, (i // columns) * tile_h
+        cues += [f"{_vtt_timestamp(i * interval)} --> {_vtt_timestamp(min(duration, (i + 1) * interval))}", f"{sprite_ref}#xywh={x},{y},{tile_w},{tile_h}", ""]
+    return "\n".join(cues)
+
+@celery.task(bind=True, name='api_app.generate_video_previews_task', max_retries=2, default_retry_delay=120)
+def generate_video_previews_task(self, media_id):
+    task_id = self.request.id; logger = current_app.logger; app_config = current_app.config; task_redis_client = get_app_data_redis_client()
+    mdata = task_redis_client.hgetall(f'media:{media_id}')
+    if not mdata or mdata.get('processing_status') != 'completed' or not (mdata.get('mimetype') or '').startswith('video/') or not mdata.get('filepath'):
+        logger.info(f"[VideoPreviewTask {task_id}] MediaID {media_id} missing, not completed or not video; skipping.")
+        return {'status': 'skipped', 'media_id': media_id}
+
+    ffmpeg = app_config['FFMPEG_PATH']; source_key = mdata['filepath']; batch_segment = '/'.join(source_key.split('/')[:2])
+    poster_key, _ = item_storage_key(batch_segment, f"{media_id}_poster", ".jpg")
+    sprite_key, _ = item_storage_key(batch_segment, f"{media_id}_sprite", ".jpg")
+    vtt_key, _ = item_storage_key(batch_segment, f"{media_id}_sprite", ".vtt")
+    previous_bytes = previous_rendition_bytes(mdata, 'video_previews_bytes', [mdata.get(field) for field, _ in VIDEO_PREVIEW_ASSETS.values()])
+    produced = {}
+    try:
+        with storage.fetch(source_key) as local_path:
+            probe = probe_video(app_config, local_path); duration, width, height = probe['duration'], probe['width'], probe['height']
+            if duration <= 0 or not width or not height:
+                raise ValueError("Could not determine video duration or dimensions.")
+
+            with storage.produce(poster_key) as out_path:
+                # Seek before -i (fast keyframe seek); skip the first second or so, which is often black.
+                subprocess.run([ffmpeg, '-hide_banner', '-loglevel', 'error', '-ss', f"{min(1.0, duration * 0.1):.3f}", '-i', local_path, '-frames:v', '1',
+                                '-vf', f"scale='min({app_config['VIDEO_POSTER_WIDTH']},iw)':-2", '-q:v', '3', '-y', out_path],
+                               check=True, capture_output=True, text=True, timeout=app_config['VIDEO_PREVIEW_TIMEOUT'])
+            produced['derivative_poster'] = poster_key
+
+            tile_count = max(1, min(app_config['VIDEO_SPRITE_MAX_TILES'], int(math.ceil(duration / app_config['VIDEO_SPRITE_INTERVAL']))))
+            columns = min(app_config['VIDEO_SPRITE_COLUMNS'], tile_count); rows = int(math.ceil(tile_count / columns))
+            tile_w = app_config['VIDEO_SPRITE_TILE_WIDTH']; tile_h = max(2, int(round(tile_w * height / width / 2)) * 2)
+            with storage.produce(sprite_key) as out_path:
+                # Keyframe-only decode keeps this cheap on long videos; fps picks evenly spaced frames from what is decoded.
+                subprocess.run([ffmpeg, '-hide_banner', '-loglevel', 'error', '-skip_frame', 'nokey', '-i', local_path, '-an', '-sn',
+                                '-vf', f"fps={tile_count}/{duration:.3f},scale={tile_w}:{tile_h},tile={columns}x{rows}", '-frames:v', '1', '-q:v', '4', '-y', out_path],
+                               check=True, capture_output=True, text=True, timeout=app_config['VIDEO_PREVIEW_TIMEOUT'])
+            produced['derivative_sprite'] = sprite_key
+
+            with storage.produce(vtt_key) as out_path:
+                with open(out_path, 'w', encoding='utf-8') as vtt_file:
+                    vtt_file.write(build_sprite_vtt(duration, tile_count, columns, tile_w, tile_h))
+            produced['derivative_sprite_vtt'] = vtt_key
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, ValueError) as e:
+        err_out = ((getattr(e, 'stderr', None) or '').strip() or str(e))
+        logger.error(f"[VideoPreviewTask {task_id}] FAILED for MediaID {media_id}: {err_out}")
+        for key in produced.values(): storage.delete(key)
+        task_redis_client.hset(f'media:{media_id}', mapping={'video_previews_status': 'failed', 'video_previews_error': err_out[:200]})
+        return {'status': 'failed', 'media_id': media_id}
+    except OSError as e:
+        if self.request.retries < self.max_retries:
+            logger.info(f"[VideoPreviewTask {task_id}] Retrying ({self.request.retries + 1}/{self.max_retries}) after: {e}")
+            raise self.retry(exc=e, countdown=int(self.default_retry_delay * (2**self.request.retries)))
+        for key in produced.values(): storage.delete(key)
+        task_redis_client.hset(f'media:{media_id}', mapping={'video_previews_status': 'failed', 'video_previews_error': str(e)[:200]})
+        return {'status': 'failed', 'media_id': media_id}
+
+    if not task_redis_client.exists(f'media:{media_id}'):
+        for key in produced.values(): storage.delete(key)
+        return {'status': 'skipped', 'media_id': media_id}
+    produced_bytes = sum(storage.size(key) or 0 for key in produced.values())
+    task_redis_client.hset(f'media:{media_id}', mapping={**produced, 'video_previews_status': 'completed', 'video_previews_error': '', 'duration_seconds': f"{duration:.3f}", 'video_previews_bytes': produced_bytes})
+    record_media_bytes(task_redis_client, media_id, mdata, produced_bytes - previous_bytes)
+    publish_media_event(task_redis_client, mdata.get('batch_id'), media_id, 'preview', asset='video_previews')
+    logger.info(f"[VideoPreviewTask {task_id}] Poster and {tile_count}-tile sprite generated for MediaID {media_id}.")
+    return {'status': 'success', 'media_id': media_id, 'derivatives': produced}
+
+@celery.task(bind=True, name='api_app.package_hls_task', max_retries=1, default_retry_delay=300)
+def package_hls_task(self, media_id):
+    task_id = self.request.id; logger = current_app.logger; app_config = current_app.config; task_redis_client = get_app_data_redis_client()
+    mdata = task_redis_client.hgetall(f'media:{media_id}')
+    if not mdata or mdata.get('processing_status') != 'completed' or not (mdata.get('mimetype') or '').startswith('video/') or not mdata.get('filepath'):
+        logger.info(f"[HLSTask {task_id}] MediaID {media_id} missing, not completed or not video; skipping.")
+        return {'status': 'skipped', 'media_id': media_id}
+
+    source_key = mdata['filepath']; previous_prefix = mdata.get('hls_prefix')
+    # Each run packages into its own sibling prefix and hls_prefix only moves on success, so a failed rerun never touches the package being served.
+    hls_prefix = f"{'/'.join(source_key.split('/')[:2])}/hls/{media_id}-{uuid.uuid4().hex[:12]}"
+    previous_bytes = previous_rendition_bytes(mdata, 'hls_bytes', prefix=previous_prefix)
+    task_redis_client.hset(f'media:{media_id}', 'hls_status', 'processing')
+    try:
+        with storage.fetch(source_key) as local_path, tempfile.TemporaryDirectory(dir=app_config['SCRATCH_FOLDER']) as out_dir:
+            probe = probe_video(app_config, local_path)
+            if not probe['height']:
+                raise ValueError("Could not determine video dimensions.")
+            rungs = hls_ladder_for(app_config, probe['height'])
+            for i in range(len(rungs)): os.makedirs(os.path.join(out_dir, f"v{i}"))
+            hls_command = build_hls_command(app_config, local_path, out_dir, rungs, probe['has_audio'])
+            logger.info(f"[HLSTask {task_id}] Executing: {' '.join(hls_command)}")
+            subprocess.run(hls_command, check=True, capture_output=True, text=True, timeout=app_config['HLS_TIMEOUT'])
+            # Segments first, playlists last, so a manifest never references a segment that is not in storage yet.
+            produced = [os.path.relpath(os.path.join(root, name), out_dir) for root, _, names in os.walk(out_dir) for name in names]
+            hls_bytes = sum(os.path.getsize(os.path.join(out_dir, rel_path)) for rel_path in produced)
+            for rel_path in sorted(produced, key=lambda p: (p.endswith('.m3u8'), p == 'master.m3u8', p)):
+                storage.put_file(f"{hls_prefix}/{rel_path.replace(os.sep, '/')}", os.path.join(out_dir, rel_path), move=True)
+    except Exception as e:
+        # Storage and OS errors land here too: the half-uploaded run prefix is dropped and the status never stays 'processing'.
+        err_out = ((getattr(e, 'stderr', None) or '').strip() or str(e))
+        logger.error(f"[HLSTask {task_id}] FAILED for MediaID {media_id}: {err_out}")
+        try: storage.delete_prefix(hls_prefix)
+        except Exception as e_rm: logger.error(f"[HLSTask {task_id}] Could not remove partial package {hls_prefix}: {e_rm}")
+        # An earlier package is still intact and served, so only report failure when there is nothing to fall back on.
+        fallback_status = 'completed' if previous_prefix and mdata.get('hls_status') == 'completed' else 'failed'
+        task_redis_client.register_script(SET_IF_EXISTS_SCRIPT)(keys=[f'media:{media_id}'], args=['hls_status', fallback_status, 'hls_error', err_out[:200]])
+        if self.request.retries < self.max_retries and not isinstance(e, (subprocess.CalledProcessError, ValueError)):
+            raise self.retry(exc=e, countdown=self.default_retry_delay)
+        return {'status': 'failed', 'media_id': media_id}
+
+    if not task_redis_client.exists(f'media:{media_id}'):
+        storage.delete_prefix(hls_prefix)
+        return {'status': 'skipped', 'media_id': media_id}
+    task_redis_client.hset(f'media:{media_id}', mapping={'hls_prefix': hls_prefix, 'hls_status': 'completed', 'hls_error': '', 'hls_renditions': ','.join(str(h) for h, _, _ in rungs), 'hls_bytes': hls_bytes})
+    record_media_bytes(task_redis_client, media_id, mdata, hls_bytes - previous_bytes)
+    if previous_prefix and previous_prefix != hls_prefix:
+        try: storage.delete_prefix(previous_prefix)
+        except Exception as e: logger.error(f"[HLSTask {task_id}] Could not remove superseded package {previous_prefix}: {e}")
+    publish_media_event(task_redis_client, mdata.get('batch_id'), media_id, 'preview', asset='hls')
+    logger.info(f"[HLSTask {task_id}] Packaged {len(rungs)} rendition(s) for MediaID {media_id}.")
+    return {'status': 'success', 'media_id': media_id, 'renditions': [h for h, _, _ in rungs]}
+
+@celery.task(bind=True, name='api_app.normalize_image_task', max_retries=2, default_retry_delay=60)
+def normalize_image_task(self, media_id):
+    task_id = self.request.id; logger = current_app.logger; app_config = current_app.config; task_redis_client = get_app_data_redis_client()
+    mdata = task_redis_client.hgetall(f'media:{media_id}')
+    if not mdata or mdata.get('processing_status') != 'completed' or not mdata.get('filepath') or not needs_image_normalization(mdata.get('mimetype')):
+        logger.info(f"[NormalizeTask {task_id}] MediaID {media_id} missing, not completed or not a normalizable image; skipping.")
+        return {'status': 'skipped', 'media_id': media_id}
+    if Image is None:
+        logger.warning(f"[NormalizeTask {task_id}] Pillow not installed; cannot normalize MediaID {media_id}.")
+        task_redis_client.hset(f'media:{media_id}', 'display_status', 'unavailable')
+        return {'status': 'unavailable', 'media_id': media_id}
+
+    fmt = app_config['IMAGE_NORMALIZE_FORMAT']; ext = 'jpg' if fmt == 'jpeg' else fmt
+    source_key = mdata['filepath']; batch_segment = '/'.join(source_key.split('/')[:2])
+    display_key, _ = item_storage_key(batch_segment, f"{media_id}_display", f".{ext}")
+    previous_bytes = previous_rendition_bytes(mdata, 'display_bytes', [mdata.get('display_filepath')])
+    try:
+        with storage.fetch(source_key) as local_path:
+            img = Image.open(local_path)
+            icc_profile = img.info.get('icc_profile')  # Kept for colour accuracy; EXIF/XMP/thumbnails are dropped.
+            img = ImageOps.exif_transpose(img)  # Bake orientation in, since the EXIF that carried it is not copied.
+            img.thumbnail((app_config['IMAGE_NORMALIZE_MAX_PX'], app_config['IMAGE_NORMALIZE_MAX_PX']), Image.LANCZOS)
+            if fmt == 'jpeg' and img.mode != 'RGB':
+                # JPEG has no alpha: flatten onto white rather than letting transparent areas turn black.
+                rgba = img.convert('RGBA'); flattened = Image.new('RGB', rgba.size, (255, 255, 255)); flattened.paste(rgba, mask=rgba.getchannel('A')); img = flattened
+            save_kwargs = {'quality': app_config['IMAGE_NORMALIZE_QUALITY']}
+            if fmt == 'jpeg': save_kwargs.update(optimize=True, progressive=True)
+            if icc_profile: save_kwargs['icc_profile'] = icc_profile
+            with storage.produce(display_key) as out_path:
+                img.save(out_path, format=fmt.upper(), **save_kwargs)
+    except (UnidentifiedImageError, OSError) as e:
+        if isinstance(e, UnidentifiedImageError) or self.request.retries >= self.max_retries:
+            logger.error(f"[NormalizeTask {task_id}] Failed for MediaID {media_id}: {e}")
+            task_redis_client.hset(f'media:{media_id}', mapping={'display_status': 'failed', 'display_error': str(e)[:200]})
+            return {'status': 'failed', 'media_id': media_id}
+        logger.info(f"[NormalizeTask {task_id}] Retrying ({self.request.retries + 1}/{self.max_retries}) after: {e}")
+        raise self.retry(exc=e, countdown=int(self.default_retry_delay * (2**self.request.retries)))
+
+    if not task_redis_client.exists(f'media:{media_id}'):
+        storage.delete(display_key)
+        return {'status': 'skipped', 'media_id': media_id}
+    display_bytes = storage.size(display_key) or 0
+    task_redis_client.hset(f'media:{media_id}', mapping={'display_filepath': display_key, 'display_mimetype': MIME_TYPE_MAP[f'.{ext}'], 'display_status': 'completed', 'display_error': '', 'display_bytes': display_bytes})
+    record_media_bytes(task_redis_client, media_id, mdata, display_bytes - previous_bytes)
+    publish_media_event(task_redis_client, mdata.get('batch_id'), media_id, 'preview', asset='display')
+    logger.info(f"[NormalizeTask {task_id}] Web rendition stored for MediaID {media_id}: {display_key}")
+    # Thumbnails and previews decode much faster from the rendition than from the original HEIC/TIFF.
+    generate_derivatives_task.apply_async(args=[media_id])
+    return {'status': 'success', 'media_id': media_id, 'display_filepath': display_key}
+
+@celery.task(bind=True, name='api_app.delete_media_files_task', max_retries=3, default_retry_delay=60)
+def delete_media_files_task(self, storage_keys, storage_prefixes=()):
+    # Storage cleanup for items whose Redis records are already gone (bulk delete); safe to re-run.
+    task_id = self.request.id; logger = current_app.logger
+    failed_keys, failed_prefixes = [], []
+    for key in storage_keys:
+        try: storage.delete(key)
+        except Exception as e: logger.error(f"[DeleteFilesTask {task_id}] Error deleting {key}: {e}"); failed_keys.append(key)
+    for prefix in storage_prefixes:
+        try: storage.delete_prefix(prefix)
+        except Exception as e: logger.error(f"[DeleteFilesTask {task_id}] Error deleting prefix {prefix}: {e}"); failed_prefixes.append(prefix)
+    if (failed_keys or failed_prefixes) and self.request.retries < self.max_retries:
+        raise self.retry(args=[failed_keys, failed_prefixes], countdown=int(self.default_retry_delay * (2**self.request.retries)))
+    logger.info(f"[DeleteFilesTask {task_id}] Deleted {len(storage_keys) - len(failed_keys)} file(s), {len(storage_prefixes) - len(failed_prefixes)} prefix(es).")
+    return {'status': 'success' if not (failed_keys or failed_prefixes) else 'partial', 'failed': failed_keys + failed_prefixes}
+
+@celery.task(bind=True, name='api_app.relocate_media_files_task', max_retries=3, default_retry_delay=60)
+def relocate_media_files_task(self, media_id):
+    # After a move, copy the item's files under its new batch's storage prefix (batch delete removes the whole
+    # prefix), repoint Redis, then delete the old copies. Same copy/repoint/delete order as migrate-disk-names.
+    task_id = self.request.id; logger = current_app.logger; task_redis_client = get_app_data_redis_client()
+    mdata = task_redis_client.hgetall(f'media:{media_id}')
+    batch_owner = task_redis_client.hget(f"batch:{mdata.get('batch_id')}", 'user_id') if mdata else None
+    if not batch_owner:
+        return {'status': 'skipped', 'media_id': media_id}
+    target_segment = f"{batch_owner}/{mdata['batch_id']}"
+    rebase = lambda key: f"{target_segment}/{'/'.join(key.split('/')[2:])}"
+    fields = {k: v for k, v in mdata.items() if v and (k in ('filepath', 'display_filepath', 'hls_prefix') or k.startswith('derivative_'))}
+    fields = {k: v for k, v in fields.items() if not v.startswith(f"{target_segment}/")}
+    if not fields:
+        return {'status': 'skipped', 'media_id': media_id}
+
+    copied, old_keys = [], []
+    try:
+        for field, key in fields.items():
+            source_keys = [k for k, _, _ in storage.iter_keys(key)] if field == 'hls_prefix' else [key]
+            for source_key in source_keys:
+                storage.copy(source_key, rebase(source_key)); copied.append(rebase(source_key)); old_keys.append(source_key)
+    except Exception as e:
+        for key in copied: storage.delete(key)
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=int(self.default_retry_delay * (2**self.request.retries)))
+        logger.error(f"[RelocateTask {task_id}] Could not relocate files for MediaID {media_id}: {e}", exc_info=True)
+        return {'status': 'failed', 'media_id': media_id}
+
+    if task_redis_client.hget(f'media:{media_id}', 'batch_id') != mdata['batch_id']:
+        # Deleted or moved again meanwhile; whichever operation did that owns the files now.
+        for key in copied: storage.delete(key)
+        return {'status': 'skipped', 'media_id': media_id}
+    task_redis_client.hset(f'media:{media_id}', mapping={field: rebase(key) for field, key in fields.items()})
+    for key in old_keys: storage.delete(key)
+    logger.info(f"[RelocateTask {task_id}] Relocated {len(old_keys)} file(s) for MediaID {media_id} to {target_segment}.")
+    return {'status': 'success', 'media_id': media_id, 'files': len(old_keys)}
+
+@celery.task(bind=True, name='api_app.reap_batch_task', max_retries=5, default_retry_delay=60)
+def reap_batch_task(self, batch_id):
+    # Phase two of batch deletion. Bounded work per run (BATCH_REAP_CHUNKS_PER_RUN chunks), then re-queues
+    # itself, so one huge batch never pins a worker. Files go before the records that reference them, so a
+    # crash or retry at any point only repeats idempotent deletes.
+    task_id = self.request.id; logger = current_app.logger; app_config = current_app.config; task_redis_client = get_app_data_redis_client()
+    batch_key = f'batch:{batch_id}'; list_key = f'{batch_key}:media_ids'; lock_key = f'reap_lock:{batch_id}'
+    batch_data = task_redis_client.hgetall(batch_key)
+    if batch_data.get('deleting') != '1':
+        logger.info(f"[ReapTask {task_id}] Batch {batch_id} is not tombstoned; nothing to reap.")
+        return {'status': 'skipped', 'batch_id': batch_id}
+    if not task_redis_client.set(lock_key, task_id or '1', nx=True, ex=app_config['BATCH_REAP_LOCK_TTL']):
+        return {'status': 'skipped', 'batch_id': batch_id, 'reason': 'already running'}
+
+    chunk_size = app_config['BATCH_REAP_CHUNK_SIZE']; budget = chunk_size * app_config['BATCH_REAP_CHUNKS_PER_RUN']
+    work = 0; freed = 0; done = False
+    try:
+        while work < budget:
+            media_ids = task_redis_client.lrange(list_key, 0, chunk_size - 1)
+            if not media_ids: break
+            redis_pipe = task_redis_client.pipeline(transaction=False)
+            for mid in media_ids: redis_pipe.hgetall(f'media:{mid}')
+            media_hashes = redis_pipe.execute()
+            for mdata in media_hashes:
+                for key in media_storage_keys(mdata): freed += storage.delete(key) or 0
+                if mdata.get('hls_prefix'): storage.delete_prefix(mdata['hls_prefix'])
+            redis_pipe = task_redis_client.pipeline()
+            for mid, mdata in zip(media_ids, media_hashes):
+                redis_pipe.delete(f'media:{mid}')
+                if mdata: queue_usage_delta(redis_pipe, mdata.get('uploader_user_id'), None, -int(mdata.get('stored_bytes') or 0), -1)
+                if mdata.get('item_type') == 'archive_import' and mdata.get('original_filename'):
+                    redis_pipe.delete(f"batch_import_tracker:{batch_id}:{mdata['original_filename']}")
+            redis_pipe.ltrim(list_key, len(media_ids), -1)
+            redis_pipe.hincrby(batch_key, 'reaped_items', len(media_ids)); redis_pipe.hincrby(batch_key, 'reaped_bytes', freed)
+            redis_pipe.execute()
+            work += len(media_ids); freed = 0
+
+        if work < budget and batch_data.get('user_id'):
+            # Files no item references any more (conversion inputs, extracts), one at a time within the remaining budget.
+            batch_prefix = f"{batch_data['user_id']}/{batch_id}"
+            for key, _size, _mtime in storage.iter_keys(batch_prefix):
+                if work >= budget: break
+                freed += storage.delete(key) or 0; work += 1
+            task_redis_client.hincrby(batch_key, 'reaped_bytes', freed)
+            if work < budget:
+                storage.delete_prefix(batch_prefix)  # Only empty directories / no objects remain at this point.
+                done = True
+        elif work < budget:
+            done = True
+
+        if done:
+            reaped = task_redis_client.hmget(batch_key, ['reaped_items', 'reaped_bytes'])
+            task_redis_client.delete(list_key, batch_key, f'batch_events:{batch_id}', f'usage:batch:{batch_id}')
+            logger.info(f"[ReapTask {task_id}] Batch {batch_id} fully reaped: {reaped[0] or 0} item(s), {reaped[1] or 0} byte(s).")
+            return {'status': 'success', 'batch_id': batch_id, 'items': int(reaped[0] or 0), 'bytes': int(reaped[1] or 0)}
+    except (redis.exceptions.RedisError, OSError) as e:
+        logger.error(f"[ReapTask {task_id}] Error reaping batch {batch_id}: {e}")
+        raise self.retry(exc=e, countdown=int(self.default_retry_delay * (2**self.request.retries)))
+    finally:
+        task_redis_client.delete(lock_key)
+
+    logger.info(f"[ReapTask {task_id}] Batch {batch_id}: reaped {work} entries this run; continuing.")
+    reap_batch_task.apply_async(args=[batch_id])
+    return {'status': 'in_progress', 'batch_id': batch_id, 'reaped_this_run': work}
+
+INPUT_KEY_PATTERN = re.compile(r'(?:^|/)([0-9a-f-]{36})_input\.[^/]+$')
+MEDIA_KEY_PATTERN = re.compile(r'^media:[0-9a-f-]{36}$')
+BATCH_KEY_PATTERN = re.compile(r'^batch:([0-9a-f-]{36})(:media_ids)?$')
+GC_STATE_KEY = 'gc:state'  # Checkpoints (key_cursor, file_after) and cumulative totals.
+
+def _gc_media_keys(r_client, keys, now, app_config, stats):
+    # Media hashes whose batch no longer exists, and items stuck queued/processing after a worker died.
+    redis_pipe = r_client.pipeline(transaction=False)
+    for key in keys: redis_pipe.hmget(key, ['batch_id', 'upload_timestamp', 'processing_status'])
+    rows = redis_pipe.execute()
+    redis_pipe = r_client.pipeline(transaction=False)
+    for batch_id, _, _ in rows: redis_pipe.exists(f'batch:{batch_id}')
+    batch_exists = redis_pipe.execute()
+    orphans, stalled = [], []
+    for key, (batch_id, uploaded, status), has_batch in zip(keys, rows, batch_exists):
+        age = now - float(uploaded or 0)
+        if not has_batch and age > app_config['GC_GRACE_SECONDS']: orphans.append(key)
+        elif status in ('queued', 'processing', 'queued_import') and age > app_config['GC_STALE_PROCESSING_SECONDS']: stalled.append((key, batch_id, status))
+    if orphans:
+        redis_pipe = r_client.pipeline(transaction=False)
+        for key in orphans: redis_pipe.hgetall(key)
+        orphan_hashes = redis_pipe.execute()
+        for key, mdata in zip(orphans, orphan_hashes):
+            for stored_key in media_storage_keys(mdata): stats['bytes_reclaimed'] += storage.delete(stored_key) or 0
+            if mdata.get('hls_prefix'): storage.delete_prefix(mdata['hls_prefix'])
+        redis_pipe = r_client.pipeline()
+        redis_pipe.delete(*orphans)
+        for mdata in orphan_hashes: queue_usage_delta(redis_pipe, mdata.get('uploader_user_id'), None, -int(mdata.get('stored_bytes') or 0), -1)
+        stats['keys_deleted'] += redis_pipe.execute()[0]
+    for key, batch_id, status in stalled:
+        # The conversion input (if any) is reclaimed by the file pass once the item reads as failed.
+        set_media_status(r_client, key.split(':', 1)[1], batch_id, {'processing_status': 'failed_import' if status == 'queued_import' else 'failed', 'error_message': 'Processing was interrupted.'})
+        stats['items_failed'] += 1
+
+def _gc_tracker_keys(r_client, keys, stats):
+    # Trackers outlive their import only when the import task never reached its finally block.
+    redis_pipe = r_client.pipeline(transaction=False)
+    for key in keys: redis_pipe.hget(key, 'zip_media_id')
+    zip_ids = redis_pipe.execute()
+    redis_pipe = r_client.pipeline(transaction=False)
+    for zip_id in zip_ids: redis_pipe.hget(f'media:{zip_id}', 'processing_status')
+    stale = [key for key, status in zip(keys, redis_pipe.execute()) if status != 'queued_import']
+    if stale: stats['keys_deleted'] += r_client.delete(*stale)
+
+def _gc_batch_keys(r_client, keys, now, app_config, stats):
+    # Tombstones whose reaper was lost get a new one; item lists whose batch hash is gone are dropped.
+    redis_pipe = r_client.pipeline(transaction=False)
+    for key in keys: redis_pipe.hmget(f"batch:{BATCH_KEY_PATTERN.match(key).group(1)}", ['user_id', 'deleting', 'deleted_timestamp'])
+    dangling_lists = []
+    for key, (owner, deleting, deleted_at) in zip(keys, redis_pipe.execute()):
+        batch_id, is_list = BATCH_KEY_PATTERN.match(key).groups()
+        if is_list and owner is None and deleting is None: dangling_lists.append(key)
+        elif not is_list and deleting == '1' and now - float(deleted_at or 0) > app_config['BATCH_REAP_LOCK_TTL']:
+            reap_batch_task.apply_async(args=[batch_id]); stats['reapers_requeued'] += 1
+    if dangling_lists: stats['keys_deleted'] += r_client.delete(*dangling_lists)
+
+def _gc_input_files(r_client, entries, now, app_config, stats):
+    # Conversion inputs ('<media_id>_input.<ext>') no live conversion will read again. Resumable uploads stage
+    # into the same name before any media hash exists; those are kept while their upload_staged:<id> marker lives,
+    # and (for sessions without a marker) until no session could still be open.
+    session_cutoff = max(app_config['GC_GRACE_SECONDS'], app_config['RESUMABLE_UPLOAD_SESSION_TTL'])
+    candidates = [(key, mtime, INPUT_KEY_PATTERN.search(key).group(1)) for key, size, mtime in entries
+                  if INPUT_KEY_PATTERN.search(key) and now - mtime > app_config['GC_GRACE_SECONDS']]
+    if not candidates: return
+    redis_pipe = r_client.pipeline(transaction=False)
+    for _, _, media_id in candidates:
+        redis_pipe.hmget(f'media:{media_id}', ['filepath', 'processing_status']); redis_pipe.exists(f'upload_staged:{media_id}')
+    rows = redis_pipe.execute()
+    for (key, mtime, _), (filepath, status), staged in zip(candidates, rows[::2], rows[1::2]):
+        if staged or (filepath is None and now - mtime <= session_cutoff): continue
+        if filepath != key or status in ('failed', 'failed_import'):
+            stats['bytes_reclaimed'] += storage.delete(key) or 0; stats['files_deleted'] += 1
+
+def _gc_scratch_dirs(now, app_config, stats):
+    # ZIP extract dirs and task TemporaryDirectory()s left behind by a killed worker.
+    scratch = app_config['SCRATCH_FOLDER']
+    candidates = []
+    for parent in (os.path.join(scratch, 'temp_zip_extracts'), scratch):
+        try: candidates += [e for e in os.scandir(parent) if e.is_dir(follow_symlinks=False) and (e.name.startswith('import_') or (parent == scratch and e.name.startswith('tmp')))]
+        except FileNotFoundError: continue
+    for entry in candidates:
+        try:
+            if now - entry.stat().st_mtime <= app_config['GC_GRACE_SECONDS']: continue
+            freed = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(entry.path) for f in files)
+            shutil.rmtree(entry.path)
+            stats['bytes_reclaimed'] += freed; stats['files_deleted'] += 1
+        except OSError as e:
+            current_app.logger.warning(f"[GCTask] Could not remove scratch dir {entry.path}: {e}")
+
+@celery.task(bind=True, name='api_app.garbage_collect_task', max_retries=0)
+def garbage_collect_task(self):
+    # One bounded, throttled pass. The Redis SCAN cursor and the storage listing position are checkpointed in
+    # gc:state, so consecutive runs sweep the whole keyspace and bucket incrementally instead of all at once.
+    task_id = self.request.id; logger = current_app.logger; app_config = current_app.config; task_redis_client = get_app_data_redis_client()
+    if not task_redis_client.set('gc:lock', task_id or '1', nx=True, ex=max(600, app_config['GC_INTERVAL_SECONDS'])):
+        logger.info(f"[GCTask {task_id}] Another GC run holds the lock; skipping.")
+        return {'status': 'skipped'}
+    stats = {'keys_scanned': 0, 'keys_deleted': 0, 'items_failed': 0, 'reapers_requeued': 0, 'files_scanned': 0, 'files_deleted': 0, 'bytes_reclaimed': 0}
+    started = time.monotonic(); now = time.time(); chunk = app_config['GC_SCAN_COUNT']
+    try:
+        cursor, file_after = task_redis_client.hmget(GC_STATE_KEY, ['key_cursor', 'file_after'])
+        cursor = int(cursor or 0)
+        while stats['keys_scanned'] < app_config['GC_KEY_BUDGET']:
+            cursor, keys = task_redis_client.scan(cursor=cursor, count=chunk)
+            stats['keys_scanned'] += len(keys)
+            _gc_media_keys(task_redis_client, [k for k in keys if MEDIA_KEY_PATTERN.match(k)], now, app_config, stats)
+            _gc_tracker_keys(task_redis_client, [k for k in keys if k.startswith('batch_import_tracker:')], stats)
+            _gc_batch_keys(task_redis_client, [k for k in keys if BATCH_KEY_PATTERN.match(k)], now, app_config, stats)
+            task_redis_client.hset(GC_STATE_KEY, 'key_cursor', cursor)
+            if cursor == 0: break  # Full keyspace pass complete; the next run starts over.
+            time.sleep(app_config['GC_THROTTLE_SECONDS'])
+
+        entries = []
+        for entry in storage.iter_keys('', start_after=file_after or ''):
+            entries.append(entry)
+            if len(entries) >= chunk:
+                _gc_input_files(task_redis_client, entries, now, app_config, stats)
+                stats['files_scanned'] += len(entries); file_after = entries[-1][0]; entries = []
+                task_redis_client.hset(GC_STATE_KEY, 'file_after', file_after)
+                if stats['files_scanned'] >= app_config['GC_FILE_BUDGET']: break
+                time.sleep(app_config['GC_THROTTLE_SECONDS'])
+        else:
+            _gc_input_files(task_redis_client, entries, now, app_config, stats)
+            stats['files_scanned'] += len(entries)
+            task_redis_client.hset(GC_STATE_KEY, 'file_after', '')  # Listing exhausted; restart from the top next run.
+
+        _gc_scratch_dirs(now, app_config, stats)
+    except (redis.exceptions.RedisError, OSError) as e:
+        logger.error(f"[GCTask {task_id}] Aborted after partial progress: {e}", exc_info=True)
+        stats['error'] = str(e)[:200]
+    finally:
+        task_redis_client.delete('gc:lock')
+
+    redis_pipe = task_redis_client.pipeline(transaction=False)
+    for name in ('keys_deleted', 'files_deleted', 'bytes_reclaimed'): redis_pipe.hincrby(GC_STATE_KEY, f'total_{name}', stats[name])
+    redis_pipe.hset(GC_STATE_KEY, 'last_run_timestamp', now); redis_pipe.execute()
+    stats['duration_seconds'] = round(time.monotonic() - started, 3)
+    logger.info(f"[GCTask {task_id}] {json.dumps(stats)}")
+    return {'status': 'success' if 'error' not in stats else 'partial', **stats}
+
+@celery.task(bind=True, name='api_app.reconcile_usage_task', max_retries=0)
+def reconcile_usage_task(self):
+    # Recomputes every item's stored_bytes from storage and rebuilds the usage:* counters from scratch.
+    # Uploads that land mid-run can be off until the next reconciliation; the counters never drift further.
+    task_id = self.request.id; logger = current_app.logger; task_redis_client = get_app_data_redis_client()
+    user_totals, batch_totals = {}, {}; media_count = corrected = 0
+    media_keys = task_redis_client.scan_iter(match='media:*', count=500)
+    while True:
+        chunk = [key for _, key in zip(range(500), media_keys)]
+        if not chunk: break
+        redis_pipe = task_redis_client.pipeline(transaction=False)
+        for media_key in chunk: redis_pipe.hgetall(media_key)
+        corrections = task_redis_client.pipeline(transaction=False)
+        for media_key, mdata in zip(chunk, redis_pipe.execute()):
+            if not mdata: continue
+            actual = storage_bytes_for(mdata); media_count += 1
+            if int(mdata.get('stored_bytes') or 0) != actual:
+                corrections.hset(media_key, 'stored_bytes', actual); corrections.hdel(media_key, *RENDITION_BYTES_FIELDS); corrected += 1
+            for totals, owner in ((user_totals, mdata.get('uploader_user_id')), (batch_totals, mdata.get('batch_id'))):
+                if owner:
+                    entry = totals.setdefault(owner, {'bytes': 0, 'items': 0}); entry['bytes'] += actual; entry['items'] += 1
+        corrections.execute()
+    redis_pipe = task_redis_client.pipeline()
+    for usage_key in task_redis_client.scan_iter(match='usage:*', count=500): redis_pipe.delete(usage_key)
+    for username, totals in user_totals.items(): redis_pipe.hset(f'usage:user:{username}', mapping=totals)
+    for batch_id, totals in batch_totals.items(): redis_pipe.hset(f'usage:batch:{batch_id}', mapping=totals)
+    redis_pipe.execute()
+    logger.info(f"[ReconcileUsageTask {task_id}] {media_count} item(s), {corrected} corrected; {len(user_totals)} user and {len(batch_totals)} batch counter(s) rebuilt.")
+    return {'status': 'success', 'items': media_count, 'corrected': corrected, 'users': len(user_totals), 'batches': len(batch_totals)}
+
+def followup_tasks_for(mimetype):
+    # Tasks that derive browse/delivery renditions from a completed item, in the order they should be queued.
+    if needs_image_normalization(mimetype): return [normalize_image_task]  # Queues derivatives itself once the rendition exists.
+    if is_derivative_source(mimetype): return [generate_derivatives_task]
+    if (mimetype or '').startswith('video/'):
+        return [generate_video_previews_task] + ([package_hls_task] if app.config['HLS_ENABLED'] else [])
+    return []
+
+
 # --- Root Status Endpoint ---
+def redis_status_message():
+    try:
+        redis_client.ping()
+        return f"Connected to Redis DB {app.config['APP_REDIS_DB_NUM']} at {redis_client.connection_pool.connection_kwargs.get('host')}:{redis_client.connection_pool.connection_kwargs.get('port')}."
+    except redis.exceptions.RedisError as e:
+        return f"Could not connect to Redis: {e}"
+
 @app.route('/')
 def root_status():
     app.logger.info("Root path '/' accessed.")
@@ -545,9 +2565,22 @@ def root_status():
         message="Frugal One Backend (Medium Test Version V3.0 - Full API Conversion)",
         status="API is running.",
         timestamp=datetime.datetime.utcnow().isoformat(),
-        redis_status=redis_connection_message
+        redis_status=redis_status_message()
     )
 
+# --- Metrics Endpoint ---
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    token = app.config['METRICS_TOKEN']
+    if token and not secrets.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return jsonify(success=False, message="Unauthorized."), 401
+    metrics.flush(redis_client, force=True)
+    try: samples = redis_client.hgetall(METRICS_KEY)
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error reading metrics: {e}")
+        return jsonify(success=False, message="Database error."), 503
+    return Response(render_metrics(samples), mimetype='text/plain; version=0.0.4')
+
 # --- Test User Setup Endpoint ---
 @app.route('/setup_test_user', methods=['GET'])
 def setup_test_user():
@@ -565,6 +2598,7 @@ def setup_test_user():
             'is_admin': '1',
             'email': 'ross@example.com'
         })
+        queue_user_index_add(pipe, username)
         pipe.execute()
         app.logger.info(f"Test user '{username}' with password '{password}' created/updated in Redis.")
         return jsonify(success=True, message=f"User '{username}' with password '{password}' created/updated successfully."), 200
@@ -603,6 +2637,7 @@ def api_auth_status_check():
         return jsonify(isLoggedIn=False, user=None, message="An error occurred during authentication check."), 500
 
 @app.route(f'{API_PREFIX}/auth/login', methods=['POST', 'OPTIONS'])
+@rate_limited('login_ip', 'login_user')
 def api_login_attempt():
     if request.method == 'OPTIONS': return '', 204
     
@@ -672,6 +2707,7 @@ def api_logout():
     return jsonify(success=True, message="Logout successful."), 200
 
 @app.route(f'{API_PREFIX}/auth/register', methods=['POST', 'OPTIONS'])
+@rate_limited('register_ip')
 def api_register():
     if request.method == 'OPTIONS': return '', 204
 
@@ -715,6 +2751,7 @@ def api_register():
         pipe = redis_client.pipeline()
         pipe.sadd('users', username)
         pipe.hset(f'user:{username}', mapping={'password_hash': generate_password_hash(password), 'is_admin': '0'})
+        queue_user_index_add(pipe, username)
         pipe.execute()
         
         app.logger.info(f"API: New user registered: {username}")
@@ -744,12 +2781,19 @@ def api_list_batches():
     try:
         batch_ids = redis_client.lrange(f'user:{username}:batches', 0, -1)
         
-        batches_data_list = []
+        # One round trip for every batch's hash, item count and usage, plus the user's own usage and quota.
+        pipe = redis_client.pipeline(transaction=False)
         for batch_id_str in batch_ids:
-            batch_info = redis_client.hgetall(f'batch:{batch_id_str}')
+            pipe.hgetall(f'batch:{batch_id_str}').llen(f'batch:{batch_id_str}:media_ids').hget(f'usage:batch:{batch_id_str}', 'bytes')
+        pipe.hmget(f'usage:user:{username}', ['bytes', 'items']).hget(f'user:{username}', 'quota_bytes')
+        *batch_results, (used_bytes, used_items), quota_field = pipe.execute()
+
+        batches_data_list = []
+        for batch_id_str, batch_info, item_count, stored_bytes in zip(batch_ids, batch_results[0::3], batch_results[1::3], batch_results[2::3]):
             if batch_info:
                 batch_info['id'] = batch_id_str
-                batch_info['item_count'] = redis_client.llen(f'batch:{batch_id_str}:media_ids')
+                batch_info['item_count'] = item_count
+                batch_info['stored_bytes'] = int(stored_bytes or 0)
                 
                 for key in ['creation_timestamp', 'last_modified_timestamp']:
                     if key in batch_info and batch_info[key]:
@@ -761,8 +2805,9 @@ def api_list_batches():
         
         batches_data_list.sort(key=lambda x: x.get('creation_timestamp', 0.0), reverse=True)
 
+        usage = {'bytes': int(used_bytes or 0), 'items': int(used_items or 0), 'quota_bytes': user_quota_bytes(username, quota_field)}
         app.logger.info(f"API: GET /batches - User '{username}' retrieved {len(batches_data_list)} Lightboxes.")
-        return jsonify(success=True, batches=batches_data_list), 200
+        return jsonify(success=True, batches=batches_data_list, usage=usage), 200
 
     except redis.exceptions.RedisError as e:
         app.logger.error(f"API: GET /batches - Redis error for user '{username}': {e}", exc_info=True)
@@ -824,10 +2869,110 @@ def api_create_batch():
         app.logger.error(f"API: POST /batches - Unexpected error for user '{current_username}' creating batch: {e}", exc_info=True)
         return jsonify(success=False, message="An unexpected server error occurred while creating Lightbox."), 500
 
+# --- Listing Responses ---
+MEDIA_URL_SLOT = '__media_id__'
+
+def media_url_template(endpoint, **values):
+    # One url_for() per request with a placeholder ID; each item's URL is then two string concatenations.
+    # Every other route value (size name, asset, share token) must be the same for all items.
+    head, tail = url_for(endpoint, media_id=MEDIA_URL_SLOT, _external=True, **values).split(MEDIA_URL_SLOT, 1)
+    return lambda mid: head + mid + tail
+
+def owner_media_urls():
+    return {
+        'web_url': media_url_template('api_display_media_item'),
+        'download_url': media_url_template('api_download_media_item'),
+        'thumb_url': media_url_template('api_media_thumbnail', size_name='thumb'),
+        'preview_url': media_url_template('api_media_thumbnail', size_name='preview'),
+        'poster_url': media_url_template('api_media_video_asset', asset='poster.jpg'),
+        'sprite_vtt_url': media_url_template('api_media_video_asset', asset='sprite.vtt'),
+    }
+
+def public_media_urls(share_token):
+    return {
+        'public_display_url': media_url_template('api_public_display_media_item', share_token=share_token),
+        'public_download_url': media_url_template('api_public_download_media_item', share_token=share_token),
+        'public_thumb_url': media_url_template('api_public_media_thumbnail', share_token=share_token, size_name='thumb'),
+        'public_preview_url': media_url_template('api_public_media_thumbnail', share_token=share_token, size_name='preview'),
+        'public_poster_url': media_url_template('api_public_media_video_asset', share_token=share_token, asset='poster.jpg'),
+        'public_sprite_vtt_url': media_url_template('api_public_media_video_asset', share_token=share_token, asset='sprite.vtt'),
+        'hls_url': media_url_template('api_public_media_hls', share_token=share_token, asset='master.m3u8'),
+    }
+
+def listing_response(payload, status=200):
+    # jsonify() for responses that can hold tens of thousands of items: orjson when installed, compact stdlib
+    # JSON otherwise, and br/gzip when the body is large and the client accepts it.
+    body = orjson.dumps(payload) if orjson else json.dumps(payload, separators=(',', ':')).encode()
+    response = Response(body, status=status, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if len(body) < app.config['LISTING_COMPRESS_MIN_BYTES']: return response
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+    if encoding == 'br':
+        response.set_data(brotli.compress(body, mode=brotli.MODE_TEXT, quality=app.config['LISTING_BROTLI_QUALITY']))
+    elif encoding == 'gzip':
+        response.set_data(gzip.compress(body, compresslevel=app.config['LISTING_GZIP_LEVEL'], mtime=0))
+    else:
+        return response
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+MEDIA_ITEM_FIELDS = ('id', 'original_filename', 'filename_on_disk', 'filepath', 'mimetype', 'is_hidden', 'is_liked', 'uploader_user_id',
+                     'batch_id', 'upload_timestamp', 'description', 'item_type', 'processing_status', 'progress', 'error_message',
+                     'file_size', 'display_mimetype', 'web_url', 'download_url', 'thumb_url', 'preview_url', 'poster_url', 'sprite_vtt_url')
+
+def _parse_media_fields(raw):
+    # ?fields=mimetype,thumb_url -> ['id', 'mimetype', 'thumb_url']; None (all fields) when absent. 'id' is always included.
+    if not raw: return None, None
+    fields = list(dict.fromkeys(['id'] + [f.strip() for f in raw.split(',') if f.strip()]))
+    unknown = [f for f in fields if f not in MEDIA_ITEM_FIELDS]
+    if unknown:
+        return None, (jsonify(success=False, message=f"Unknown field(s): {', '.join(unknown)}. Allowed: {', '.join(MEDIA_ITEM_FIELDS)}."), 400)
+    return fields, None
+
+def _serialize_media_item(mid, mdata_raw, urls=None):
+    # Owner-facing JSON shape of one media item (batch details, event stream). Callers serializing many items
+    # pass one owner_media_urls() so routes are built once, not per item.
+    urls = urls or owner_media_urls()
+    media_item = {
+        'id': mid,
+        'original_filename': mdata_raw.get('original_filename'),
+        'filename_on_disk': mdata_raw.get('filename_on_disk'),
+        'filepath': mdata_raw.get('filepath'),
+        'mimetype': mdata_raw.get('mimetype'),
+        'is_hidden': mdata_raw.get('is_hidden', '0') == '1',
+        'is_liked': mdata_raw.get('is_liked', '0') == '1',
+        'uploader_user_id': mdata_raw.get('uploader_user_id'),
+        'batch_id': mdata_raw.get('batch_id'),
+        'upload_timestamp': float(mdata_raw.get('upload_timestamp', 0)),
+        'description': mdata_raw.get('description', ''),
+        'item_type': mdata_raw.get('item_type', 'media'),
+        'processing_status': mdata_raw.get('processing_status', 'completed'),
+        'progress': int(mdata_raw['progress']) if mdata_raw.get('progress') else None,
+        'error_message': mdata_raw.get('error_message') or None,
+        'file_size': int(mdata_raw.get('file_size') or 0),
+        'display_mimetype': display_source(mdata_raw)[1]
+    }
+
+    if media_item['filepath'] and media_item['processing_status'] == 'completed':
+        media_item['web_url'] = urls['web_url'](mid)
+        media_item['download_url'] = urls['download_url'](mid)
+    else:
+        media_item['download_url'] = None
+        media_item['web_url'] = None
+    has_derivatives = mdata_raw.get('derivatives_status') == 'completed'
+    media_item['thumb_url'] = urls['thumb_url'](mid) if has_derivatives else None
+    media_item['preview_url'] = urls['preview_url'](mid) if has_derivatives else None
+    has_video_previews = mdata_raw.get('video_previews_status') == 'completed'
+    media_item['poster_url'] = urls['poster_url'](mid) if has_video_previews else None
+    media_item['sprite_vtt_url'] = urls['sprite_vtt_url'](mid) if has_video_previews else None
+    return media_item
+
 @app.route(f'{API_PREFIX}/batches/<uuid:batch_id>', methods=['GET', 'OPTIONS'])
 @owner_or_admin_access_required_api(item_type='batch')
 def api_get_batch_details(batch_id, batch_data):
     if request.method == 'OPTIONS': return '', 204
+    fields, error_response = _parse_media_fields(request.args.get('fields'))
+    if error_response: return error_response
 
     if not redis_client:
         app.logger.error("API: Database service unavailable for fetching batch details.")
@@ -846,43 +2991,87 @@ def api_get_batch_details(batch_id, batch_data):
         'share_token': batch_info_raw.get('share_token')
     }
 
+    # Snapshot position in the batch's event stream; pass it to /events to receive only changes after this read.
+    batch_info['events_cursor'] = latest_batch_event_id(batch_id_str)
+    batch_info['stored_bytes'] = read_usage(f'usage:batch:{batch_id_str}')['bytes']
     media_ids = redis_client.lrange(f'batch:{batch_id_str}:media_ids', 0, -1)
-    media_list = []
+    media_list = []; playable_count = 0; urls = owner_media_urls()
     for mid in media_ids:
         mdata_raw = redis_client.hgetall(f'media:{mid}')
         if mdata_raw:
-            media_item = {
-                'id': mid,
-                'original_filename': mdata_raw.get('original_filename'),
-                'filename_on_disk': mdata_raw.get('filename_on_disk'),
-                'filepath': mdata_raw.get('filepath'),
-                'mimetype': mdata_raw.get('mimetype'),
-                'is_hidden': mdata_raw.get('is_hidden', '0') == '1',
-                'is_liked': mdata_raw.get('is_liked', '0') == '1',
-                'uploader_user_id': mdata_raw.get('uploader_user_id'),
-                'batch_id': mdata_raw.get('batch_id'),
-                'upload_timestamp': float(mdata_raw.get('upload_timestamp', 0)),
-                'description': mdata_raw.get('description', ''),
-                'item_type': mdata_raw.get('item_type', 'media'),
-                'processing_status': mdata_raw.get('processing_status', 'completed')
-            }
-
-            if media_item['filepath'] and media_item['processing_status'] == 'completed':
-                media_item['web_url'] = url_for('api_display_media_item', media_id=mid, _external=True)
-                media_item['download_url'] = url_for('api_download_media_item', media_id=mid, _external=True)
-            else:
-                media_item['download_url'] = None
-                media_item['web_url'] = None
-            media_list.append(media_item)
+            media_item = _serialize_media_item(mid, mdata_raw, urls)
+            if media_item['web_url'] and media_item['item_type'] == 'media' and not media_item['is_hidden']: playable_count += 1
+            media_list.append({f: media_item[f] for f in fields} if fields else media_item)
         else:
             app.logger.warning(f"API: Media ID {mid} in batch {batch_id_str} but no data in Redis.")
 
     batch_info['media_items'] = media_list
     batch_info['item_count'] = len(media_ids)
-    batch_info['playable_media_count'] = sum(1 for item in media_list if item['web_url'] and item['item_type'] == 'media' and not item['is_hidden'])
+    batch_info['playable_media_count'] = playable_count
 
     app.logger.info(f"API: User '{request.current_identity}' fetched details for batch '{batch_id_str}'.")
-    return jsonify(success=True, batch=batch_info), 200
+    return listing_response({'success': True, 'batch': batch_info})
+
+STREAM_ID_PATTERN = re.compile(r'^\d+-\d+$')
+ITEM_EVENT_KINDS = ('status', 'preview', 'updated')
+
+def _sse_message(event_name, data, event_id=None):
+    lines = ([f"id: {event_id}"] if event_id else []) + [f"event: {event_name}", f"data: {json.dumps(data)}"]
+    return "\n".join(lines) + "\n\n"
+
+@app.route(f'{API_PREFIX}/batches/<uuid:batch_id>/events', methods=['GET', 'OPTIONS'])
+@owner_or_admin_access_required_api(item_type='batch')
+def api_batch_events(batch_id, batch_data):
+    # Server-Sent Events: 'status', 'progress', 'preview', 'updated' and 'deleted' for items in this batch. Resume with the
+    # Last-Event-ID header (sent automatically on reconnect) or ?cursor= (the events_cursor from batch details).
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: return jsonify(success=False, message="DB unavailable."), 503
+
+    batch_id_str = str(batch_id); stream_key = f'batch_events:{batch_id_str}'
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('cursor') or ''
+    if cursor and not STREAM_ID_PATTERN.match(cursor):
+        return jsonify(success=False, message="Invalid event cursor."), 400
+    try:
+        latest_id = latest_batch_event_id(batch_id_str)
+        oldest = redis_client.xrange(stream_key, count=1)
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error opening event stream for batch {batch_id_str}: {e}")
+        return jsonify(success=False, message="Database error."), 500
+    cursor = cursor or latest_id
+    # Events after the cursor were trimmed (or expired): the client must refetch the batch instead of replaying.
+    needs_resync = cursor != '0-0' and (not oldest or _stream_id_tuple(cursor) < _stream_id_tuple(oldest[0][0]))
+    block_ms = app.config['SSE_BLOCK_MS']; deadline = time.monotonic() + app.config['SSE_MAX_STREAM_SECONDS']
+    app.logger.info(f"API: User '{request.current_identity}' subscribed to events for batch '{batch_id_str}' from {cursor}.")
+
+    def generate():
+        last_id = cursor
+        yield f"retry: {app.config['SSE_RETRY_MS']}\n\n"
+        if needs_resync:
+            last_id = latest_id
+            yield _sse_message('resync', {'batch_id': batch_id_str}, latest_id)
+        while time.monotonic() < deadline:
+            try:
+                response = redis_client.xread({stream_key: last_id}, count=100, block=block_ms)
+                entries = [entry for _, stream_entries in response for entry in stream_entries] if response else []
+                # Status, preview and metadata changes carry the item's current JSON, so clients can patch in place.
+                item_ids = list(dict.fromkeys(f['media_id'] for _, f in entries if f.get('kind') in ITEM_EVENT_KINDS))
+                redis_pipe = redis_client.pipeline(transaction=False)
+                for mid in item_ids: redis_pipe.hgetall(f'media:{mid}')
+                item_hashes = redis_pipe.execute() if item_ids else []; urls = owner_media_urls() if item_ids else None
+                items = {mid: _serialize_media_item(mid, mdata, urls) for mid, mdata in zip(item_ids, item_hashes) if mdata}
+            except redis.exceptions.RedisError as e:
+                app.logger.error(f"API: Redis error streaming events for batch {batch_id_str}: {e}")
+                return  # The client reconnects with Last-Event-ID after the retry interval.
+            if not entries:
+                yield ": keepalive\n\n"; continue
+            for entry_id, fields in entries:
+                last_id = entry_id
+                payload = {k: v for k, v in fields.items() if k != 'kind'}
+                if fields.get('kind') in ITEM_EVENT_KINDS and fields.get('media_id') in items: payload['item'] = items[fields['media_id']]
+                yield _sse_message(fields.get('kind', 'status'), payload, entry_id)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route(f'{API_PREFIX}/batches/<uuid:batch_id>/toggle_share', methods=['POST', 'OPTIONS'])
 @login_required_api
@@ -978,6 +3167,8 @@ def api_rename_batch(batch_id, batch_data):
 @login_required_api
 @owner_or_admin_access_required_api(item_type='batch')
 def api_delete_batch(batch_id, batch_data):
+    # Phase one only: tombstone the batch and drop it from every index so it disappears immediately.
+    # reap_batch_task removes the media records and files in bounded chunks afterwards.
     if request.method == 'OPTIONS': return '', 204
     if not redis_client: return jsonify(success=False, message="DB unavailable."), 503
 
@@ -986,256 +3177,174 @@ def api_delete_batch(batch_id, batch_data):
     owner_id = batch_data.get('user_id')
 
     try:
-        media_ids = redis_client.lrange(f'batch:{batch_id_str}:media_ids',0,-1)
         pipe = redis_client.pipeline()
-        
-        if media_ids:
-            for m_id in media_ids:
-                m_info = redis_client.hgetall(f'media:{m_id}')
-                pipe.delete(f'media:{m_id}')
-                if m_info.get('item_type')=='archive_import' and m_info.get('original_filename'):
-                    pipe.delete(f'batch_import_tracker:{batch_id_str}:{m_info.get("original_filename")}')
-        
-        pipe.delete(f'batch:{batch_id_str}:media_ids')
-        pipe.delete(f'batch:{batch_id_str}')
-        
+        pipe.hset(f'batch:{batch_id_str}', mapping={'deleting': '1', 'deleted_timestamp': datetime.datetime.now().timestamp(), 'is_shared': '0', 'share_token': ''})
         if batch_data.get('share_token'):
             pipe.delete(f"share_token:{batch_data['share_token']}")
-        
         if owner_id:
             pipe.lrem(f'user:{owner_id}:batches',0,batch_id_str)
-        
         pipe.execute()
-        app.logger.info(f"API: Batch {batch_id_str} metadata deleted from Redis for user '{owner_id}'.")
-        
-        if owner_id:
-            batch_dir = os.path.join(app.config['UPLOAD_FOLDER'], owner_id, batch_id_str)
-            if os.path.isdir(batch_dir):
-                try:
-                    shutil.rmtree(batch_dir)
-                    app.logger.info(f"API: Deleted batch directory: {batch_dir}")
-                except OSError as e:
-                    app.logger.error(f"API: OS error deleting batch directory {batch_dir}: {e}", exc_info=True)
-                    return jsonify(success=False, message=f"Lightbox '{name_flash}' deleted from DB, but error deleting files on server: {str(e)}"), 500
-            else:
-                app.logger.info(f"API: Batch directory not found for deletion: {batch_dir}")
-        else:
-            app.logger.error(f"API: No owner ID for batch {batch_id_str} when attempting file deletion.")
-            return jsonify(success=False, message=f"Lightbox '{name_flash}' deleted from DB, but could not determine file path for deletion."), 500
-        
-        return jsonify(success=True, message=f'Lightbox "{name_flash}" and its contents deleted.'), 200
-
+        app.logger.info(f"API: Batch {batch_id_str} tombstoned for user '{owner_id}'.")
     except redis.exceptions.RedisError as e:
         app.logger.error(f"API: Redis error deleting batch {batch_id_str}: {e}", exc_info=True)
         return jsonify(success=False, message="Database error during Lightbox deletion."), 500
-    except Exception as e:
-        app.logger.error(f"API: Unexpected error deleting batch {batch_id_str}: {e}", exc_info=True)
-        return jsonify(success=False, message="An unexpected server error occurred during Lightbox deletion."), 500
 
+    try:
+        reap_batch_task.apply_async(args=[batch_id_str])
+    except Exception as e:
+        # The tombstone stays; the garbage collector re-queues reapers for stale tombstones.
+        app.logger.error(f"API: Could not queue reaper for deleted batch {batch_id_str}: {e}", exc_info=True)
 
-# --- Media Item Management Endpoints ---
+    return jsonify(success=True, message=f'Lightbox "{name_flash}" deleted. Its files are being removed in the background.', batch_id=batch_id_str), 202
 
-@app.route(f'{API_PREFIX}/upload', methods=['POST', 'OPTIONS'])
-@login_required_api
-def api_upload():
-    if request.method == 'OPTIONS': 
-        return '', 204
-    
-    app.logger.info(f"API: Upload request received. Content-Type: {request.headers.get('Content-Type')}")
-    app.logger.info(f"API: Request files: {request.files}")
-    app.logger.info(f"API: Request form data: {request.form}")
-    app.logger.info(f"API: 'files[]' in request.files check: {'files[]' in request.files}")
 
-    if not redis_client:
-        return jsonify(success=False, message="Upload service unavailable (DB error)."), 503
-    
-    if 'files[]' not in request.files:
-        app.logger.warning("API: 'files[]' not found in request.files. Returning 400 (No file part).")
-        return jsonify(success=False, message="No file part in the request or request malformed."), 400
-    
-    files = request.files.getlist('files[]')
-    
-    if not files or all(f.filename == '' for f in files):
-        app.logger.warning("API: Files list is empty or all filenames are empty. Returning 400 (No files selected).")
-        return jsonify(success=False, message="No files selected for upload."), 400
-
-    current_user = request.current_identity
-    existing_batch_id = request.form.get('existing_batch_id')
-    upload_type = request.form.get('upload_type', 'media')
-    description = request.form.get('description', '').strip()
-
-    app.logger.info(f"API: Upload by {current_user}. Type: {upload_type}. Files count: {len(files)}")
+# --- Media Item Management Endpoints ---
 
-    batch_id, batch_name, new_batch, batch_owner = "", "", True, current_user
+def _resolve_upload_batch(current_user, existing_batch_id, upload_type, batch_name_form, first_filename):
     if existing_batch_id:
-        new_batch = False
         batch_id = existing_batch_id
         try:
             b_info = redis_client.hgetall(f'batch:{batch_id}')
-            if not b_info:
-                return jsonify(success=False, message=f'Lightbox {batch_id} not found.'), 404
+            if not b_info or b_info.get('deleting') == '1':
+                return None, (jsonify(success=False, message=f'Lightbox {batch_id} not found.'), 404)
             batch_owner = b_info.get('user_id')
             if not batch_owner:
                 app.logger.error(f"API: Batch {batch_id} missing owner in Redis.")
-                return jsonify(success=False, message='Lightbox data error.'), 500
+                return None, (jsonify(success=False, message='Lightbox data error.'), 500)
             is_admin = redis_client.hget(f'user:{current_user}', 'is_admin') == '1'
             if batch_owner != current_user and not is_admin:
-                return jsonify(success=False, message='No permission to upload to this Lightbox.'), 403
+                return None, (jsonify(success=False, message='No permission to upload to this Lightbox.'), 403)
             batch_name = b_info.get('name', f'Lightbox_{batch_id[:8]}')
         except redis.exceptions.RedisError as e:
             app.logger.error(f"API: Redis error checking existing batch {batch_id}: {e}", exc_info=True)
-            return jsonify(success=False, message="Database error during batch lookup."), 500
+            return None, (jsonify(success=False, message="Database error during batch lookup."), 500)
+        new_batch = False
     else:
-        new_batch = True
         batch_id = str(uuid.uuid4())
-        batch_name_form = request.form.get('batch_name', '').strip()
-        if upload_type == 'import_zip' and not batch_name_form and files and files[0].filename:
-            zip_base, _ = os.path.splitext(files[0].filename)
+        batch_owner = current_user
+        if upload_type == 'import_zip' and not batch_name_form and first_filename:
+            zip_base, _ = os.path.splitext(first_filename)
             batch_name = secure_filename(zip_base) if zip_base else f"Import_{batch_id[:8]}"
         elif batch_name_form:
             batch_name = batch_name_form
         else:
             batch_name = f"New Lightbox_{batch_id[:8]}"
-            
-    disk_path_segment = os.path.join(batch_owner, batch_id)
-    full_disk_dir = os.path.join(app.config['UPLOAD_FOLDER'], disk_path_segment)
-    
-    try:
-        os.makedirs(full_disk_dir, exist_ok=True)
-    except OSError as e:
-        app.logger.error(f"API: Error creating upload directory '{full_disk_dir}': {e}", exc_info=True)
-        return jsonify(success=False, message="Server directory error during upload."), 500
-
-    direct_count, convert_queued_count, import_queued_count, blob_count = 0, 0, 0, 0
-    uploaded_items_meta = []
-    redis_pipe = redis_client.pipeline()
-
-    vid_formats = app.config['VIDEO_FORMATS_TO_CONVERT_TO_MP4']
-    aud_formats = app.config['AUDIO_FORMATS_TO_CONVERT_TO_MP3']
-
-    for file_item in files:
-        if not file_item or not file_item.filename:
-            continue
-
-        orig_fname = file_item.filename
-        if not allowed_file(orig_fname):
-            app.logger.warning(f"API: File type '{orig_fname}' not allowed. Skipped.")
-            uploaded_items_meta.append({"filename": orig_fname, "status": "skipped", "message": "File type not allowed."})
-            continue
-        
-        base, ext_dot = os.path.splitext(orig_fname)
-        ext_dot = ext_dot.lower()
-        ext_no_dot = ext_dot.lstrip('.')
-        
-        item_id = str(uuid.uuid4())
-        sec_base = secure_filename(base) if base else f"item_{item_id[:8]}"
-        
-        temp_input_fname = f"{item_id}_input{ext_dot}"
-        temp_input_path = os.path.join(full_disk_dir, temp_input_fname)
-        initial_rpath_temp = os.path.join(disk_path_segment, temp_input_fname)
-
-        common_data = {
-            'original_filename': orig_fname,
-            'filename_on_disk': "",
-            'filepath': "",
-            'mimetype': MIME_TYPE_MAP.get(ext_dot, 'application/octet-stream'),
-            'is_hidden': '0',
-            'is_liked': '0',
-            'uploader_user_id': current_user,
-            'batch_id': batch_id,
-            'upload_timestamp': datetime.datetime.now().timestamp(),
-            'item_type': 'media',
-            'description': description
-        }
+        new_batch = True
 
+    return {
+        'batch_id': batch_id,
+        'batch_name': batch_name,
+        'new_batch': new_batch,
+        'batch_owner': batch_owner,
+        'disk_path_segment': f"{batch_owner}/{batch_id}"
+    }, None
+
+def _stage_upload_item(place_file, orig_fname, item_id, upload_type, batch_ctx, current_user, description):
+    # place_file(storage_key) must leave the uploaded bytes in storage under that key.
+    # Touches storage only (no Redis, no broker), so it is safe to run on the upload I/O pool.
+    batch_id = batch_ctx['batch_id']; disk_path_segment = batch_ctx['disk_path_segment']
+    ext_dot = os.path.splitext(orig_fname)[1].lower()
+    ext_no_dot = ext_dot.lstrip('.')
+
+    temp_input_key, temp_input_fname = item_storage_key(disk_path_segment, f"{item_id}_input", ext_dot)
+
+    common_data = {
+        'original_filename': orig_fname,
+        'filename_on_disk': "",
+        'filepath': "",
+        'mimetype': MIME_TYPE_MAP.get(ext_dot, 'application/octet-stream'),
+        'is_hidden': '0',
+        'is_liked': '0',
+        'uploader_user_id': current_user,
+        'batch_id': batch_id,
+        'upload_timestamp': datetime.datetime.now().timestamp(),
+        'item_type': 'media',
+        'description': description
+    }
+    staged = {'item_id': item_id, 'batch_id': batch_id, 'orig_fname': orig_fname, 'record': None, 'tracker': None, 'tasks': [], 'key': None, 'size': 0}
+
+    if upload_type == 'import_zip' and ext_no_dot == 'zip':
+        app.logger.info(f"API: Queuing ZIP '{orig_fname}' for import. ItemID: {item_id}")
+        place_file(temp_input_key)
+        staged.update(key=temp_input_key, record={
+            **common_data,
+            'filename_on_disk': temp_input_fname,
+            'filepath': temp_input_key,
+            'processing_status': 'queued_import',
+            'item_type': 'archive_import'
+        }, tracker=f'batch_import_tracker:{batch_id}:{orig_fname}', tasks=[(handle_zip_import_task, [temp_input_key, batch_id, current_user, orig_fname])],
+            meta={"id": item_id, "filename": orig_fname, "status": "queued_import", "message": "ZIP import queued."}, kind='import')
+    elif upload_type == 'blob_storage' or not is_media_for_processing(orig_fname):
+        app.logger.info(f"API: Storing blob: '{orig_fname}'. ItemID: {item_id}")
+        final_key, final_name = reserve_item_storage_key(disk_path_segment, item_id, ext_dot)
+        place_file(final_key)
+        staged.update(key=final_key, record={
+            **common_data,
+            'filename_on_disk': final_name,
+            'filepath': final_key,
+            'processing_status': 'completed',
+            'item_type': 'blob'
+        }, meta={"id": item_id, "filename": orig_fname, "status": "completed", "message": "File stored as blob."}, kind='blob')
+        staged['tasks'] = [(task, [item_id]) for task in followup_tasks_for(common_data['mimetype'])]
+    elif upload_type == 'media' and is_media_for_processing(orig_fname):
+        if ext_no_dot in app.config['VIDEO_FORMATS_TO_CONVERT_TO_MP4'] or ext_no_dot in app.config['AUDIO_FORMATS_TO_CONVERT_TO_MP3']:
+            is_video = ext_no_dot in app.config['VIDEO_FORMATS_TO_CONVERT_TO_MP4']
+            place_file(temp_input_key)
+            target_key, _ = item_storage_key(disk_path_segment, item_id, ".mp4" if is_video else ".mp3")
+            staged.update(key=temp_input_key, record={
+                **common_data,
+                'filename_on_disk': temp_input_fname,
+                'filepath': temp_input_key,
+                'processing_status': 'queued'
+            }, tasks=[(convert_video_to_mp4_task if is_video else transcode_audio_to_mp3_task, [temp_input_key, target_key, item_id, batch_id, orig_fname, disk_path_segment, current_user])],
+                meta={"id": item_id, "filename": orig_fname, "status": "queued", "message": f"{'Video' if is_video else 'Audio'} conversion queued."}, kind='convert')
+        else:
+            final_key, final_name = reserve_item_storage_key(disk_path_segment, item_id, ext_dot)
+            place_file(final_key)
+            staged.update(key=final_key, record={
+                **common_data,
+                'filename_on_disk': final_name,
+                'filepath': final_key,
+                'processing_status': 'completed'
+            }, meta={"id": item_id, "filename": orig_fname, "status": "completed", "message": "Media uploaded directly."}, kind='direct')
+            staged['tasks'] = [(task, [item_id]) for task in followup_tasks_for(common_data['mimetype'])]
+    else:
+        app.logger.warning(f"API: Could not handle '{orig_fname}'. Skipped.")
+        staged.update(meta={"filename": orig_fname, "status": "skipped", "message": "Unknown processing type."}, kind=None)
+        return staged
+
+    staged['size'] = storage.size(staged['key']) or 0
+    return staged
+
+def _record_upload_item(redis_pipe, staged):
+    redis_pipe.hset(f"media:{staged['item_id']}", mapping={**staged['record'], 'file_size': staged['size'], 'stored_bytes': staged['size']})
+    queue_usage_delta(redis_pipe, staged['record'].get('uploader_user_id'), staged['batch_id'], staged['size'], 1)
+    if staged['tracker']:
+        redis_pipe.hset(staged['tracker'], mapping={'zip_media_id': staged['item_id']})
+    redis_pipe.rpush(f"batch:{staged['batch_id']}:media_ids", staged['item_id'])
+    queue_media_event(redis_pipe, staged['batch_id'], staged['item_id'], 'status', status=staged['record'].get('processing_status'))
+
+def _enqueue_upload_item(staged):
+    # Only called once the media hash is committed, so a fast (or eager) worker can never have its
+    # status update overwritten by the upload's own 'queued' write.
+    for task, task_args in staged['tasks']:
         try:
-            if upload_type == 'import_zip' and ext_no_dot == 'zip':
-                app.logger.info(f"API: Queuing ZIP '{orig_fname}' for import. ItemID: {item_id}")
-                file_item.save(temp_input_path)
-                redis_pipe.hmset(f'media:{item_id}', {
-                    **common_data, 
-                    'filename_on_disk': temp_input_fname,
-                    'filepath': initial_rpath_temp,
-                    'processing_status': 'queued_import', 
-                    'item_type': 'archive_import'
-                })
-                redis_pipe.hmset(f'batch_import_tracker:{batch_id}:{orig_fname}', {'zip_media_id': item_id})
-                handle_zip_import_task.apply_async(args=[temp_input_path, batch_id, current_user, orig_fname])
-                import_queued_count += 1
-                uploaded_items_meta.append({"id": item_id, "filename": orig_fname, "status": "queued_import", "message": "ZIP import queued."})
-            elif upload_type == 'blob_storage' or not is_media_for_processing(orig_fname):
-                app.logger.info(f"API: Storing blob: '{orig_fname}'. ItemID: {item_id}")
-                final_path, final_name = get_unique_disk_path(full_disk_dir, sec_base, ext_dot)
-                file_item.save(final_path)
-                redis_pipe.hmset(f'media:{item_id}', {
-                    **common_data, 
-                    'filename_on_disk': final_name,
-                    'filepath': os.path.join(disk_path_segment, final_name),
-                    'processing_status': 'completed', 
-                    'item_type': 'blob'
-                })
-                blob_count += 1
-                uploaded_items_meta.append({"id": item_id, "filename": orig_fname, "status": "completed", "message": "File stored as blob."})
-            elif upload_type == 'media' and is_media_for_processing(orig_fname):
-                if ext_no_dot in vid_formats:
-                    file_item.save(temp_input_path)
-                    target_path, _ = get_unique_disk_path(full_disk_dir, sec_base, ".mp4")
-                    redis_pipe.hmset(f'media:{item_id}', {
-                        **common_data, 
-                        'filename_on_disk': temp_input_fname,
-                        'filepath': initial_rpath_temp,
-                        'processing_status': 'queued'
-                    })
-                    convert_video_to_mp4_task.apply_async(args=[temp_input_path, target_path, item_id, batch_id, orig_fname, disk_path_segment, current_user])
-                    convert_queued_count += 1
-                    uploaded_items_meta.append({"id": item_id, "filename": orig_fname, "status": "queued", "message": "Video conversion queued."})
-                elif ext_no_dot in aud_formats:
-                    file_item.save(temp_input_path)
-                    target_path, _ = get_unique_disk_path(full_disk_dir, sec_base, ".mp3")
-                    redis_pipe.hmset(f'media:{item_id}', {
-                        **common_data, 
-                        'filename_on_disk': temp_input_fname,
-                        'filepath': initial_rpath_temp,
-                        'processing_status': 'queued'
-                    })
-                    transcode_audio_to_mp3_task.apply_async(args=[temp_input_path, target_path, item_id, batch_id, orig_fname, disk_path_segment, current_user])
-                    convert_queued_count += 1
-                    uploaded_items_meta.append({"id": item_id, "filename": orig_fname, "status": "queued", "message": "Audio conversion queued."})
-                else:
-                    final_path, final_name = get_unique_disk_path(full_disk_dir, sec_base, ext_dot)
-                    file_item.save(final_path)
-                    redis_pipe.hset(f'media:{item_id}', mapping={
-                        **common_data, 
-                        'filename_on_disk': final_name,
-                        'filepath': os.path.join(disk_path_segment, final_name),
-                        'processing_status': 'completed'
-                    })
-                    direct_count += 1
-                    uploaded_items_meta.append({"id": item_id, "filename": orig_fname, "status": "completed", "message": "Media uploaded directly."})
-            else:
-                app.logger.warning(f"API: Could not handle '{orig_fname}'. Skipped.")
-                uploaded_items_meta.append({"filename": orig_fname, "status": "skipped", "message": "Unknown processing type."})
-                continue
-            
-            redis_pipe.rpush(f'batch:{batch_id}:media_ids', item_id)
-
+            task.apply_async(args=task_args)
         except Exception as e:
-            app.logger.error(f"API: Error processing '{orig_fname}' (type:{upload_type}): {e}", exc_info=True)
-            uploaded_items_meta.append({"filename": orig_fname, "status": "error", "message": f"Server error: {str(e)}"})
-            if os.path.exists(temp_input_path):
-                try: os.remove(temp_input_path)
-                except OSError: app.logger.error(f"Failed to cleanup temp file during upload error: {temp_input_path}")
-    
-    try:
-        redis_pipe.execute()
-    except redis.exceptions.RedisError as e:
-        app.logger.error(f"API: Redis pipeline error during upload for batch {batch_id}: {e}", exc_info=True)
-        return jsonify(success=False, message="Database error during upload finalization."), 500
-
-    total_submitted = direct_count + convert_queued_count + import_queued_count + blob_count
+            app.logger.error(f"API: Failed to enqueue {task.name} for '{staged['orig_fname']}' (ItemID: {staged['item_id']}): {e}", exc_info=True)
+            if staged['record'].get('processing_status') == 'completed':
+                continue  # Only follow-up work (previews) was lost; the item itself is usable.
+            try: redis_client.hset(f"media:{staged['item_id']}", mapping={'processing_status': 'failed', 'error_message': 'Could not queue processing task.'})
+            except redis.exceptions.RedisError: pass
+            staged['meta'].update(status='error', message='Could not queue processing task.')
+            return
+
+def _finalize_upload_batch(batch_ctx, counts, uploaded_items_meta):
+    batch_id = batch_ctx['batch_id']; batch_name = batch_ctx['batch_name']; batch_owner = batch_ctx['batch_owner']
+    total_submitted = sum(counts.values())
     if total_submitted > 0:
         try:
-            if new_batch:
+            if batch_ctx['new_batch']:
                 redis_client.hset(f'batch:{batch_id}', mapping={
                     'user_id': batch_owner,
                     'creation_timestamp': datetime.datetime.now().timestamp(),
@@ -1246,11 +3355,11 @@ def api_upload():
                 redis_client.lpush(f'user:{batch_owner}:batches', batch_id)
             else:
                 redis_client.hset(f'batch:{batch_id}', 'last_modified_timestamp', datetime.datetime.now().timestamp())
-            
+
             summary_message = f'{total_submitted} item(s) processed for "{batch_name}". '
-            if convert_queued_count: summary_message += f"{convert_queued_count} media processing. "
-            if import_queued_count: summary_message += f"{import_queued_count} archive(s) importing. "
-            if blob_count: summary_message += f"{blob_count} file(s) stored. "
+            if counts['convert']: summary_message += f"{counts['convert']} media processing. "
+            if counts['import']: summary_message += f"{counts['import']} archive(s) importing. "
+            if counts['blob']: summary_message += f"{counts['blob']} file(s) stored. "
 
             return jsonify(
                 success=True,
@@ -1259,16 +3368,522 @@ def api_upload():
                 batch_name=batch_name,
                 uploaded_items=uploaded_items_meta
             ), 200
-        
+
         except redis.exceptions.RedisError as e:
             app.logger.error(f"API: Redis error finalizing batch {batch_id} after upload: {e}", exc_info=True)
             return jsonify(success=False, message="Items submitted, but error saving batch metadata."), 500
     else:
-        if new_batch and os.path.exists(full_disk_dir) and not os.listdir(full_disk_dir):
-            try: shutil.rmtree(full_disk_dir)
-            except OSError as e_rmdir: app.logger.error(f"API: Error removing empty new batch dir '{full_disk_dir}': {e_rmdir}")
         return jsonify(success=False, message="No valid files processed or uploaded."), 400
 
+@app.route(f'{API_PREFIX}/upload', methods=['POST', 'OPTIONS'])
+@login_required_api
+@rate_limited('upload_user')
+def api_upload():
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    app.logger.info(f"API: Upload request received. Content-Type: {request.headers.get('Content-Type')}")
+    app.logger.info(f"API: Request files: {request.files}")
+    app.logger.info(f"API: Request form data: {request.form}")
+    app.logger.info(f"API: 'files[]' in request.files check: {'files[]' in request.files}")
+
+    if not redis_client:
+        return jsonify(success=False, message="Upload service unavailable (DB error)."), 503
+
+    if 'files[]' not in request.files:
+        app.logger.warning("API: 'files[]' not found in request.files. Returning 400 (No file part).")
+        return jsonify(success=False, message="No file part in the request or request malformed."), 400
+
+    files = request.files.getlist('files[]')
+
+    if not files or all(f.filename == '' for f in files):
+        app.logger.warning("API: Files list is empty or all filenames are empty. Returning 400 (No files selected).")
+        return jsonify(success=False, message="No files selected for upload."), 400
+
+    current_user = request.current_identity
+    try:
+        quota_response = check_upload_quota(current_user, request.content_length)
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error checking quota for '{current_user}': {e}", exc_info=True)
+        return jsonify(success=False, message="Database error checking storage quota."), 500
+    if quota_response: return quota_response
+    existing_batch_id = request.form.get('existing_batch_id')
+    upload_type = request.form.get('upload_type', 'media')
+    description = request.form.get('description', '').strip()
+
+    app.logger.info(f"API: Upload by {current_user}. Type: {upload_type}. Files count: {len(files)}")
+
+    batch_ctx, error_response = _resolve_upload_batch(current_user, existing_batch_id, upload_type, request.form.get('batch_name', '').strip(), files[0].filename if files else '')
+    if error_response:
+        return error_response
+    batch_id = batch_ctx['batch_id']
+
+    def ingest_file(file_item):
+        orig_fname = file_item.filename
+        if not allowed_file(orig_fname):
+            app.logger.warning(f"API: File type '{orig_fname}' not allowed. Skipped.")
+            return {'kind': None, 'meta': {"filename": orig_fname, "status": "skipped", "message": "File type not allowed."}}
+        item_id = str(uuid.uuid4())
+        try:
+            return _stage_upload_item(lambda key: storage.save_upload(key, file_item), orig_fname, item_id, upload_type, batch_ctx, current_user, description)
+        except Exception as e:
+            app.logger.error(f"API: Error processing '{orig_fname}' (type:{upload_type}): {e}", exc_info=True)
+            ext_dot = os.path.splitext(orig_fname)[1].lower()
+            for partial_key in (item_storage_key(batch_ctx['disk_path_segment'], f"{item_id}_input", ext_dot)[0], item_storage_key(batch_ctx['disk_path_segment'], item_id, ext_dot)[0]):
+                try: storage.delete(partial_key)
+                except Exception: app.logger.error(f"Failed to cleanup temp file during upload error: {partial_key}")
+            return {'kind': None, 'meta': {"filename": orig_fname, "status": "error", "message": f"Server error: {str(e)}"}}
+
+    # Storage writes (and the stat that follows) overlap on a bounded pool; map() keeps results in submission order.
+    file_items = [f for f in files if f and f.filename]
+    io_workers = max(1, min(app.config['UPLOAD_IO_WORKERS'], len(file_items)))
+    ingest_started = time.monotonic()
+    if io_workers > 1:
+        with ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='upload-io') as io_pool:
+            staged_items = list(io_pool.map(ingest_file, file_items))
+    else:
+        staged_items = [ingest_file(f) for f in file_items]
+    app.logger.info(f"API: Ingested {len(file_items)} file(s), {sum(st.get('size', 0) for st in staged_items)} bytes in {time.monotonic() - ingest_started:.2f}s ({io_workers} I/O worker(s)).")
+
+    counts = {'direct': 0, 'convert': 0, 'import': 0, 'blob': 0}
+    uploaded_items_meta = [st['meta'] for st in staged_items]
+    committed_items = [st for st in staged_items if st['kind']]
+    redis_pipe = redis_client.pipeline()
+    for staged in committed_items:
+        counts[staged['kind']] += 1
+        _record_upload_item(redis_pipe, staged)
+
+    try:
+        redis_pipe.execute()
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis pipeline error during upload for batch {batch_id}: {e}", exc_info=True)
+        for staged in committed_items:
+            try: storage.delete(staged['key'])
+            except Exception: app.logger.error(f"Failed to cleanup stored file after pipeline error: {staged['key']}")
+        return jsonify(success=False, message="Database error during upload finalization."), 500
+
+    for staged in committed_items:
+        _enqueue_upload_item(staged)
+
+    return _finalize_upload_batch(batch_ctx, counts, uploaded_items_meta)
+
+# --- Resumable (Chunked) Upload Endpoints ---
+def _get_upload_session(session_id, current_user):
+    session_data = redis_client.hgetall(f'upload_session:{session_id}')
+    if not session_data:
+        return None, (jsonify(success=False, message="Upload session not found or expired."), 404)
+    if session_data.get('user_id') != current_user:
+        app.logger.warning(f"API: User '{current_user}' attempted to use upload session {session_id} owned by '{session_data.get('user_id')}'.")
+        return None, (jsonify(success=False, message="No permission for this upload session."), 403)
+    return session_data, None
+
+def _upload_session_state(session_id, session_data):
+    return {
+        'session_id': session_id,
+        'filename': session_data.get('original_filename'),
+        'offset': int(session_data.get('offset', 0)),
+        'total_size': int(session_data.get('total_size', 0)),
+        'batch_id': session_data.get('batch_id'),
+        'upload_url': url_for('api_upload_session_chunk', session_id=session_id, _external=True),
+        'finalize_url': url_for('api_upload_session_finalize', session_id=session_id, _external=True)
+    }
+
+@app.route(f'{API_PREFIX}/upload/sessions', methods=['POST', 'OPTIONS'])
+@login_required_api
+@rate_limited('upload_user')
+def api_create_upload_session():
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: return jsonify(success=False, message="Upload service unavailable (DB error)."), 503
+
+    data = request.get_json(silent=True)
+    if not data: return jsonify(success=False, message="JSON with 'filename' and 'total_size' required."), 400
+
+    orig_fname = (data.get('filename') or '').strip()
+    if not orig_fname: return jsonify(success=False, message="Filename is required."), 400
+    if not allowed_file(orig_fname): return jsonify(success=False, message="File type not allowed."), 400
+    try:
+        total_size = int(data.get('total_size'))
+    except (TypeError, ValueError):
+        return jsonify(success=False, message="total_size must be an integer byte count."), 400
+    if total_size <= 0: return jsonify(success=False, message="total_size must be positive."), 400
+    if total_size > app.config['RESUMABLE_UPLOAD_MAX_BYTES']:
+        return jsonify(success=False, message="File too large for resumable upload."), 413
+
+    current_user = request.current_identity
+    try:
+        quota_response = check_upload_quota(current_user, total_size)
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error checking quota for '{current_user}': {e}", exc_info=True)
+        return jsonify(success=False, message="Database error checking storage quota."), 500
+    if quota_response: return quota_response
+    upload_type = data.get('upload_type', 'media')
+    batch_ctx, error_response = _resolve_upload_batch(current_user, data.get('existing_batch_id'), upload_type, (data.get('batch_name') or '').strip(), orig_fname)
+    if error_response:
+        return error_response
+
+    session_id = secrets.token_urlsafe(24)
+    item_id = str(uuid.uuid4())
+    staged_key, _ = item_storage_key(batch_ctx['disk_path_segment'], f"{item_id}_input", os.path.splitext(orig_fname)[1].lower())
+    try:
+        storage_state = storage.open_append(staged_key)
+    except Exception as e:
+        app.logger.error(f"API: Storage error opening staged upload '{staged_key}': {e}", exc_info=True)
+        return jsonify(success=False, message="Server storage error during upload."), 500
+
+    session_data = {
+        'user_id': current_user,
+        'item_id': item_id,
+        'original_filename': orig_fname,
+        'upload_type': upload_type,
+        'description': (data.get('description') or '').strip(),
+        'total_size': total_size,
+        'offset': 0,
+        'staged_filepath': staged_key,
+        'storage_state': json.dumps(storage_state),
+        'batch_id': batch_ctx['batch_id'],
+        'batch_name': batch_ctx['batch_name'],
+        'batch_owner': batch_ctx['batch_owner'],
+        'new_batch': '1' if batch_ctx['new_batch'] else '0',
+        'creation_timestamp': datetime.datetime.now().timestamp()
+    }
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hset(f'upload_session:{session_id}', mapping=session_data)
+        pipe.expire(f'upload_session:{session_id}', app.config['RESUMABLE_UPLOAD_SESSION_TTL'])
+        # Lets the GC's input-file pass (keyed by item ID) see that this staged file still belongs to a live session.
+        pipe.set(f'upload_staged:{item_id}', session_id, ex=app.config['RESUMABLE_UPLOAD_SESSION_TTL'])
+        pipe.execute()
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error creating upload session for '{orig_fname}': {e}", exc_info=True)
+        try: storage.abort_append(staged_key, storage_state)
+        except Exception: pass
+        return jsonify(success=False, message="Database error creating upload session."), 500
+
+    app.logger.info(f"API: User '{current_user}' opened upload session {session_id} for '{orig_fname}' ({total_size} bytes) into batch {batch_ctx['batch_id']}.")
+    return jsonify(success=True, message="Upload session created.", chunk_size=app.config['RESUMABLE_UPLOAD_CHUNK_SIZE'], **_upload_session_state(session_id, session_data)), 201
+
+@app.route(f'{API_PREFIX}/upload/sessions/<string:session_id>', methods=['GET', 'OPTIONS'])
+@login_required_api
+def api_upload_session_status(session_id):
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: return jsonify(success=False, message="Upload service unavailable (DB error)."), 503
+
+    try:
+        session_data, error_response = _get_upload_session(session_id, request.current_identity)
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error reading upload session {session_id}: {e}", exc_info=True)
+        return jsonify(success=False, message="Database error reading upload session."), 500
+    if error_response:
+        return error_response
+    return jsonify(success=True, **_upload_session_state(session_id, session_data)), 200
+
+@app.route(f'{API_PREFIX}/upload/sessions/<string:session_id>', methods=['PUT', 'OPTIONS'])
+@login_required_api
+@rate_limited('upload_chunk_user')
+def api_upload_session_chunk(session_id):
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: return jsonify(success=False, message="Upload service unavailable (DB error)."), 503
+
+    current_user = request.current_identity
+    content_range = request.headers.get('Content-Range', '')
+    try:
+        # Content-Range: bytes <start>-<end>/<total>
+        range_spec, _, range_total = content_range.replace('bytes', '', 1).strip().partition('/')
+        range_start, _, range_end = range_spec.partition('-')
+        chunk_start, chunk_end = int(range_start), int(range_end)
+    except ValueError:
+        return jsonify(success=False, message="Content-Range header 'bytes <start>-<end>/<total>' is required."), 400
+    if chunk_end < chunk_start:
+        return jsonify(success=False, message="Invalid Content-Range."), 400
+
+    lock_key = f'upload_session_lock:{session_id}'
+    try:
+        session_data, error_response = _get_upload_session(session_id, current_user)
+        if error_response:
+            return error_response
+        if not redis_client.set(lock_key, '1', nx=True, ex=app.config['RESUMABLE_UPLOAD_LOCK_TTL']):
+            return jsonify(success=False, message="Another chunk for this session is in progress.", offset=int(session_data.get('offset', 0))), 409
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error reading upload session {session_id}: {e}", exc_info=True)
+        return jsonify(success=False, message="Database error reading upload session."), 500
+
+    try:
+        offset = int(session_data.get('offset', 0)); total_size = int(session_data.get('total_size', 0))
+        if range_total.strip() not in ('*', str(total_size)):
+            return jsonify(success=False, message="Content-Range total does not match session size.", offset=offset), 400
+        if chunk_start != offset:
+            return jsonify(success=False, message="Chunk does not start at the current session offset.", offset=offset), 409
+        if chunk_end >= total_size:
+            return jsonify(success=False, message="Chunk extends past the declared file size.", offset=offset), 416
+
+        expected_len = chunk_end - chunk_start + 1
+        storage_state = json.loads(session_data.get('storage_state') or '{}')
+        try:
+            written, storage_state = storage.append_chunk(session_data['staged_filepath'], storage_state, offset, request.stream, expected_len, chunk_end == total_size - 1)
+        except FileNotFoundError:
+            app.logger.error(f"API: Staged file for upload session {session_id} missing: {session_data['staged_filepath']}")
+            return jsonify(success=False, message="Upload session data lost; please restart the upload."), 410
+        except ValueError as e:
+            return jsonify(success=False, message=str(e), offset=offset), 400
+        if written < expected_len:
+            app.logger.warning(f"API: Chunk for upload session {session_id} incomplete: {written} of {expected_len} bytes kept.")
+
+        new_offset = offset + written
+        pipe = redis_client.pipeline()
+        pipe.hset(f'upload_session:{session_id}', mapping={'offset': new_offset, 'storage_state': json.dumps(storage_state)})
+        pipe.expire(f'upload_session:{session_id}', app.config['RESUMABLE_UPLOAD_SESSION_TTL'])
+        pipe.expire(f"upload_staged:{session_data['item_id']}", app.config['RESUMABLE_UPLOAD_SESSION_TTL'])
+        pipe.execute()
+
+        if written < expected_len:
+            return jsonify(success=False, message="Chunk incomplete; resume from the returned offset.", offset=new_offset), 400
+        return jsonify(success=True, offset=new_offset, total_size=total_size, complete=new_offset == total_size), 200
+
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error writing chunk for upload session {session_id}: {e}", exc_info=True)
+        return jsonify(success=False, message="Database error during chunk upload."), 500
+    except Exception as e:
+        app.logger.error(f"API: Storage error writing chunk for upload session {session_id}: {e}", exc_info=True)
+        return jsonify(success=False, message="Server storage error during chunk upload."), 500
+    finally:
+        try: redis_client.delete(lock_key)
+        except redis.exceptions.RedisError: pass
+
+@app.route(f'{API_PREFIX}/upload/sessions/<string:session_id>/finalize', methods=['POST', 'OPTIONS'])
+@login_required_api
+def api_upload_session_finalize(session_id):
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: return jsonify(success=False, message="Upload service unavailable (DB error)."), 503
+
+    current_user = request.current_identity
+    lock_key = f'upload_session_lock:{session_id}'
+    try:
+        session_data, error_response = _get_upload_session(session_id, current_user)
+        if error_response:
+            return error_response
+        if not redis_client.set(lock_key, '1', nx=True, ex=app.config['RESUMABLE_UPLOAD_LOCK_TTL']):
+            return jsonify(success=False, message="A chunk for this session is still in progress."), 409
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error reading upload session {session_id}: {e}", exc_info=True)
+        return jsonify(success=False, message="Database error reading upload session."), 500
+
+    try:
+        offset = int(session_data.get('offset', 0)); total_size = int(session_data.get('total_size', 0))
+        if offset != total_size:
+            return jsonify(success=False, message=f"Upload incomplete ({offset} of {total_size} bytes).", offset=offset), 409
+
+        if session_data.get('new_batch') == '1':
+            batch_ctx = {
+                'batch_id': session_data['batch_id'],
+                'batch_name': session_data['batch_name'],
+                'new_batch': True,
+                'batch_owner': session_data['batch_owner'],
+                'disk_path_segment': f"{session_data['batch_owner']}/{session_data['batch_id']}"
+            }
+        else:
+            # The target Lightbox may have been deleted or re-permissioned while the upload was running.
+            batch_ctx, error_response = _resolve_upload_batch(current_user, session_data['batch_id'], session_data['upload_type'], '', '')
+            if error_response:
+                return error_response
+
+        staged_key = session_data['staged_filepath']
+        storage.complete_append(staged_key, json.loads(session_data.get('storage_state') or '{}'))
+        redis_client.hset(f'upload_session:{session_id}', 'storage_state', json.dumps({'completed': True}))
+        if not storage.exists(staged_key):
+            app.logger.error(f"API: Staged file for upload session {session_id} missing at finalize: {staged_key}")
+            return jsonify(success=False, message="Upload session data lost; please restart the upload."), 410
+
+        def place_staged_file(dest_key):
+            if dest_key != staged_key:
+                storage.move(staged_key, dest_key)
+
+        item_id = session_data['item_id']; orig_fname = session_data['original_filename']
+        counts = {'direct': 0, 'convert': 0, 'import': 0, 'blob': 0}
+        redis_pipe = redis_client.pipeline()
+        staged = _stage_upload_item(place_staged_file, orig_fname, item_id, session_data['upload_type'], batch_ctx, current_user, session_data.get('description', ''))
+        if staged['kind']:
+            counts[staged['kind']] += 1
+            _record_upload_item(redis_pipe, staged)
+        else:
+            storage.delete(staged_key)
+        redis_pipe.delete(f'upload_session:{session_id}', f'upload_staged:{item_id}')
+        redis_pipe.execute()
+        if staged['kind']:
+            _enqueue_upload_item(staged)
+        item_meta = staged['meta']
+
+        app.logger.info(f"API: User '{current_user}' finalized upload session {session_id} for '{orig_fname}' ({total_size} bytes).")
+        return _finalize_upload_batch(batch_ctx, counts, [item_meta])
+
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error finalizing upload session {session_id}: {e}", exc_info=True)
+        return jsonify(success=False, message="Database error during upload finalization."), 500
+    except Exception as e:
+        app.logger.error(f"API: Unexpected error finalizing upload session {session_id}: {e}", exc_info=True)
+        return jsonify(success=False, message="An unexpected server error occurred during upload finalization."), 500
+    finally:
+        try: redis_client.delete(lock_key)
+        except redis.exceptions.RedisError: pass
+
+@app.route(f'{API_PREFIX}/upload/sessions/<string:session_id>', methods=['DELETE', 'OPTIONS'])
+@login_required_api
+def api_cancel_upload_session(session_id):
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: return jsonify(success=False, message="Upload service unavailable (DB error)."), 503
+
+    try:
+        session_data, error_response = _get_upload_session(session_id, request.current_identity)
+        if error_response:
+            return error_response
+        redis_client.delete(f'upload_session:{session_id}', f"upload_staged:{session_data['item_id']}")
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error cancelling upload session {session_id}: {e}", exc_info=True)
+        return jsonify(success=False, message="Database error cancelling upload session."), 500
+
+    try: storage.abort_append(session_data['staged_filepath'], json.loads(session_data.get('storage_state') or '{}'))
+    except Exception as e: app.logger.error(f"API: Error removing staged upload {session_data['staged_filepath']}: {e}")
+    app.logger.info(f"API: User '{request.current_identity}' cancelled upload session {session_id}.")
+    return jsonify(success=True, message="Upload session cancelled.", session_id=session_id), 200
+
+def _parse_bulk_media_ids(payload):
+    # Returns (ids, error_response). IDs are de-duplicated, order preserved.
+    media_ids = (payload or {}).get('media_ids')
+    if not isinstance(media_ids, list) or not media_ids:
+        return None, (jsonify(success=False, message="media_ids must be a non-empty list."), 400)
+    if len(media_ids) > app.config['BULK_MEDIA_MAX_IDS']:
+        return None, (jsonify(success=False, message=f"At most {app.config['BULK_MEDIA_MAX_IDS']} media IDs per request."), 400)
+    try:
+        return list(dict.fromkeys(str(uuid.UUID(str(mid))) for mid in media_ids)), None
+    except ValueError:
+        return None, (jsonify(success=False, message="media_ids must be UUIDs."), 400)
+
+def _load_authorized_media(media_ids, username):
+    # One pipelined read for the caller's admin flag and every media hash, then a single ownership pass
+    # (same rule as owner_or_admin_access_required_api). Items that are missing or not the caller's are
+    # reported together, so the response does not reveal which IDs exist.
+    redis_pipe = redis_client.pipeline(transaction=False)
+    redis_pipe.hget(f'user:{username}', 'is_admin')
+    for mid in media_ids: redis_pipe.hgetall(f'media:{mid}')
+    is_admin_flag, *media_hashes = redis_pipe.execute()
+    is_admin = is_admin_flag == '1'
+    authorized, not_found = {}, []
+    for mid, mdata in zip(media_ids, media_hashes):
+        if mdata and (is_admin or mdata.get('uploader_user_id') == username): authorized[mid] = mdata
+        else: not_found.append(mid)
+    return authorized, not_found
+
+@app.route(f'{API_PREFIX}/media/bulk_status', methods=['POST', 'OPTIONS'])
+@login_required_api
+def api_media_bulk_status():
+    # Targeted polling: the current JSON of just the listed items, without fetching the whole batch.
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: return jsonify(success=False, message="DB unavailable."), 503
+
+    media_ids, error_response = _parse_bulk_media_ids(request.get_json(silent=True))
+    if error_response: return error_response
+    try:
+        authorized, not_found = _load_authorized_media(media_ids, request.current_identity)
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error reading bulk status for {len(media_ids)} item(s): {e}", exc_info=True)
+        return jsonify(success=False, message="Database error reading media status."), 500
+
+    urls = owner_media_urls()
+    media_items = [_serialize_media_item(mid, authorized[mid], urls) for mid in media_ids if mid in authorized]
+    return jsonify(success=True, media_items=media_items, not_found=not_found), 200
+
+BULK_MEDIA_ACTIONS = ('set_hidden', 'set_liked', 'delete', 'move')
+
+@app.route(f'{API_PREFIX}/media/bulk', methods=['POST', 'OPTIONS'])
+@login_required_api
+def api_media_bulk():
+    # {"action": "set_hidden"|"set_liked", "value": bool} | {"action": "delete"} | {"action": "move", "target_batch_id": ...},
+    # plus "media_ids". Authorized in one pass, applied in one server-side script; file deletion runs in the background.
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: return jsonify(success=False, message="DB unavailable."), 503
+
+    payload = request.get_json(silent=True) or {}
+    action = payload.get('action')
+    if action not in BULK_MEDIA_ACTIONS:
+        return jsonify(success=False, message=f"action must be one of: {', '.join(BULK_MEDIA_ACTIONS)}."), 400
+    if action in ('set_hidden', 'set_liked') and not isinstance(payload.get('value'), bool):
+        return jsonify(success=False, message="value must be true or false."), 400
+    media_ids, error_response = _parse_bulk_media_ids(payload)
+    if error_response: return error_response
+    current_user = request.current_identity
+
+    try:
+        authorized, not_found = _load_authorized_media(media_ids, current_user)
+        target_batch_id = None
+        if action == 'move':
+            try: target_batch_id = str(uuid.UUID(str(payload.get('target_batch_id'))))
+            except ValueError: return jsonify(success=False, message="target_batch_id must be a Lightbox ID."), 400
+            (target_owner, target_deleting), is_admin = redis_client.pipeline(transaction=False).hmget(f'batch:{target_batch_id}', ['user_id', 'deleting']).hget(f'user:{current_user}', 'is_admin').execute()
+            if not target_owner or target_deleting == '1':
+                return jsonify(success=False, message="Target Lightbox not found."), 404
+            if target_owner != current_user and is_admin != '1':
+                return jsonify(success=False, message="No permission for the target Lightbox."), 403
+
+        # Same restrictions as the single-item endpoints: hide/like apply to media only, and items still being
+        # converted stay put until their task has written its output.
+        skipped = [mid for mid, mdata in authorized.items() if
+                   (action in ('set_hidden', 'set_liked') and mdata.get('item_type', 'media') != 'media') or
+                   (action == 'move' and (mdata.get('batch_id') == target_batch_id or mdata.get('processing_status') in ('queued', 'processing')))]
+        targets = [mid for mid in media_ids if mid in authorized and mid not in skipped]
+        if not targets:
+            return jsonify(success=True, action=action, applied=[], skipped=skipped, not_found=not_found), 200
+        keys = [f'media:{mid}' for mid in targets]
+
+        if action in ('set_hidden', 'set_liked'):
+            field = 'is_hidden' if action == 'set_hidden' else 'is_liked'
+            results = redis_client.register_script(BULK_SET_FIELD_SCRIPT)(keys=keys, args=[field, '1' if payload['value'] else '0', *(authorized[mid]['batch_id'] for mid in targets)])
+        elif action == 'delete':
+            args = []
+            for mid in targets:
+                mdata = authorized[mid]
+                tracker = f"batch_import_tracker:{mdata['batch_id']}:{mdata.get('original_filename', mid)}" if mdata.get('item_type') == 'archive_import' else ''
+                args += [mdata.get('batch_id', ''), mid, tracker]
+            results = redis_client.register_script(BULK_DELETE_SCRIPT)(keys=keys, args=args)
+        else:
+            args = [target_batch_id]
+            for mid in targets: args += [authorized[mid].get('batch_id', ''), mid]
+            results = redis_client.register_script(BULK_MOVE_SCRIPT)(keys=keys, args=args)
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error applying bulk {action} to {len(media_ids)} item(s): {e}", exc_info=True)
+        return jsonify(success=False, message=f"Database error during bulk {action}."), 500
+
+    applied = [mid for mid, ok in zip(targets, results) if ok]
+    skipped += [mid for mid, ok in zip(targets, results) if not ok]
+    try:
+        redis_pipe = redis_client.pipeline(transaction=False)
+        for mid in applied:
+            source_batch = authorized[mid].get('batch_id')
+            if action == 'move':
+                queue_media_event(redis_pipe, source_batch, mid, 'deleted')
+                queue_media_event(redis_pipe, target_batch_id, mid, 'updated')
+                moved_bytes = int(authorized[mid].get('stored_bytes') or 0)
+                queue_usage_delta(redis_pipe, None, source_batch, -moved_bytes, -1); queue_usage_delta(redis_pipe, None, target_batch_id, moved_bytes, 1)
+            elif action == 'delete':
+                queue_media_event(redis_pipe, source_batch, mid, 'deleted')
+                queue_media_removal_usage(redis_pipe, authorized[mid])
+            else:
+                queue_media_event(redis_pipe, source_batch, mid, 'updated')
+        redis_pipe.execute()
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Could not record bulk {action} events/usage: {e}")
+
+    if action == 'delete' and applied:
+        storage_keys = [key for mid in applied for key in media_storage_keys(authorized[mid])]
+        hls_prefixes = [authorized[mid]['hls_prefix'] for mid in applied if authorized[mid].get('hls_prefix')]
+        try: delete_media_files_task.apply_async(args=[storage_keys, hls_prefixes])
+        except Exception as e: app.logger.error(f"API: Could not queue file deletion for {len(applied)} bulk-deleted item(s): {e}", exc_info=True)
+    elif action == 'move':
+        for mid in applied:
+            try: relocate_media_files_task.apply_async(args=[mid])
+            except Exception as e: app.logger.error(f"API: Could not queue file relocation for moved media {mid}: {e}", exc_info=True)
+
+    app.logger.info(f"API: User '{current_user}' bulk {action}: {len(applied)} applied, {len(skipped)} skipped, {len(not_found)} not found.")
+    return jsonify(success=True, action=action, applied=applied, skipped=skipped, not_found=not_found), 200
+
 @app.route(f'{API_PREFIX}/media/<uuid:media_id>/toggle_hidden', methods=['POST', 'OPTIONS'])
 @login_required_api
 @owner_or_admin_access_required_api(item_type='media')
@@ -1340,16 +3955,6 @@ def api_delete_media(media_id, media_data):
     item_type = media_data.get('item_type','media')
 
     try:
-        filepath_redis = media_data.get('filepath')
-        if filepath_redis:
-            disk_path = os.path.join(app.config['UPLOAD_FOLDER'], filepath_redis)
-            if os.path.isfile(disk_path):
-                try:
-                    os.remove(disk_path)
-                    app.logger.info(f"API: Deleted file {disk_path} for item {media_id_str} (type: {item_type})")
-                except OSError as e:
-                    app.logger.error(f"API: OS error deleting file {disk_path} for media {media_id_str}: {e}", exc_info=True)
-        
         pipe = redis_client.pipeline()
         if batch_id_contained_in:
             pipe.lrem(f'batch:{batch_id_contained_in}:media_ids',0,media_id_str)
@@ -1357,9 +3962,24 @@ def api_delete_media(media_id, media_data):
         
         if item_type == 'archive_import' and batch_id_contained_in:
             pipe.delete(f'batch_import_tracker:{batch_id_contained_in}:{orig_fname}')
+        if batch_id_contained_in:
+            queue_media_event(pipe, batch_id_contained_in, media_id_str, 'deleted')
+        queue_media_removal_usage(pipe, media_data)
         
         pipe.execute()
         app.logger.info(f"API: Media '{orig_fname}' (ID: {media_id_str}) metadata deleted from Redis.")
+
+        storage_keys = media_storage_keys(media_data); hls_prefixes = [media_data['hls_prefix']] if media_data.get('hls_prefix') else []
+        try:
+            delete_media_files_task.apply_async(args=[storage_keys, hls_prefixes])
+        except Exception as e:
+            app.logger.warning(f"API: Could not queue file deletion for media {media_id_str} ({e}); deleting inline.")
+            for stored_key in storage_keys:
+                try: storage.delete(stored_key)
+                except Exception as e_rm: app.logger.error(f"API: Storage error deleting file {stored_key} for media {media_id_str}: {e_rm}", exc_info=True)
+            for prefix in hls_prefixes:
+                try: storage.delete_prefix(prefix)
+                except Exception as e_rm: app.logger.error(f"API: Storage error deleting HLS package for media {media_id_str}: {e_rm}", exc_info=True)
         
         return jsonify(
             success=True,
@@ -1382,23 +4002,21 @@ def api_display_media_item(media_id, media_data):
     if request.method == 'OPTIONS': return '', 204
     if not redis_client: abort(503, description="DB unavailable.")
 
-    rpath = media_data.get('filepath'); orig_fname = media_data.get('original_filename', f"display_{media_id}.bin")
-    mime = media_data.get('mimetype', 'application/octet-stream')
+    rpath, mime = display_source(media_data); orig_fname = media_data.get('original_filename', f"display_{media_id}.bin")
     
     if not rpath:
         app.logger.error(f"API: Display item {media_id} failed: No filepath in Redis.")
         abort(404, description="File information missing.")
 
-    dpath = os.path.join(app.config['UPLOAD_FOLDER'], rpath)
-    if not os.path.isfile(dpath):
-        app.logger.error(f"API: Display item {media_id} (path: {dpath}) failed: File not found on disk.")
+    if not storage.exists(rpath):
+        app.logger.error(f"API: Display item {media_id} (key: {rpath}) failed: File not found in storage.")
         abort(404, description="File not found on server.")
     
     app.logger.info(f"API: User '{request.current_identity}' serving/displaying '{orig_fname}' (ID: {media_id})")
     try:
-        return send_file(dpath, mimetype=mime, as_attachment=False, download_name=orig_fname)
+        return storage.serve(rpath, mime, as_attachment=False, download_name=orig_fname)
     except Exception as e:
-        app.logger.error(f"API: Error serving file {dpath}: {e}", exc_info=True)
+        app.logger.error(f"API: Error serving file {rpath}: {e}", exc_info=True)
         abort(500, description="Error preparing file for display.")
 
 @app.route(f'{API_PREFIX}/media/<uuid:media_id>/download', methods=['GET', 'OPTIONS'])
@@ -1415,18 +4033,85 @@ def api_download_media_item(media_id, media_data):
         app.logger.error(f"API: Download item {media_id} failed: No filepath in Redis.")
         abort(404, description="File information missing.")
 
-    dpath = os.path.join(app.config['UPLOAD_FOLDER'], rpath)
-    if not os.path.isfile(dpath):
-        app.logger.error(f"API: Download item {media_id} (path: {dpath}) failed: File not found on disk.")
+    if not storage.exists(rpath):
+        app.logger.error(f"API: Download item {media_id} (key: {rpath}) failed: File not found in storage.")
         abort(404, description="File not found on server.")
     
     app.logger.info(f"API: User '{request.current_identity}' downloading '{orig_fname}' (ID: {media_id})")
     try:
-        return send_file(dpath, mimetype=mime, as_attachment=True, download_name=orig_fname)
+        return storage.serve(rpath, mime, as_attachment=True, download_name=orig_fname)
     except Exception as e:
-        app.logger.error(f"API: Error serving file {dpath}: {e}", exc_info=True)
+        app.logger.error(f"API: Error serving file {rpath}: {e}", exc_info=True)
         abort(500, description="Error preparing file for download.")
 
+def _serve_derivative(mdata, media_id, size_name, cache_scope):
+    if size_name not in app.config['DERIVATIVE_SIZES']:
+        abort(404, description="Unknown derivative size.")
+    requested_format = request.args.get('fmt', '').lower() or None
+    if requested_format and requested_format not in DERIVATIVE_CONTENT_TYPES:
+        abort(400, description="Unsupported derivative format.")
+    key, fmt = pick_derivative_key(mdata, size_name, request.headers.get('Accept', ''), requested_format)
+    if not key or not storage.exists(key):
+        abort(404, description="Derivative not available.")
+    response = storage.serve(key, DERIVATIVE_CONTENT_TYPES[fmt], as_attachment=False, download_name=f"{media_id}_{size_name}.{fmt}")
+    # Derivative keys are never rewritten in place, so caches can hold them for a long time.
+    response.headers['Cache-Control'] = f"{cache_scope}, max-age={app.config['DERIVATIVE_CACHE_MAX_AGE']}"
+    response.headers.add('Vary', 'Accept')
+    return response
+
+@app.route(f'{API_PREFIX}/media/<uuid:media_id>/thumb/<string:size_name>', methods=['GET', 'OPTIONS'])
+@login_required_api
+@owner_or_admin_access_required_api(item_type='media')
+def api_media_thumbnail(media_id, size_name, media_data):
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: abort(503, description="DB unavailable.")
+    try:
+        return _serve_derivative(media_data, media_id, size_name, 'private')
+    except HTTPException:
+        raise
+    except Exception as e:
+        app.logger.error(f"API: Error serving {size_name} derivative for {media_id}: {e}", exc_info=True)
+        abort(500, description="Error preparing derivative.")
+
+def _serve_video_asset(mdata, media_id, asset, cache_scope):
+    if asset not in VIDEO_PREVIEW_ASSETS:
+        abort(404, description="Unknown video preview asset.")
+    field, content_type = VIDEO_PREVIEW_ASSETS[asset]
+    key = mdata.get(field)
+    if not key or not storage.exists(key):
+        abort(404, description="Video preview not available.")
+    response = storage.serve(key, content_type, as_attachment=False, download_name=f"{media_id}_{asset}")
+    response.headers['Cache-Control'] = f"{cache_scope}, max-age={app.config['DERIVATIVE_CACHE_MAX_AGE']}"
+    return response
+
+@app.route(f'{API_PREFIX}/media/<uuid:media_id>/video/<string:asset>', methods=['GET', 'OPTIONS'])
+@login_required_api
+@owner_or_admin_access_required_api(item_type='media')
+def api_media_video_asset(media_id, asset, media_data):
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: abort(503, description="DB unavailable.")
+    try:
+        return _serve_video_asset(media_data, media_id, asset, 'private')
+    except HTTPException:
+        raise
+    except Exception as e:
+        app.logger.error(f"API: Error serving video asset {asset} for {media_id}: {e}", exc_info=True)
+        abort(500, description="Error preparing video preview.")
+
+@app.route(f'{API_PREFIX}/media/<uuid:media_id>/render', methods=['GET', 'OPTIONS'])
+@login_required_api
+@owner_or_admin_access_required_api(item_type='media')
+def api_render_media_item(media_id, media_data):
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: abort(503, description="DB unavailable.")
+    try:
+        return _serve_render(str(media_id), media_data, 'private')
+    except HTTPException:
+        raise
+    except Exception as e:
+        app.logger.error(f"API: Error rendering {media_id}: {e}", exc_info=True)
+        abort(500, description="Error rendering image.")
+
 @app.route(f'{API_PREFIX}/batches/<uuid:batch_id>/export', methods=['GET', 'OPTIONS'])
 @login_required_api
 @owner_or_admin_access_required_api(item_type='batch')
@@ -1454,15 +4139,16 @@ def api_export_batch(batch_id, batch_data):
                 if minfo and minfo.get('is_hidden','0')=='0' and minfo.get('processing_status','completed')=='completed' and minfo.get('item_type') != 'archive_import':
                     rpath = minfo.get('filepath'); orig_fname = minfo.get('original_filename',f"item_{mid}"); item_type = minfo.get('item_type','media'); desc = minfo.get('description','')
                     if rpath:
-                        dpath = os.path.join(app.config['UPLOAD_FOLDER'], rpath)
-                        if os.path.isfile(dpath):
+                        if storage.exists(rpath):
                             base, ext = os.path.splitext(orig_fname); arc_base = secure_filename(base if base else f"item_{idx}"); arc_cand = f"{arc_base}{ext if ext else '.bin'}"
                             ct = 0; final_arc = arc_cand
                             while final_arc in zip_fnames_used: ct+=1; final_arc = f"{arc_base}_{ct}{ext if ext else '.bin'}"
-                            zip_fnames_used.add(final_arc); zf.write(dpath, arcname=final_arc)
+                            zip_fnames_used.add(final_arc)
+                            with zf.open(final_arc, 'w', force_zip64=True) as zdest:
+                                for chunk in storage.open_range(rpath): zdest.write(chunk)
                             manifest['files'].append({"zip_path":final_arc, "original_filename":orig_fname, "item_type":item_type, "mimetype":minfo.get('mimetype','application/octet-stream'), "description":desc, "is_hidden":minfo.get('is_hidden','0')=='1'})
                             files_in_zip +=1
-                        else: app.logger.warning(f"API Export: File missing {dpath}")
+                        else: app.logger.warning(f"API Export: File missing {rpath}")
                     else: app.logger.warning(f"API Export: Filepath missing for {mid}")
             
             if files_in_zip == 0:
@@ -1481,6 +4167,7 @@ def api_export_batch(batch_id, batch_data):
 
 # --- Public Access Endpoints (for shared Lightboxes) ---
 @app.route(f'{API_PREFIX}/public/batches/<string:share_token>', methods=['GET', 'OPTIONS'])
+@rate_limited('public_ip', 'public_token')
 def api_public_batch_view(share_token):
     if request.method == 'OPTIONS': return '', 204
     if not redis_client: return jsonify(success=False, message="DB unavailable."), 503
@@ -1504,7 +4191,7 @@ def api_public_batch_view(share_token):
             batch_info['last_modified_timestamp'] = float(batch_info['last_modified_timestamp'])
 
         media_ids = redis_client.lrange(f'batch:{batch_id_str}:media_ids', 0, -1)
-        media_list = []; valid_items = 0
+        media_list = []; valid_items = 0; urls = public_media_urls(share_token)
         
         for mid in media_ids:
             mdata = redis_client.hgetall(f'media:{mid}')
@@ -1519,9 +4206,17 @@ def api_public_batch_view(share_token):
 
                 rpath = mdata.get('filepath')
                 if rpath:
-                    mdata['public_display_url'] = url_for('api_public_display_media_item', share_token=share_token, media_id=mid, _external=True)
-                    mdata['public_download_url'] = url_for('api_public_download_media_item', share_token=share_token, media_id=mid, _external=True)
-                    
+                    mdata['public_display_url'] = urls['public_display_url'](mid)
+                    mdata['public_download_url'] = urls['public_download_url'](mid)
+                    has_derivatives = mdata.get('derivatives_status') == 'completed'
+                    mdata['public_thumb_url'] = urls['public_thumb_url'](mid) if has_derivatives else None
+                    mdata['public_preview_url'] = urls['public_preview_url'](mid) if has_derivatives else None
+                    has_video_previews = mdata.get('video_previews_status') == 'completed'
+                    mdata['public_poster_url'] = urls['public_poster_url'](mid) if has_video_previews else None
+                    mdata['public_sprite_vtt_url'] = urls['public_sprite_vtt_url'](mid) if has_video_previews else None
+                    mdata['display_mimetype'] = display_source(mdata)[1]
+                    for internal_field in [k for k in mdata if k.startswith(('derivative', 'video_previews', 'hls_', 'display_status', 'display_error', 'display_filepath', 'display_bytes'))]: mdata.pop(internal_field)
+
                     media_list.append(mdata)
                     valid_items += 1
                 else:
@@ -1529,11 +4224,7 @@ def api_public_batch_view(share_token):
         
         batch_info['item_count'] = valid_items
         
-        return jsonify(
-            success=True,
-            batch=batch_info,
-            media_items=media_list
-        ), 200
+        return listing_response({'success': True, 'batch': batch_info, 'media_items': media_list})
 
     except redis.exceptions.RedisError as e:
         app.logger.error(f"API: Redis error public_batch_view {share_token}: {e}", exc_info=True)
@@ -1543,6 +4234,7 @@ def api_public_batch_view(share_token):
         return jsonify(success=False, message="An unexpected server error occurred during public view."), 500
 
 @app.route(f'{API_PREFIX}/public/slideshow/<string:share_token>', methods=['GET', 'OPTIONS'])
+@rate_limited('public_ip', 'public_token')
 def api_public_slideshow_view(share_token):
     if request.method == 'OPTIONS': return '', 204
     if not redis_client: return jsonify(success=False, message="DB unavailable."), 503
@@ -1564,7 +4256,7 @@ def api_public_slideshow_view(share_token):
             batch_info['last_modified_timestamp'] = float(batch_info['last_modified_timestamp'])
 
         media_ids = redis_client.lrange(f'batch:{batch_id_str}:media_ids', 0, -1)
-        js_media_list = []
+        js_media_list = []; urls = public_media_urls(share_token)
         
         for mid in media_ids:
             mdata = redis_client.hgetall(f'media:{mid}')
@@ -1574,8 +4266,12 @@ def api_public_slideshow_view(share_token):
                 if rpath and mimetype and mimetype.startswith(('image/','video/','audio/')):
                     js_media_list.append({
                         'id': mid,
-                        'public_display_url': url_for('api_public_display_media_item', share_token=share_token, media_id=mid, _external=True),
+                        'public_display_url': urls['public_display_url'](mid),
+                        'public_preview_url': urls['public_preview_url'](mid) if mdata.get('derivatives_status') == 'completed' else None,
+                        'public_poster_url': urls['public_poster_url'](mid) if mdata.get('video_previews_status') == 'completed' else None,
+                        'hls_url': urls['hls_url'](mid) if mdata.get('hls_status') == 'completed' else None,
                         'mimetype': mimetype,
+                        'display_mimetype': display_source(mdata)[1],
                         'original_filename': mdata.get('original_filename','unknown'),
                         'description': mdata.get('description', '')
                     })
@@ -1583,12 +4279,7 @@ def api_public_slideshow_view(share_token):
         if not js_media_list:
             return jsonify(success=False, message="No playable media items available for slideshow in this Lightbox."), 404
         
-        return jsonify(
-            success=True,
-            batch=batch_info,
-            media_data=js_media_list,
-            is_public_view=True
-        ), 200
+        return listing_response({'success': True, 'batch': batch_info, 'media_data': js_media_list, 'is_public_view': True})
 
     except redis.exceptions.RedisError as e:
         app.logger.error(f"API: Redis error public_slideshow {share_token}: {e}", exc_info=True)
@@ -1598,6 +4289,7 @@ def api_public_slideshow_view(share_token):
         return jsonify(success=False, message="An unexpected server error occurred during public slideshow view."), 500
 
 @app.route(f'{API_PREFIX}/public/media/<string:share_token>/<uuid:media_id>/display', methods=['GET', 'OPTIONS'])
+@rate_limited('public_ip', 'public_token')
 def api_public_display_media_item(share_token, media_id):
     if request.method == 'OPTIONS': return '', 204
     if not redis_client: abort(503, description="DB unavailable.")
@@ -1618,21 +4310,21 @@ def api_public_display_media_item(share_token, media_id):
             app.logger.warning(f"API: Public display: Item {media_id} conditions not met (e.g., not found, hidden, not completed, not media/blob).")
             abort(404, description="File not found or not available for public display.")
         
-        rpath = mdata.get('filepath'); orig_fname = mdata.get('original_filename',f"display_{media_id}.bin")
-        mime = mdata.get('mimetype','application/octet-stream')
+        rpath, mime = display_source(mdata); orig_fname = mdata.get('original_filename',f"display_{media_id}.bin")
         
         if not rpath:
             app.logger.error(f"API: Public display item {media_id} failed: No filepath.")
             abort(404, description="File information missing for public display.")
         
-        dpath = os.path.join(app.config['UPLOAD_FOLDER'], rpath)
-        if not os.path.isfile(dpath):
-            app.logger.error(f"API: Public display item {media_id} (path: {dpath}) failed: File not found on server.")
+        if not storage.exists(rpath):
+            app.logger.error(f"API: Public display item {media_id} (key: {rpath}) failed: File not found on server.")
             abort(404, description="File not found on server for public display.")
         
         app.logger.info(f"API: Public display for '{orig_fname}' (ID: {media_id}) via token {share_token}.")
-        return send_file(dpath, mimetype=mime, as_attachment=False, download_name=orig_fname)
+        return storage.serve(rpath, mime, as_attachment=False, download_name=orig_fname)
 
+    except HTTPException:
+        raise
     except redis.exceptions.RedisError as e:
         app.logger.error(f"API: Redis error public_display {share_token} media {media_id}: {e}", exc_info=True)
         abort(500, description="Database error during public display.")
@@ -1641,6 +4333,7 @@ def api_public_display_media_item(share_token, media_id):
         abort(500, description="An unexpected server error occurred during public display.")
 
 @app.route(f'{API_PREFIX}/public/media/<string:share_token>/<uuid:media_id>/download', methods=['GET', 'OPTIONS'])
+@rate_limited('public_ip', 'public_token')
 def api_public_download_media_item(share_token, media_id):
     if request.method == 'OPTIONS': return '', 204
     if not redis_client: abort(503, description="DB unavailable.")
@@ -1668,14 +4361,15 @@ def api_public_download_media_item(share_token, media_id):
             app.logger.error(f"API: Public download item {media_id} failed: No filepath.")
             abort(404, description="File information missing for public download.")
         
-        dpath = os.path.join(app.config['UPLOAD_FOLDER'], rpath)
-        if not os.path.isfile(dpath):
-            app.logger.error(f"API: Public download item {media_id} (path: {dpath}) failed: File not found on server.")
+        if not storage.exists(rpath):
+            app.logger.error(f"API: Public download item {media_id} (key: {rpath}) failed: File not found on server.")
             abort(404, description="File not found on server for public download.")
         
         app.logger.info(f"API: Public download for '{orig_fname}' (ID: {media_id}) via token {share_token}.")
-        return send_file(dpath, mimetype=mime, as_attachment=True, download_name=orig_fname)
+        return storage.serve(rpath, mime, as_attachment=True, download_name=orig_fname)
 
+    except HTTPException:
+        raise
     except redis.exceptions.RedisError as e:
         app.logger.error(f"API: Redis error public_download {share_token} media {media_id}: {e}", exc_info=True)
         abort(500, description="Database error during public download.")
@@ -1683,26 +4377,145 @@ def api_public_download_media_item(share_token, media_id):
         app.logger.error(f"API: Unexpected error public_download {share_token} media {media_id}: {e}", exc_info=True)
         abort(500, description="An unexpected server error occurred during public download.")
 
+def _get_public_media_or_abort(share_token, media_id, context):
+    # Share-token checks shared by the public per-item endpoints; aborts with 404/403 like the display route.
+    batch_id_str = redis_client.get(f'share_token:{share_token}')
+    if not batch_id_str:
+        app.logger.warning(f"API: Public {context}: Invalid share token: {share_token}")
+        abort(404, description="Invalid or expired share link.")
+    if redis_client.hget(f'batch:{batch_id_str}', 'is_shared') != '1':
+        app.logger.warning(f"API: Public {context}: Access attempt to non-shared batch {batch_id_str} via token {share_token}")
+        abort(403, description="Lightbox is not publicly shared.")
+    mdata = redis_client.hgetall(f'media:{media_id}')
+    if not mdata or mdata.get('batch_id')!=batch_id_str or mdata.get('is_hidden','0')=='1' or mdata.get('processing_status')!='completed' or mdata.get('item_type') not in ['media', 'blob']:
+        app.logger.warning(f"API: Public {context}: Item {media_id} conditions not met (e.g., not found, hidden, not completed, not media/blob).")
+        abort(404, description="File not found or not available publicly.")
+    return mdata
+
+@app.route(f'{API_PREFIX}/public/media/<string:share_token>/<uuid:media_id>/thumb/<string:size_name>', methods=['GET', 'OPTIONS'])
+@rate_limited('public_ip', 'public_token')
+def api_public_media_thumbnail(share_token, media_id, size_name):
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: abort(503, description="DB unavailable.")
+    try:
+        mdata = _get_public_media_or_abort(share_token, media_id, 'thumb')
+        return _serve_derivative(mdata, media_id, size_name, 'public')
+    except HTTPException:
+        raise
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error public_thumb {share_token} media {media_id}: {e}", exc_info=True)
+        abort(500, description="Database error during public thumbnail.")
+    except Exception as e:
+        app.logger.error(f"API: Unexpected error public_thumb {share_token} media {media_id}: {e}", exc_info=True)
+        abort(500, description="An unexpected server error occurred during public thumbnail.")
+
+@app.route(f'{API_PREFIX}/public/media/<string:share_token>/<uuid:media_id>/video/<string:asset>', methods=['GET', 'OPTIONS'])
+@rate_limited('public_ip', 'public_token')
+def api_public_media_video_asset(share_token, media_id, asset):
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: abort(503, description="DB unavailable.")
+    try:
+        mdata = _get_public_media_or_abort(share_token, media_id, 'video asset')
+        return _serve_video_asset(mdata, media_id, asset, 'public')
+    except HTTPException:
+        raise
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error public_video_asset {share_token} media {media_id}: {e}", exc_info=True)
+        abort(500, description="Database error during public video preview.")
+    except Exception as e:
+        app.logger.error(f"API: Unexpected error public_video_asset {share_token} media {media_id}: {e}", exc_info=True)
+        abort(500, description="An unexpected server error occurred during public video preview.")
+
+@app.route(f'{API_PREFIX}/public/media/<string:share_token>/<uuid:media_id>/render', methods=['GET', 'OPTIONS'])
+@rate_limited('public_ip', 'public_token')
+def api_public_render_media_item(share_token, media_id):
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: abort(503, description="DB unavailable.")
+    try:
+        mdata = _get_public_media_or_abort(share_token, media_id, 'render')
+        return _serve_render(str(media_id), mdata, 'public')
+    except HTTPException:
+        raise
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error public_render {share_token} media {media_id}: {e}", exc_info=True)
+        abort(500, description="Database error during public render.")
+    except Exception as e:
+        app.logger.error(f"API: Unexpected error public_render {share_token} media {media_id}: {e}", exc_info=True)
+        abort(500, description="An unexpected server error occurred during public render.")
+
+HLS_ASSET_PATTERN = re.compile(r'^(master\.m3u8|v\d{1,2}/(index\.m3u8|seg_\d{5,}\.ts))$')
+
+@app.route(f'{API_PREFIX}/public/media/<string:share_token>/<uuid:media_id>/hls/<path:asset>', methods=['GET', 'OPTIONS'])
+@rate_limited('public_ip', 'public_token')
+def api_public_media_hls(share_token, media_id, asset):
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: abort(503, description="DB unavailable.")
+    if not HLS_ASSET_PATTERN.match(asset):
+        abort(404, description="Unknown HLS asset.")
+    try:
+        mdata = _get_public_media_or_abort(share_token, media_id, 'hls')
+        if mdata.get('hls_status') != 'completed' or not mdata.get('hls_prefix'):
+            abort(404, description="No HLS package for this item.")
+        key = f"{mdata['hls_prefix']}/{asset}"
+        is_playlist = asset.endswith('.m3u8')
+        response = storage.serve(key, 'application/vnd.apple.mpegurl' if is_playlist else 'video/mp2t', as_attachment=False, download_name=asset.rsplit('/', 1)[-1])
+        # Segments never change once written; playlists get a short TTL so revoking a share takes effect quickly.
+        response.headers['Cache-Control'] = f"public, max-age={app.config['HLS_PLAYLIST_MAX_AGE']}" if is_playlist else f"public, max-age={app.config['HLS_SEGMENT_MAX_AGE']}, immutable"
+        return response
+    except HTTPException:
+        raise
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error public_hls {share_token} media {media_id}: {e}", exc_info=True)
+        abort(500, description="Database error during public HLS delivery.")
+    except Exception as e:
+        app.logger.error(f"API: Unexpected error public_hls {share_token} media {media_id} asset {asset}: {e}", exc_info=True)
+        abort(500, description="An unexpected server error occurred during public HLS delivery.")
+
 
 # --- Admin Dashboard Endpoints ---
+ADMIN_USERS_DEFAULT_PAGE = 100
+ADMIN_USERS_MAX_PAGE = 1000
+ADMIN_USER_FIELDS = ['is_admin', 'email', 'quota_bytes']
+
 @app.route(f'{API_PREFIX}/admin/users', methods=['GET', 'OPTIONS'])
 @login_required_api
 @admin_required_api
 def api_admin_dashboard():
+    # ?limit=&cursor=&q= : one page of users in case-insensitive name order, optionally filtered by name prefix.
+    # next_cursor is null on the last page. Only display fields are projected; password hashes never leave Redis.
     if request.method == 'OPTIONS': return '', 204
     if not redis_client: return jsonify(success=False, message="DB unavailable."), 503
-    
+
+    try: limit = max(1, min(ADMIN_USERS_MAX_PAGE, int(request.args.get('limit', ADMIN_USERS_DEFAULT_PAGE))))
+    except ValueError: return jsonify(success=False, message="limit must be an integer."), 400
+    prefix = request.args.get('q', '').strip().lower()
+    cursor = request.args.get('cursor', '')
+    try: after = base64.urlsafe_b64decode(cursor.encode()).decode() if cursor else ''
+    except (ValueError, UnicodeDecodeError): return jsonify(success=False, message="Invalid cursor."), 400
+
+    range_min = f"({after}" if after else (f"[{prefix}" if prefix else '-')
+    range_max = f"({prefix}{USERS_INDEX_MAX}" if prefix else '+'
     try:
-        usernames = redis_client.smembers('users')
+        members = redis_client.zrangebylex(USERS_INDEX_KEY, range_min, range_max, start=0, num=limit + 1)
+        has_more = len(members) > limit; members = members[:limit]
+        usernames = [m.split('\x00', 1)[1] for m in members]
+
+        redis_pipe = redis_client.pipeline(transaction=False)
+        redis_pipe.zcard(USERS_INDEX_KEY)
+        for uname in usernames:
+            redis_pipe.hmget(f'user:{uname}', ADMIN_USER_FIELDS)
+            redis_pipe.llen(f'user:{uname}:batches')
+            redis_pipe.hmget(f'usage:user:{uname}', ['bytes', 'items'])
+        total_users, *rows = redis_pipe.execute()
+
         users_data = []
-        for uname in sorted(list(usernames),key=lambda s:s.lower()):
-            uinfo = redis_client.hgetall(f'user:{uname}')
-            uinfo['username'] = uname
-            uinfo['is_admin'] = uinfo.get('is_admin', '0') == '1'
-            uinfo['batch_count'] = redis_client.llen(f'user:{uname}:batches')
-            users_data.append(uinfo)
-        
-        return jsonify(success=True, users=users_data), 200
+        for i, uname in enumerate(usernames):
+            (is_admin, email, quota_field), batch_count, (used_bytes, used_items) = rows[3 * i:3 * i + 3]
+            users_data.append({'username': uname, 'is_admin': is_admin == '1', 'email': email, 'batch_count': batch_count,
+                               'stored_bytes': int(used_bytes or 0), 'stored_items': int(used_items or 0),
+                               'quota_bytes': user_quota_bytes(uname, quota_field or '')})
+        next_cursor = base64.urlsafe_b64encode(members[-1].encode()).decode() if has_more else None
+        return jsonify(success=True, users=users_data, next_cursor=next_cursor, total_users=total_users), 200
     
     except redis.exceptions.RedisError as e:
         app.logger.error(f"API: Redis error admin_dashboard: {e}", exc_info=True)
@@ -1711,6 +4524,32 @@ def api_admin_dashboard():
         app.logger.error(f"API: Unexpected error admin_dashboard: {e}", exc_info=True)
         return jsonify(success=False, message="An unexpected server error occurred."), 500
 
+@app.route(f'{API_PREFIX}/admin/users/quota', methods=['POST', 'OPTIONS'])
+@login_required_api
+@admin_required_api
+def api_set_user_quota():
+    # {"username": ..., "quota_bytes": int} sets a per-user quota (0 = unlimited); "quota_bytes": null reverts to USER_QUOTA_BYTES.
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: return jsonify(success=False, message="DB unavailable."), 503
+
+    data = request.get_json(silent=True) or {}
+    target_user = data.get('username'); quota = data.get('quota_bytes')
+    if not target_user or 'quota_bytes' not in data:
+        return jsonify(success=False, message="username and quota_bytes are required."), 400
+    if quota is not None and (not isinstance(quota, int) or isinstance(quota, bool) or quota < 0):
+        return jsonify(success=False, message="quota_bytes must be a non-negative integer or null."), 400
+    try:
+        if not redis_client.sismember('users', target_user):
+            return jsonify(success=False, message=f'User "{target_user}" not found.'), 404
+        if quota is None: redis_client.hdel(f'user:{target_user}', 'quota_bytes')
+        else: redis_client.hset(f'user:{target_user}', 'quota_bytes', quota)
+        usage = read_usage(f'usage:user:{target_user}')
+        app.logger.info(f"API: Admin '{request.current_identity}' set quota for '{target_user}' to {quota}.")
+        return jsonify(success=True, username=target_user, quota_bytes=user_quota_bytes(target_user), stored_bytes=usage['bytes'], stored_items=usage['items']), 200
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error setting quota for {target_user}: {e}", exc_info=True)
+        return jsonify(success=False, message="Database error setting quota."), 500
+
 @app.route(f'{API_PREFIX}/admin/users/change_password', methods=['POST', 'OPTIONS'])
 @login_required_api
 @admin_required_api
@@ -1734,7 +4573,10 @@ def api_change_user_password():
         if not redis_client.sismember('users', target_user):
             return jsonify(success=False, message=f'User "{target_user}" not found.'), 404
         
-        redis_client.hset(f'user:{target_user}','password_hash',generate_password_hash(new_pass))
+        pipe = redis_client.pipeline()
+        pipe.hset(f'user:{target_user}','password_hash',generate_password_hash(new_pass))
+        queue_user_index_add(pipe, target_user)  # Self-heals accounts created outside the API.
+        pipe.execute()
         
         app.logger.info(f"API: Admin '{request.current_identity}' changed password for '{target_user}'.")
         return jsonify(success=True, message=f'Password updated for user "{target_user}".', username=target_user), 200
@@ -1746,6 +4588,100 @@ def api_change_user_password():
         app.logger.error(f"API: Unexpected error changing password for {target_user}: {e}", exc_info=True)
         return jsonify(success=False, message="An unexpected server error occurred."), 500
 
+@app.route(f'{API_PREFIX}/admin/task-stats', methods=['GET', 'OPTIONS'])
+@login_required_api
+@admin_required_api
+def api_admin_task_stats():
+    # ?hours=24 : per-queue, per-task run counts, failure/retry reasons, queue wait, run time, bytes and xrealtime.
+    if request.method == 'OPTIONS': return '', 204
+    if not redis_client: return jsonify(success=False, message="DB unavailable."), 503
+
+    try: hours = max(1, min(app.config['TASK_STATS_RETENTION_HOURS'], int(request.args.get('hours', 24))))
+    except ValueError: return jsonify(success=False, message="hours must be an integer."), 400
+    try:
+        return jsonify(success=True, hours=hours, queues=task_stats_summary(redis_client, hours)), 200
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"API: Redis error reading task stats: {e}", exc_info=True)
+        return jsonify(success=False, message="Database error reading task stats."), 500
+
+
+# --- Maintenance Commands ---
+@app.cli.command('migrate-disk-names')
+@click.option('--dry-run', is_flag=True, help="Report what would be moved without touching storage or Redis.")
+def migrate_disk_names_command(dry_run):
+    """Move stored files to the item-ID, hash-sharded layout (<owner>/<batch>/ab/cd/<media_id><ext>) and update Redis."""
+    if not redis_client:
+        raise click.ClickException("Redis not connected; cannot migrate.")
+    moved = skipped = missing = 0
+    for media_key in redis_client.scan_iter(match='media:*', count=500):
+        media_id = media_key.split(':', 1)[1]
+        fname, rpath, status = redis_client.hmget(media_key, ['filename_on_disk', 'filepath', 'processing_status'])
+        if not fname or not rpath or status not in ('completed', 'completed_import', 'failed', 'failed_import'):
+            skipped += 1; continue
+        rpath = rpath.replace(os.sep, '/')
+        batch_segment = '/'.join(rpath.split('/')[:2])
+        new_rpath, new_fname = item_storage_key(batch_segment, media_id, os.path.splitext(fname)[1].lower())
+        if rpath == new_rpath:
+            continue
+        if not storage.exists(rpath):
+            missing += 1; app.logger.warning(f"Migrate: File for media {media_id} missing: {rpath}"); continue
+        if dry_run:
+            click.echo(f"{rpath} -> {new_rpath}"); moved += 1; continue
+        # Copy, repoint Redis, then delete: an interrupted run leaves both copies and is safe to re-run.
+        storage.copy(rpath, new_rpath)
+        redis_client.hset(media_key, mapping={'filename_on_disk': new_fname, 'filepath': new_rpath})
+        storage.delete(rpath)
+        moved += 1
+    click.echo(f"{'Would move' if dry_run else 'Moved'} {moved} file(s); skipped {skipped} in-flight/incomplete record(s); {missing} missing in storage.")
+
+@app.cli.command('bootstrap')
+def bootstrap_command():
+    """Create the admin user and backfill the user index now instead of on the first request."""
+    try: bootstrap_app_data(redis_client)
+    except redis.exceptions.RedisError as e: raise click.ClickException(f"Redis error: {e}")
+    _bootstrap_state['done'] = True
+    click.echo("Bootstrap complete.")
+
+@app.cli.command('rebuild-user-index')
+def rebuild_user_index_command():
+    """Add every account in 'users' to the sorted admin user index (safe to re-run)."""
+    if not redis_client:
+        raise click.ClickException("Redis not connected; cannot rebuild the user index.")
+    click.echo(f"Indexed {backfill_user_index(redis_client)} user(s).")
+
+@app.cli.command('reconcile-usage')
+def reconcile_usage_command():
+    """Rebuild per-user and per-batch storage counters (and each item's stored_bytes) from what is actually in storage."""
+    if not redis_client:
+        raise click.ClickException("Redis not connected; cannot reconcile usage.")
+    click.echo(json.dumps(reconcile_usage_task.apply().get(), indent=2))
+
+@app.cli.command('gc')
+def gc_command():
+    """Run one bounded garbage-collection pass now (the same task Celery beat schedules) and print what it reclaimed."""
+    if not redis_client:
+        raise click.ClickException("Redis not connected; cannot run GC.")
+    click.echo(json.dumps(garbage_collect_task.apply().get(), indent=2))
+
+@app.cli.command('generate-derivatives')
+@click.option('--force', is_flag=True, help="Re-render items that already have derivatives.")
+def generate_derivatives_command(force):
+    """Queue preview generation (thumbnails, video posters/sprites, HLS when enabled) for completed items (backfill)."""
+    if not redis_client:
+        raise click.ClickException("Redis not connected; cannot queue derivatives.")
+    queued = 0
+    for media_key in redis_client.scan_iter(match='media:*', count=500):
+        mimetype, status, deriv_status, video_status, hls_status = redis_client.hmget(media_key, ['mimetype', 'processing_status', 'derivatives_status', 'video_previews_status', 'hls_status'])
+        if status != 'completed':
+            continue
+        done = {generate_derivatives_task: deriv_status, generate_video_previews_task: video_status, package_hls_task: hls_status,
+                normalize_image_task: deriv_status}
+        for task in followup_tasks_for(mimetype):
+            if done.get(task) == 'completed' and not force:
+                continue
+            task.apply_async(args=[media_key.split(':', 1)[1]])
+            queued += 1
+    click.echo(f"Queued {queued} derivative task(s).")
 
 # --- Consolidated JSON Error Handlers ---
 @app.errorhandler(400)
@@ -1785,7 +4721,7 @@ def too_many_requests_error(e):
     desc = getattr(e,'description',"Too many requests.")
     app.logger.warning(f"API 429 {request.url}: {desc}", exc_info=e if app.debug else False)
     headers=getattr(e,'headers',{})
-    return jsonify(error="Too Many Requests",message=desc),429,headers
+    return jsonify(success=False,error="Too Many Requests",message=desc),429,headers
 @app.errorhandler(500)
 def internal_server_error(e):
     orig_exc = str(getattr(e,'original_exception',e))
@@ -1797,6 +4733,17 @@ def service_unavailable_error(e):
     app.logger.error(f"API 503 {request.url}: {desc}", exc_info=True if app.debug else False)
     headers=getattr(e,'headers',{})
     return jsonify(error="Service Unavailable",message=desc),503,headers
+@app.errorhandler(redis.exceptions.ConnectionError)
+def redis_unavailable_error(e):
+    # Clients connect lazily, so an outage surfaces here rather than as redis_client = None.
+    app.logger.error(f"API 503 {request.url}: Redis unavailable: {e}")
+    return jsonify(error="Service Unavailable",message="DB unavailable."),503
+
+# --- Startup Timing ---
+app.config['STARTUP_IMPORT_MS'] = round((time.perf_counter() - STARTUP_T0) * 1000, 1)
+if app.config['STARTUP_IMPORT_MS'] > app.config['STARTUP_BUDGET_MS']:
+    app.logger.warning(f"Startup: module body took {app.config['STARTUP_IMPORT_MS']} ms (budget {app.config['STARTUP_BUDGET_MS']} ms).")
+else: app.logger.info(f"Startup: module body took {app.config['STARTUP_IMPORT_MS']} ms.")
 
 
 if __name__ == '__main__':
@@ -1805,7 +4752,7 @@ if __name__ == '__main__':
     if not os.path.exists(upload_dir):
         try: os.makedirs(upload_dir); print(f"Created UPLOAD_FOLDER: {upload_dir}")
         except OSError as e: print(f"ERROR creating UPLOAD_FOLDER {upload_dir}: {e}")
-    temp_zip_extracts_dir = os.path.join(app.config['UPLOAD_FOLDER'], "temp_zip_extracts")
+    temp_zip_extracts_dir = os.path.join(app.config['SCRATCH_FOLDER'], "temp_zip_extracts")
     if not os.path.exists(temp_zip_extracts_dir):
         try: os.makedirs(temp_zip_extracts_dir); print(f"Created temp_zip_extracts dir: {temp_zip_extracts_dir}")
         except OSError as e: print(f"ERROR creating temp_zip_extracts dir {temp_zip_extracts_dir}: {e}")
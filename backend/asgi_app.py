@@ -0,0 +1,468 @@
+# /home/www/froogle/backend/asgi_app.py
+# Async serving mode. Run from backend/ with e.g.:  uvicorn asgi_app:application --workers 4 --port 5005
+#
+# The long-lived, I/O-bound routes (owner and public display/download, batch export, batch event stream) are served
+# natively on the event loop with redis.asyncio and chunked, executor-backed storage reads, so a slow client costs a
+# coroutine instead of a whole sync worker. Every other request is handed to the unchanged Flask app on a thread pool.
+# Auth, ownership and share-token checks mirror the Flask routes of the same path.
+
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import re
+import sys
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import redis
+import redis.asyncio as aioredis
+from flask_jwt_extended import decode_token
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.http import parse_etags, parse_range_header
+from werkzeug.utils import secure_filename
+
+from api_app import (app as flask_app, storage, API_PREFIX, CORS_ORIGINS, ITEM_EVENT_KINDS, STREAM_ID_PATTERN, TOKEN_BUCKET_SCRIPT,
+                     _content_disposition, _serialize_media_item, _sse_message, _stream_id_tuple, client_ip, display_source,
+                     metrics, owner_media_urls, rate_limit_outcome, rate_limit_request, record_request_metrics, redis_client, redis_connection_kwargs)
+
+app = flask_app  # Config and logger live on the Flask app; `application` below is the ASGI entry point.
+
+app.config['ASGI_WSGI_THREADS'] = int(os.environ.get('ASGI_WSGI_THREADS', 32))  # Threads running delegated Flask requests.
+app.config['ASGI_FILE_THREADS'] = int(os.environ.get('ASGI_FILE_THREADS', 16))  # Threads doing blocking storage reads.
+app.config['ASGI_CHUNK_SIZE'] = int(os.environ.get('ASGI_CHUNK_SIZE', 256 * 1024))
+
+wsgi_executor = ThreadPoolExecutor(max_workers=app.config['ASGI_WSGI_THREADS'], thread_name_prefix='asgi-wsgi')
+file_executor = ThreadPoolExecutor(max_workers=app.config['ASGI_FILE_THREADS'], thread_name_prefix='asgi-file')
+
+# --- Async Redis ---
+# One pool per process, created on first use inside the server's event loop.
+_async_redis = {'pid': None, 'client': None}
+
+def get_async_redis():
+    if _async_redis['pid'] != os.getpid():
+        _async_redis['client'] = aioredis.Redis(connection_pool=aioredis.ConnectionPool(**redis_connection_kwargs()))
+        _async_redis['pid'] = os.getpid()
+    return _async_redis['client']
+
+# --- Response Helpers ---
+def _header(scope, name):
+    name = name.encode('latin-1')
+    return next((v.decode('latin-1') for k, v in scope['headers'] if k == name), '')
+
+def _cors_headers(scope):
+    origin = _header(scope, 'origin')
+    return [(b'access-control-allow-origin', origin.encode('latin-1')), (b'vary', b'Origin')] if origin in CORS_ORIGINS else []
+
+def _encode_headers(scope, headers):
+    return [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in headers.items()] + _cors_headers(scope)
+
+async def _send_json(scope, send, status, **payload):
+    body = json.dumps(payload).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': _encode_headers(scope, {'Content-Type': 'application/json', 'Content-Length': len(body)})})
+    await send({'type': 'http.response.body', 'body': body})
+
+def _watch_disconnect(receive):
+    # GET bodies are empty, so the next receive() only returns once the client goes away.
+    disconnected = asyncio.Event()
+    async def watch():
+        while (await receive())['type'] != 'http.disconnect': pass
+        disconnected.set()
+    task = asyncio.ensure_future(watch())
+    return disconnected, task
+
+def _identity(scope):
+    # Same token checks as verify_jwt_in_request(); returns the username or None.
+    auth = _header(scope, 'authorization')
+    if not auth.startswith('Bearer '): return None
+    try:
+        with app.app_context(): return decode_token(auth[7:])['sub']
+    except Exception:
+        return None
+
+async def _owned_item(scope, send, r, item_type, item_id):
+    # Async twin of owner_or_admin_access_required_api: returns (username, item hash) or sends the error and returns None.
+    username = _identity(scope)
+    if not username:
+        await _send_json(scope, send, 401, success=False, message="Authentication required."); return None
+    redis_pipe = r.pipeline(transaction=False)
+    redis_pipe.hgetall(f'{item_type}:{item_id}'); redis_pipe.hget(f'user:{username}', 'is_admin')
+    item_data, is_admin = await redis_pipe.execute()
+    if not item_data or (item_type == 'batch' and item_data.get('deleting') == '1'):
+        await _send_json(scope, send, 404, success=False, message=f"{item_type.capitalize()} not found."); return None
+    owner = item_data.get('uploader_user_id' if item_type == 'media' else 'user_id')
+    if owner != username and is_admin != '1':
+        app.logger.warning(f"ASGI: User '{username}' attempted unauthorized access to {item_type} '{item_id}' owned by '{owner}'.")
+        await _send_json(scope, send, 403, success=False, message=f"No permission for this {item_type}."); return None
+    return username, item_data
+
+async def _check_rate_limits(scope, send, checks):
+    # Same buckets and script as the Flask rate_limited decorator. Returns headers to add, or None once a 429 was sent.
+    if not checks or not app.config['RATE_LIMIT_ENABLED']: return {}
+    keys, args = rate_limit_request(checks)
+    try: reply = await get_async_redis().register_script(TOKEN_BUCKET_SCRIPT)(keys=keys, args=args)
+    except redis.exceptions.RedisError as e:
+        app.logger.warning(f"ASGI: Rate limit check skipped (Redis error): {e}")
+        return {}
+    allowed, headers = rate_limit_outcome(checks, reply)
+    if allowed: return headers
+    body = json.dumps({'success': False, 'error': "Too Many Requests", 'message': "Too many requests. Please slow down and try again later."}).encode()
+    await send({'type': 'http.response.start', 'status': 429,
+                'headers': _encode_headers(scope, {'Content-Type': 'application/json', 'Content-Length': len(body), **headers})})
+    await send({'type': 'http.response.body', 'body': body})
+    return None
+
+async def _iter_storage(key, start=0, end=None):
+    # Pulls storage.open_range() one chunk at a time on the file pool, so a slow reader never blocks the loop.
+    loop = asyncio.get_running_loop()
+    chunks = storage.open_range(key, start, end, chunk_size=app.config['ASGI_CHUNK_SIZE'])
+    try:
+        while True:
+            chunk = await loop.run_in_executor(file_executor, next, chunks, None)
+            if chunk is None: return
+            yield chunk
+    finally:
+        await loop.run_in_executor(file_executor, chunks.close)
+
+async def _stream_storage_file(scope, receive, send, key, mimetype, as_attachment, download_name, extra_headers=None):
+    # Conditional (ETag) and single-range GET, matching what storage.serve() gives the Flask routes.
+    info = await asyncio.get_running_loop().run_in_executor(file_executor, storage.stat, key) if key else None
+    if info is None:
+        await _send_json(scope, send, 404, error="Not Found", message="File not found on server."); return
+    size, etag = info
+    headers = {'Content-Type': mimetype, 'Accept-Ranges': 'bytes', 'Content-Disposition': _content_disposition(as_attachment, download_name), **(extra_headers or {})}
+    if etag:
+        headers['ETag'] = f'"{etag}"'
+        if parse_etags(_header(scope, 'if-none-match') or None).contains(etag):
+            await send({'type': 'http.response.start', 'status': 304, 'headers': _encode_headers(scope, headers)})
+            await send({'type': 'http.response.body', 'body': b''}); return
+    requested_range = parse_range_header(_header(scope, 'range') or None)  # None (serve it all) when absent or malformed.
+    byte_range = requested_range.range_for_length(size) if requested_range else None
+    if requested_range and byte_range is None:
+        headers['Content-Range'] = f"bytes */{size}"
+        await send({'type': 'http.response.start', 'status': 416, 'headers': _encode_headers(scope, headers)})
+        await send({'type': 'http.response.body', 'body': b''}); return
+    start, stop = byte_range or (0, size)
+    if byte_range: headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+    headers['Content-Length'] = stop - start
+    await send({'type': 'http.response.start', 'status': 206 if byte_range else 200, 'headers': _encode_headers(scope, headers)})
+    disconnected, watcher = _watch_disconnect(receive)
+    try:
+        if stop > start:
+            async with contextlib.aclosing(_iter_storage(key, start, stop - 1)) as chunks:
+                async for chunk in chunks:
+                    if disconnected.is_set(): return
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+
+# --- Native Routes ---
+async def serve_owned_media(scope, receive, send, media_id, action):
+    owned = await _owned_item(scope, send, get_async_redis(), 'media', media_id)
+    if not owned: return
+    username, mdata = owned
+    if action == 'display': key, mime = display_source(mdata)
+    else: key, mime = mdata.get('filepath'), mdata.get('mimetype', 'application/octet-stream')
+    download_name = mdata.get('original_filename', f"{action}_{media_id}.bin")
+    app.logger.info(f"ASGI: User '{username}' {'serving/displaying' if action == 'display' else 'downloading'} '{download_name}' (ID: {media_id})")
+    await _stream_storage_file(scope, receive, send, key, mime, action == 'download', download_name)
+
+async def serve_public_media(scope, receive, send, share_token, media_id, action):
+    ip = client_ip((scope.get('client') or ('',))[0], _header(scope, 'x-forwarded-for'))
+    rate_limit_headers = await _check_rate_limits(scope, send, [('public_ip', ip), ('public_token', share_token)])
+    if rate_limit_headers is None: return
+    r = get_async_redis()
+    batch_id_str = await r.get(f'share_token:{share_token}')
+    if not batch_id_str:
+        await _send_json(scope, send, 404, error="Not Found", message="Invalid or expired share link."); return
+    redis_pipe = r.pipeline(transaction=False)
+    redis_pipe.hget(f'batch:{batch_id_str}', 'is_shared'); redis_pipe.hgetall(f'media:{media_id}')
+    is_shared, mdata = await redis_pipe.execute()
+    if is_shared != '1':
+        await _send_json(scope, send, 403, error="Forbidden", message="Lightbox is not publicly shared."); return
+    if not mdata or mdata.get('batch_id') != batch_id_str or mdata.get('is_hidden', '0') == '1' or mdata.get('processing_status') != 'completed' or mdata.get('item_type') not in ['media', 'blob']:
+        await _send_json(scope, send, 404, error="Not Found", message="File not found or not available publicly."); return
+    if action == 'display': key, mime = display_source(mdata)
+    else: key, mime = mdata.get('filepath'), mdata.get('mimetype', 'application/octet-stream')
+    download_name = mdata.get('original_filename', f"{action}_{media_id}.bin")
+    app.logger.info(f"ASGI: Public {action} for '{download_name}' (ID: {media_id}) via token {share_token}.")
+    await _stream_storage_file(scope, receive, send, key, mime, action == 'download', download_name, rate_limit_headers)
+
+async def stream_batch_events(scope, receive, send, batch_id):
+    # Same protocol as api_batch_events: resume from Last-Event-ID or ?cursor=, 'resync' when the cursor was trimmed.
+    r = get_async_redis()
+    owned = await _owned_item(scope, send, r, 'batch', batch_id)
+    if not owned: return
+    username, _ = owned
+    stream_key = f'batch_events:{batch_id}'
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    cursor = _header(scope, 'last-event-id') or query.get('cursor', [''])[0]
+    if cursor and not STREAM_ID_PATTERN.match(cursor):
+        await _send_json(scope, send, 400, success=False, message="Invalid event cursor."); return
+    try:
+        redis_pipe = r.pipeline(transaction=False)
+        redis_pipe.xrevrange(stream_key, count=1); redis_pipe.xrange(stream_key, count=1)
+        newest, oldest = await redis_pipe.execute()
+    except redis.exceptions.RedisError as e:
+        app.logger.error(f"ASGI: Redis error opening event stream for batch {batch_id}: {e}")
+        await _send_json(scope, send, 500, success=False, message="Database error."); return
+    latest_id = newest[0][0] if newest else '0-0'
+    cursor = cursor or latest_id
+    needs_resync = cursor != '0-0' and (not oldest or _stream_id_tuple(cursor) < _stream_id_tuple(oldest[0][0]))
+    deadline = time.monotonic() + app.config['SSE_MAX_STREAM_SECONDS']
+    # Item URLs are built with url_for(_external=True), so they need the host the client actually used.
+    host = _header(scope, 'host') or f"{scope['server'][0]}:{scope['server'][1]}"
+    base_url = f"{scope.get('scheme', 'http')}://{host}{scope.get('root_path', '')}"
+    app.logger.info(f"ASGI: User '{username}' subscribed to events for batch '{batch_id}' from {cursor}.")
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': _encode_headers(scope, {
+        'Content-Type': 'text/event-stream; charset=utf-8', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})})
+    disconnected, watcher = _watch_disconnect(receive)
+    try:
+        last_id = cursor
+        message = f"retry: {app.config['SSE_RETRY_MS']}\n\n"
+        if needs_resync:
+            last_id = latest_id
+            message += _sse_message('resync', {'batch_id': batch_id}, latest_id)
+        await send({'type': 'http.response.body', 'body': message.encode(), 'more_body': True})
+        while time.monotonic() < deadline and not disconnected.is_set():
+            try:
+                response = await r.xread({stream_key: last_id}, count=100, block=app.config['SSE_BLOCK_MS'])
+                entries = [entry for _, stream_entries in response for entry in stream_entries] if response else []
+                item_ids = list(dict.fromkeys(f['media_id'] for _, f in entries if f.get('kind') in ITEM_EVENT_KINDS))
+                redis_pipe = r.pipeline(transaction=False)
+                for mid in item_ids: redis_pipe.hgetall(f'media:{mid}')
+                item_hashes = await redis_pipe.execute() if item_ids else []
+            except redis.exceptions.RedisError as e:
+                app.logger.error(f"ASGI: Redis error streaming events for batch {batch_id}: {e}")
+                break  # The client reconnects with Last-Event-ID after the retry interval.
+            if not entries:
+                await send({'type': 'http.response.body', 'body': b": keepalive\n\n", 'more_body': True}); continue
+            with app.test_request_context('/', base_url=base_url):
+                urls = owner_media_urls() if item_ids else None
+                items = {mid: _serialize_media_item(mid, mdata, urls) for mid, mdata in zip(item_ids, item_hashes) if mdata}
+            message = ''
+            for entry_id, fields in entries:
+                last_id = entry_id
+                payload = {k: v for k, v in fields.items() if k != 'kind'}
+                if fields.get('kind') in ITEM_EVENT_KINDS and fields.get('media_id') in items: payload['item'] = items[fields['media_id']]
+                message += _sse_message(fields.get('kind', 'status'), payload, entry_id)
+            await send({'type': 'http.response.body', 'body': message.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+
+class _ZipSink:
+    # Write-only target for ZipFile; it has no tell(), so zipfile streams entries with data descriptors.
+    def __init__(self): self.parts = []; self.pending = 0
+    def write(self, data): self.parts.append(bytes(data)); self.pending += len(data); return len(data)
+    def flush(self): pass
+    def drain(self):
+        data = b''.join(self.parts); self.parts = []; self.pending = 0
+        return data
+
+STORED_MIME_PREFIXES = ('image/', 'video/', 'audio/')  # Already compressed (or not worth deflating on the event loop).
+
+async def stream_batch_export(scope, receive, send, batch_id):
+    # Streams the same ZIP as api_export_batch, entry by entry, instead of assembling it in memory first.
+    r = get_async_redis()
+    owned = await _owned_item(scope, send, r, 'batch', batch_id)
+    if not owned: return
+    username, batch_data = owned
+    media_ids = await r.lrange(f'batch:{batch_id}:media_ids', 0, -1)
+    if not media_ids:
+        await _send_json(scope, send, 404, success=False, message="Lightbox is empty or contains no exportable items."); return
+    redis_pipe = r.pipeline(transaction=False)
+    for mid in media_ids: redis_pipe.hgetall(f'media:{mid}')
+    candidates = [(idx, mid, minfo) for idx, (mid, minfo) in enumerate(zip(media_ids, await redis_pipe.execute()))
+                  if minfo and minfo.get('is_hidden', '0') == '0' and minfo.get('processing_status', 'completed') == 'completed'
+                  and minfo.get('item_type') != 'archive_import' and minfo.get('filepath')]
+    loop = asyncio.get_running_loop()
+    present = await asyncio.gather(*(loop.run_in_executor(file_executor, storage.exists, minfo['filepath']) for _, _, minfo in candidates))
+    exportable = [c for c, ok in zip(candidates, present) if ok]
+    for (_, mid, minfo), ok in zip(candidates, present):
+        if not ok: app.logger.warning(f"ASGI Export: File missing {minfo['filepath']}")
+    if not exportable:
+        await _send_json(scope, send, 404, success=False, message="No exportable files found in this Lightbox."); return
+
+    safe_name = secure_filename(batch_data.get('name', f'batch_{batch_id[:8]}')).replace(' ', '_')
+    zip_fname = f"LightBox_{safe_name}_Export_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    manifest = {"lightbox_name": batch_data.get('name', 'Untitled'), "export_version": "1.1",
+                "export_date": datetime.datetime.now(datetime.timezone.utc).isoformat(), "batch_id_exported_from": batch_id, "files": []}
+    app.logger.info(f"ASGI: User '{username}' exporting {len(exportable)} items from batch '{batch_id}'.")
+    await send({'type': 'http.response.start', 'status': 200, 'headers': _encode_headers(scope, {
+        'Content-Type': 'application/zip', 'Content-Disposition': _content_disposition(True, zip_fname)})})
+    disconnected, watcher = _watch_disconnect(receive)
+    sink = _ZipSink(); chunk_size = app.config['ASGI_CHUNK_SIZE']; zip_fnames_used = set()
+    try:
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for idx, mid, minfo in exportable:
+                orig_fname = minfo.get('original_filename', f"item_{mid}"); mimetype = minfo.get('mimetype', 'application/octet-stream')
+                base, ext = os.path.splitext(orig_fname); arc_base = secure_filename(base if base else f"item_{idx}"); final_arc = f"{arc_base}{ext if ext else '.bin'}"
+                ct = 0
+                while final_arc in zip_fnames_used: ct += 1; final_arc = f"{arc_base}_{ct}{ext if ext else '.bin'}"
+                zip_fnames_used.add(final_arc)
+                zinfo = zipfile.ZipInfo(final_arc, date_time=time.localtime()[:6]); zinfo.external_attr = 0o644 << 16
+                zinfo.compress_type = zipfile.ZIP_STORED if mimetype.startswith(STORED_MIME_PREFIXES) else zipfile.ZIP_DEFLATED
+                with zf.open(zinfo, 'w', force_zip64=True) as zdest:
+                    async with contextlib.aclosing(_iter_storage(minfo['filepath'])) as chunks:
+                        async for chunk in chunks:
+                            zdest.write(chunk)
+                            if sink.pending >= chunk_size:
+                                if disconnected.is_set(): return
+                                await send({'type': 'http.response.body', 'body': sink.drain(), 'more_body': True})
+                manifest['files'].append({"zip_path": final_arc, "original_filename": orig_fname, "item_type": minfo.get('item_type', 'media'),
+                                          "mimetype": mimetype, "description": minfo.get('description', ''), "is_hidden": False})
+            zf.writestr('lightbox_manifest.json', json.dumps(manifest, indent=2))
+        await send({'type': 'http.response.body', 'body': sink.drain()})
+    except Exception as e:
+        # Headers are already out; raising makes the server reset the connection rather than end a truncated ZIP cleanly.
+        app.logger.error(f"ASGI: Error export batch {batch_id}: {e}", exc_info=True)
+        raise
+    finally:
+        watcher.cancel()
+
+UUID_SEGMENT = r'[0-9a-fA-F-]{32,36}'
+NATIVE_ROUTES = [  # (path pattern, handler); GET only, everything else goes to Flask.
+    (re.compile(rf'^{API_PREFIX}/media/(?P<media_id>{UUID_SEGMENT})/(?P<action>display|download)$'), serve_owned_media),
+    (re.compile(rf'^{API_PREFIX}/public/media/(?P<share_token>[^/]+)/(?P<media_id>{UUID_SEGMENT})/(?P<action>display|download)$'), serve_public_media),
+    (re.compile(rf'^{API_PREFIX}/batches/(?P<batch_id>{UUID_SEGMENT})/events$'), stream_batch_events),
+    (re.compile(rf'^{API_PREFIX}/batches/(?P<batch_id>{UUID_SEGMENT})/export$'), stream_batch_export),
+]
+
+FILE_HANDLERS = (serve_owned_media, serve_public_media, stream_batch_export)
+
+def match_native_route(method, path):
+    if method != 'GET': return None, None
+    for pattern, handler in NATIVE_ROUTES:
+        match = pattern.match(path)
+        if not match: continue
+        params = match.groupdict()
+        try:  # Normalize like Flask's <uuid:...> converter; malformed IDs fall through to Flask's 404.
+            for name in ('media_id', 'batch_id'):
+                if name in params: params[name] = str(uuid.UUID(params[name]))
+        except ValueError:
+            return None, None
+        return handler, params
+    return None, None
+
+# --- WSGI Bridge ---
+class _ReceiveStream:
+    # wsgi.input fed from ASGI receive() by the worker thread, so request bodies (uploads) are never buffered whole.
+    def __init__(self, receive, loop):
+        self.receive = receive; self.loop = loop; self.buffer = bytearray(); self.more = True
+
+    def _fill(self):
+        message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+        if message['type'] == 'http.disconnect':
+            self.more = False; raise ClientDisconnected()
+        self.buffer += message.get('body', b''); self.more = message.get('more_body', False)
+
+    def _take(self, size):
+        data = bytes(self.buffer[:size]); del self.buffer[:size]
+        return data
+
+    def read(self, size=-1):
+        while self.more and (size is None or size < 0 or len(self.buffer) < size): self._fill()
+        return self._take(len(self.buffer) if size is None or size < 0 else size)
+
+    def readline(self, size=-1):
+        while self.more and b'\n' not in self.buffer and (size is None or size < 0 or len(self.buffer) < size): self._fill()
+        newline = self.buffer.find(b'\n')
+        end = newline + 1 if newline >= 0 else len(self.buffer)
+        return self._take(end if size is None or size < 0 else min(end, size))
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line: return
+            yield line
+
+def _wsgi_environ(scope, stream):
+    server = scope.get('server') or ('localhost', 80); client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0], 'SERVER_PORT': str(server[1]), 'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0], 'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': scope.get('scheme', 'http'), 'wsgi.input': stream, 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': True, 'wsgi.run_once': False,
+        'wsgi.input_terminated': True,  # The stream ends at the body's end, so chunked uploads work without Content-Length.
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1'); value = value.decode('latin-1')
+        if name == 'content-type': environ['CONTENT_TYPE'] = value
+        elif name == 'content-length': environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+async def call_flask(scope, receive, send):
+    loop = asyncio.get_running_loop()
+    environ = _wsgi_environ(scope, _ReceiveStream(receive, loop))
+
+    def send_from_thread(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def run():
+        response_start = {}
+        def start_response(status, headers, exc_info=None):
+            response_start['message'] = {'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                                         'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]}
+            return lambda data: None  # Legacy write() callable; Flask never uses it.
+        result = app.wsgi_app(environ, start_response)
+        try:
+            started = False
+            for chunk in result:
+                if not chunk: continue
+                if not started: send_from_thread(response_start['message']); started = True
+                send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not started: send_from_thread(response_start['message'])
+            send_from_thread({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'): result.close()
+
+    await loop.run_in_executor(wsgi_executor, run)
+
+# --- ASGI Entry Point ---
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                app.logger.info(f"ASGI: Serving {len(NATIVE_ROUTES)} route patterns natively; Flask on {app.config['ASGI_WSGI_THREADS']} threads.")
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if _async_redis['client'] is not None and _async_redis['pid'] == os.getpid():
+                    await _async_redis['client'].aclose()
+                wsgi_executor.shutdown(wait=False); file_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'}); return
+    if scope['type'] != 'http':
+        return  # No websocket routes.
+    handler, params = match_native_route(scope['method'], scope['path'])
+    if handler is None:
+        await call_flask(scope, receive, send); return
+    # Delegated requests are metered by Flask's MetricsMiddleware; native ones here (without per-request Redis counts).
+    started = time.perf_counter(); response_meta = {'status': 500, 'bytes': 0}
+    async def metered_send(message):
+        if message['type'] == 'http.response.start': response_meta['status'] = message['status']
+        else: response_meta['bytes'] += len(message.get('body', b''))
+        await send(message)
+    try:
+        await handler(scope, receive, metered_send, **params)
+    except redis.exceptions.ConnectionError as e:
+        app.logger.error(f"ASGI 503 {scope['path']}: Redis unavailable: {e}")
+        await _send_json(scope, metered_send, 503, error="Service Unavailable", message="DB unavailable.")
+    finally:
+        record_request_metrics(f"asgi.{handler.__name__}", scope['method'], str(response_meta['status']), time.perf_counter() - started,
+                               response_meta['bytes'], handler in FILE_HANDLERS, None)
+        asyncio.get_running_loop().run_in_executor(file_executor, metrics.flush, redis_client)
@@ -0,0 +1,309 @@
+# /home/www/froogle/backend/benchmarks/api_load.py
+# Read-path load benchmark: seeds a bench user with one shared Lightbox per size (synthetic media hashes that all point
+# at one small stored file), drives the list, details, public view, slideshow and display routes with concurrent
+# clients, and writes p50/p99 latency, throughput and Redis ops per request to a JSON file for comparing commits.
+#
+# In-process (Flask test client; no server needed). Use a scratch Redis DB, or --redis memory for fakeredis:
+#   python benchmarks/api_load.py --redis-url redis://localhost:6379/15 --sizes 10,1000,10000
+#   python benchmarks/api_load.py --redis memory --sizes 10,1000
+# Against a running server; --redis-url must be the server's app data DB and rate limiting should be off
+# (RATE_LIMIT_ENABLED=false), or the public routes measure 429s:
+#   python benchmarks/api_load.py --base-url http://127.0.0.1:5005 --redis-url redis://localhost:6379/0 --concurrency 16
+# Compare two runs (exits 1 if a p99 or Redis ops/request grew by more than --threshold):
+#   python benchmarks/api_load.py --compare results/api_load-abc123.json results/api_load-def456.json
+#
+# Redis ops per request come from /metrics in-process (exact, per endpoint) and from the Redis server's
+# total_commands_processed otherwise (includes anything else using that Redis, e.g. Celery workers), falling back to
+# /metrics (--metrics-token) when the server has no INFO.
+
+import argparse
+import datetime
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+API = '/api/v1'
+SEED_CHUNK = 2000
+SAMPLE_IDS = 1000  # Media IDs per batch kept in memory to pick display targets from.
+MIX = [('image/jpeg', '.jpg', 0.8), ('video/mp4', '.mp4', 0.15), ('audio/mpeg', '.mp3', 0.05)]
+
+# --- Seeding ---
+def synthetic_media(mid, batch_id, username, asset_key, index):
+    roll = random.random(); acc = 0.0
+    for mimetype, ext, share in MIX:
+        acc += share
+        if roll <= acc: break
+    mdata = {'original_filename': f"IMG_{index:06d}{ext}", 'filename_on_disk': asset_key.rsplit('/', 1)[-1], 'filepath': asset_key,
+             'mimetype': mimetype, 'is_hidden': '1' if index % 50 == 49 else '0', 'is_liked': '1' if index % 7 == 0 else '0',
+             'uploader_user_id': username, 'batch_id': batch_id, 'upload_timestamp': time.time() - index, 'description': f"Synthetic item {index}",
+             'item_type': 'media', 'processing_status': 'completed', 'file_size': 65536, 'stored_bytes': 65536}
+    if mimetype == 'image/jpeg':
+        mdata.update(derivatives_status='completed', derivative_thumb_webp=f"{asset_key}.thumb.webp", derivative_preview_webp=f"{asset_key}.preview.webp")
+    elif mimetype == 'video/mp4':
+        mdata.update(video_previews_status='completed', video_poster_key=f"{asset_key}.poster.jpg", hls_status='completed')
+    return mdata
+
+def seed(r, username, sizes, asset_key):
+    batches = []
+    for size in sizes:
+        batch_id = str(uuid.uuid4()); token = uuid.uuid4().hex; now = time.time(); sample = []
+        r.hset(f'batch:{batch_id}', mapping={'id': batch_id, 'name': f"bench {size}", 'user_id': username, 'creation_timestamp': now,
+                                             'last_modified_timestamp': now, 'is_shared': '1', 'share_token': token})
+        r.set(f'share_token:{token}', batch_id); r.rpush(f'user:{username}:batches', batch_id)
+        started = time.monotonic()
+        for start in range(0, size, SEED_CHUNK):
+            pipe = r.pipeline(transaction=False); ids = [str(uuid.uuid4()) for _ in range(min(SEED_CHUNK, size - start))]
+            for offset, mid in enumerate(ids):
+                pipe.hset(f'media:{mid}', mapping=synthetic_media(mid, batch_id, username, asset_key, start + offset))
+            pipe.rpush(f'batch:{batch_id}:media_ids', *ids); pipe.execute()
+            sample.extend(mid for i, mid in enumerate(ids) if (start + i) % 50 != 49 and len(sample) < SAMPLE_IDS)
+        print(f"seeded {size} items in {time.monotonic() - started:.1f}s", file=sys.stderr)
+        batches.append({'size': size, 'batch_id': batch_id, 'share_token': token, 'media_ids': sample})
+    return batches
+
+def cleanup(r, username, batches):
+    for batch in batches:
+        ids = r.lrange(f"batch:{batch['batch_id']}:media_ids", 0, -1)
+        for start in range(0, len(ids), SEED_CHUNK):
+            r.delete(*[f'media:{mid}' for mid in ids[start:start + SEED_CHUNK]])
+        r.delete(f"batch:{batch['batch_id']}", f"batch:{batch['batch_id']}:media_ids", f"share_token:{batch['share_token']}")
+    r.delete(f'user:{username}', f'user:{username}:batches', f'usage:user:{username}'); r.srem('users', username)
+    r.zrem('users_index', f"{username.lower()}\x00{username}")
+
+# --- Clients ---
+class InProcessClient:
+    # Flask test client per thread; requests go through the full WSGI stack, metrics middleware included.
+    def __init__(self, flask_app):
+        self.app = flask_app; self.local = threading.local()
+
+    def request(self, method, path, headers=None, body=None, content_type=None):
+        client = getattr(self.local, 'client', None) or self.app.test_client(); self.local.client = client
+        response = client.open(path, method=method, headers=headers or {}, data=body, content_type=content_type)
+        try: return response.status_code, response.get_data()
+        finally: response.close()
+
+class HttpClient:
+    # One keep-alive connection per thread.
+    def __init__(self, base_url):
+        self.url = urlsplit(base_url); self.local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.url.scheme == 'https' else http.client.HTTPConnection
+            conn = self.local.conn = cls(self.url.hostname, self.url.port, timeout=120)
+        return conn
+
+    def request(self, method, path, headers=None, body=None, content_type=None):
+        headers = dict(headers or {})
+        if content_type: headers['Content-Type'] = content_type
+        for attempt in (0, 1):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers); response = conn.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close(); self.local.conn = None
+                if attempt: raise
+
+def multipart(fields, file_field, filename, payload):
+    boundary = uuid.uuid4().hex; parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n'.encode() + payload + b'\r\n')
+    return b''.join(parts) + f'--{boundary}--\r\n'.encode(), f'multipart/form-data; boundary={boundary}'
+
+# --- Redis ops probes ---
+def metrics_probe(client, token):
+    # {endpoint: (requests, redis commands)} from the app's own /metrics.
+    status, body = client.request('GET', '/metrics', headers={'Authorization': f'Bearer {token}'} if token else {})
+    if status != 200: return None
+    totals = {}
+    for line in body.decode().splitlines():
+        if line.startswith(('froogle_http_requests_total{', 'froogle_redis_commands_total{')):
+            name, value = line.rsplit(' ', 1); endpoint = name.split('endpoint="', 1)[1].split('"', 1)[0]
+            requests_seen, commands = totals.get(endpoint, (0, 0))
+            if name.startswith('froogle_http_requests_total'): requests_seen += float(value)
+            else: commands += float(value)
+            totals[endpoint] = (requests_seen, commands)
+    return totals
+
+def redis_ops_per_request(before, after, endpoint, requests_made):
+    if before is None or after is None: return None
+    if isinstance(before, int):  # Server-wide command counter; the probe's own INFO is one command.
+        return round((after - before - 1) / requests_made, 2) if requests_made else None
+    req0, cmd0 = before.get(endpoint, (0, 0)); req1, cmd1 = after.get(endpoint, (0, 0))
+    return round((cmd1 - cmd0) / (req1 - req0), 2) if req1 > req0 else None
+
+# --- Runner ---
+def percentile(sorted_values, pct):
+    if not sorted_values: return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))]
+
+def run_scenario(client, path_for, headers, total_requests, concurrency, max_seconds):
+    latencies = []; statuses = {}; body_bytes = [0]; issued = [0]; lock = threading.Lock(); deadline = time.monotonic() + max_seconds
+
+    def worker():
+        while True:
+            with lock:
+                if issued[0] >= total_requests or time.monotonic() > deadline: return
+                issued[0] += 1
+            started = time.perf_counter()
+            try: status, body = client.request('GET', path_for(), headers=headers)
+            except (http.client.HTTPException, OSError): status, body = 'error', b''
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed); statuses[str(status)] = statuses.get(str(status), 0) + 1; body_bytes[0] += len(body)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]: future.result()
+    wall = time.perf_counter() - started; latencies.sort(); ms = lambda v: round(v * 1000, 2) if v is not None else None
+    return {'requests': len(latencies), 'status_codes': statuses, 'wall_s': round(wall, 3),
+            'throughput_rps': round(len(latencies) / wall, 1) if wall else None,
+            'p50_ms': ms(percentile(latencies, 50)), 'p90_ms': ms(percentile(latencies, 90)), 'p99_ms': ms(percentile(latencies, 99)),
+            'max_ms': ms(latencies[-1] if latencies else None), 'mean_response_bytes': int(body_bytes[0] / len(latencies)) if latencies else 0}
+
+def scenarios_for(batch):
+    bid, token, ids = batch['batch_id'], batch['share_token'], batch['media_ids']
+    return [
+        ('batch_details', 'api_get_batch_details', True, lambda: f"{API}/batches/{bid}"),
+        ('public_view', 'api_public_batch_view', False, lambda: f"{API}/public/batches/{token}"),
+        ('public_slideshow', 'api_public_slideshow_view', False, lambda: f"{API}/public/slideshow/{token}"),
+        ('media_display', 'api_display_media_item', True, lambda: f"{API}/media/{random.choice(ids)}/display"),
+        ('public_media_display', 'api_public_display_media_item', False, lambda: f"{API}/public/media/{token}/{random.choice(ids)}/display"),
+    ]
+
+def git_commit():
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError): return None
+
+def setup_in_process(args):
+    if args.redis == 'memory':
+        os.environ.setdefault('UPLOAD_FOLDER', tempfile.mkdtemp(prefix='froogle-bench-'))
+    else:
+        url = urlsplit(args.redis_url)
+        os.environ.update(REDIS_HOST=url.hostname or 'localhost', REDIS_PORT=str(url.port or 6379), APP_REDIS_DB_NUM=(url.path.strip('/') or '0'))
+        if url.password: os.environ['REDIS_PASSWORD'] = url.password
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    sys.path.insert(0, BACKEND_DIR)
+    import api_app
+    api_app.app.config.update(RATE_LIMIT_ENABLED=False, METRICS_ENABLED=True, METRICS_TOKEN='')
+    if args.redis == 'memory':
+        try: import fakeredis
+        except ImportError: sys.exit("--redis memory needs the fakeredis package.")
+        pool = api_app.CountingConnectionPool(connection_class=fakeredis.FakeConnection, server=fakeredis.FakeServer(), decode_responses=True)
+        api_app.redis_client = api_app.InstrumentedRedis(connection_pool=pool)
+    return api_app, InProcessClient(api_app.app), api_app.redis_client
+
+def main(args):
+    if args.base_url:
+        import redis
+        r = redis.Redis.from_url(args.redis_url, decode_responses=True); client = HttpClient(args.base_url); api_app = None
+    else:
+        api_app, client, r = setup_in_process(args)
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    password = uuid.uuid4().hex; batches = []; asset = None; auth = {}
+    from werkzeug.security import generate_password_hash
+    try:
+        # One real stored file backs every synthetic item, so display routes exercise storage, not 404s.
+        payload = os.urandom(args.asset_bytes)
+        r.sadd('users', args.user); r.zadd('users_index', {f"{args.user.lower()}\x00{args.user}": 0}); r.hset(f'user:{args.user}', mapping={'password_hash': generate_password_hash(password), 'is_admin': '0'})
+        status, body = client.request('POST', f"{API}/auth/login", body=json.dumps({'username': args.user, 'password': password}), content_type='application/json')
+        if status != 200: sys.exit(f"Login as {args.user} failed ({status}): {body[:200]!r}")
+        auth = {'Authorization': f"Bearer {json.loads(body)['token']}"}
+        if api_app is not None:
+            asset = {'key': f"{args.user}/bench-asset-{uuid.uuid4().hex}.gz"}
+            with tempfile.NamedTemporaryFile(delete=False) as tmp: tmp.write(payload)
+            api_app.storage.put_file(asset['key'], tmp.name, move=True)
+        else:
+            form, content_type = multipart({'batch_name': 'bench asset', 'upload_type': 'blob_storage'}, 'files[]', 'bench-asset.gz', payload)  # An allowed extension with no follow-up tasks.
+            status, body = client.request('POST', f"{API}/upload", headers=auth, body=form, content_type=content_type)
+            if status not in (200, 201): sys.exit(f"Asset upload failed ({status}): {body[:200]!r}")
+            asset_batch_id = json.loads(body)['batch_id']
+            asset = {'batch_id': asset_batch_id, 'key': r.hget(f"media:{r.lindex(f'batch:{asset_batch_id}:media_ids', 0)}", 'filepath')}
+        batches = seed(r, args.user, sizes, asset['key'])
+
+        probe = lambda: metrics_probe(client, args.metrics_token); ops_source = 'metrics'
+        if api_app is None:
+            import redis
+            try: r.info('stats'); probe = lambda: int(r.info('stats')['total_commands_processed']); ops_source = 'redis_info'
+            except redis.exceptions.ResponseError: print("Redis has no INFO; counting ops from /metrics.", file=sys.stderr)
+        results = []
+        plan = [(None, [('list_batches', 'api_list_batches', True, lambda: f"{API}/batches")])] + [(b, scenarios_for(b)) for b in batches]
+        for batch, scenarios in plan:
+            for name, endpoint, needs_auth, path_for in scenarios:
+                for _ in range(args.warmup): client.request('GET', path_for(), headers=auth if needs_auth else {})
+                before = probe()
+                result = run_scenario(client, path_for, auth if needs_auth else {}, args.requests, args.concurrency, args.max_seconds)
+                after = probe()
+                result['redis_ops_per_request'] = redis_ops_per_request(before, after, endpoint, result['requests'])
+                results.append({'scenario': name, 'items': batch['size'] if batch else None, **result})
+                print(f"{name:<22} items={str(batch['size'] if batch else '-'):<7} p50={result['p50_ms']}ms p99={result['p99_ms']}ms "
+                      f"rps={result['throughput_rps']} redis_ops/req={result['redis_ops_per_request']} {result['status_codes']}", file=sys.stderr)
+    finally:
+        if not args.keep:
+            if asset and asset.get('batch_id'): client.request('DELETE', f"{API}/batches/{asset['batch_id']}", headers=auth)  # Server removes the file.
+            elif asset: api_app.storage.delete(asset['key'])
+            cleanup(r, args.user, batches)
+
+    report = {'benchmark': 'api_load', 'commit': git_commit(), 'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+              'mode': 'http' if args.base_url else f"in-process/{args.redis}", 'base_url': args.base_url or None,
+              'concurrency': args.concurrency, 'requests_per_scenario': args.requests, 'max_seconds': args.max_seconds,
+              'sizes': sizes, 'redis_ops_source': ops_source, 'python': sys.version.split()[0],
+              'results': results}
+    output = args.output or os.path.join(BENCH_DIR, 'results', f"api_load-{report['commit'] or 'nogit'}-{datetime.datetime.now():%Y%m%d%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f: json.dump(report, f, indent=2)
+    print(output)
+
+def compare(old_path, new_path, threshold):
+    with open(old_path) as f: old = json.load(f)
+    with open(new_path) as f: new = json.load(f)
+    old_rows = {(r['scenario'], r['items']): r for r in old['results']}; regressions = 0
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    for row in new['results']:
+        base = old_rows.get((row['scenario'], row['items']))
+        if not base: continue
+        cells = []
+        for field in ('p50_ms', 'p99_ms', 'throughput_rps', 'redis_ops_per_request'):
+            a, b = base.get(field), row.get(field)
+            change = (b - a) / a if a and b is not None else None
+            worse = change is not None and (change < -threshold if field == 'throughput_rps' else change > threshold and field != 'p50_ms')
+            regressions += worse
+            cells.append(f"{field}={a}->{b}" + (f" ({change:+.0%})" if change is not None else '') + (' !' if worse else ''))
+        print(f"{row['scenario']:<22} items={str(row['items']):<7} " + '  '.join(cells))
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Seed synthetic Lightboxes and load-test the API read paths.")
+    parser.add_argument('--base-url', default='', help="Drive a running server; in-process Flask test client if omitted.")
+    parser.add_argument('--redis', choices=['url', 'memory'], default='url', help="In-process only: 'memory' uses fakeredis instead of --redis-url.")
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15', help="Redis to seed; with --base-url, the server's app data DB.")
+    parser.add_argument('--sizes', default='10,1000,10000,100000', help="Comma-separated items per seeded Lightbox.")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per scenario (capped by --max-seconds).")
+    parser.add_argument('--max-seconds', type=float, default=30.0, help="Time cap per scenario.")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent clients.")
+    parser.add_argument('--warmup', type=int, default=2, help="Unmeasured requests before each scenario.")
+    parser.add_argument('--asset-bytes', type=int, default=64 * 1024, help="Size of the file served by the display routes.")
+    parser.add_argument('--metrics-token', default='', help="METRICS_TOKEN of the server, when /metrics is the ops source.")
+    parser.add_argument('--user', default='bench_load', help="Bench user (created, and removed afterwards unless --keep).")
+    parser.add_argument('--keep', action='store_true', help="Leave the seeded data in Redis.")
+    parser.add_argument('--output', default='', help="Result file (default benchmarks/results/api_load-<commit>-<time>.json).")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="Compare two result files instead of running.")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Relative change counted as a regression by --compare.")
+    args = parser.parse_args()
+    if args.compare: sys.exit(compare(*args.compare, args.threshold))
+    main(args)
@@ -0,0 +1,83 @@
+# /home/www/froogle/backend/benchmarks/slow_clients.py
+# Concurrent slow-client capacity of one server process: opens N connections to a streaming URL (media display or
+# download, export, events), reads each one at a throttled rate, and reports how many got their first byte in time.
+#
+# Compare the sync and async serving modes with the same worker count, e.g. one process each:
+#   gunicorn -w 1 --threads 8 -b 127.0.0.1:5005 api_app:app
+#   uvicorn asgi_app:application --workers 1 --port 5006
+#   python benchmarks/slow_clients.py --url http://127.0.0.1:5005/api/v1/media/<id>/download --token <jwt> --clients 200
+#   python benchmarks/slow_clients.py --url http://127.0.0.1:5006/api/v1/media/<id>/download --token <jwt> --clients 200
+# A sync worker serves at most workers x threads slow clients at once and the rest queue (TTFB grows with the hold
+# time); the async mode should start every stream at once. Use a file large enough to outlast --hold at --rate.
+
+import argparse
+import asyncio
+import json
+import ssl
+import statistics
+import time
+from urllib.parse import urlsplit
+
+async def slow_client(args, stats):
+    url = urlsplit(args.url)
+    port = url.port or (443 if url.scheme == 'https' else 80)
+    started = time.monotonic()
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(url.hostname, port, ssl=ssl.create_default_context() if url.scheme == 'https' else None), args.ttfb_timeout)
+    except (OSError, asyncio.TimeoutError):
+        stats['connect_failed'] += 1; return
+    path = url.path + (f"?{url.query}" if url.query else '')
+    headers = [f"GET {path} HTTP/1.1", f"Host: {url.netloc}", "Connection: close", "Accept: */*"]
+    if args.token: headers.append(f"Authorization: Bearer {args.token}")
+    writer.write(("\r\n".join(headers) + "\r\n\r\n").encode())
+    try:
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), args.ttfb_timeout)
+    except (OSError, asyncio.TimeoutError):
+        stats['ttfb_timeout'] += 1; writer.close(); return
+    stats['ttfb'].append(time.monotonic() - started)
+    status = status_line.split(b' ')[1].decode() if status_line.count(b' ') else 'bad'
+    stats['status'][status] = stats['status'].get(status, 0) + 1
+    stats['active'] += 1; stats['peak_active'] = max(stats['peak_active'], stats['active'])
+    # Read at `rate` bytes/s until the hold time is up or the server ends the response.
+    chunk = max(1024, args.rate // 10); hold_until = time.monotonic() + args.hold
+    try:
+        while time.monotonic() < hold_until:
+            data = await reader.read(chunk)
+            if not data: break
+            stats['bytes'] += len(data)
+            await asyncio.sleep(len(data) / args.rate)
+    except OSError:
+        pass
+    finally:
+        stats['active'] -= 1
+        writer.close()
+
+async def main(args):
+    stats = {'ttfb': [], 'status': {}, 'bytes': 0, 'active': 0, 'peak_active': 0, 'connect_failed': 0, 'ttfb_timeout': 0}
+    started = time.monotonic()
+    await asyncio.gather(*(slow_client(args, stats) for _ in range(args.clients)))
+    ttfb = sorted(stats['ttfb'])
+    report = {
+        'url': args.url, 'clients': args.clients, 'rate_bytes_per_s': args.rate, 'hold_s': args.hold,
+        'first_byte_ok': len(ttfb),
+        'first_byte_within_1s': sum(1 for t in ttfb if t <= 1.0),
+        'ttfb_p50_s': round(statistics.median(ttfb), 3) if ttfb else None,
+        'ttfb_p95_s': round(ttfb[int(len(ttfb) * 0.95) - 1], 3) if ttfb else None,
+        'ttfb_max_s': round(ttfb[-1], 3) if ttfb else None,
+        'peak_concurrent_streams': stats['peak_active'],
+        'status_codes': stats['status'], 'connect_failed': stats['connect_failed'], 'ttfb_timeout': stats['ttfb_timeout'],
+        'bytes_read': stats['bytes'], 'wall_s': round(time.monotonic() - started, 2),
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure concurrent slow-client capacity of a streaming endpoint.")
+    parser.add_argument('--url', required=True, help="Full URL of a streaming endpoint.")
+    parser.add_argument('--token', default='', help="JWT for authenticated endpoints.")
+    parser.add_argument('--clients', type=int, default=100, help="Concurrent connections to open.")
+    parser.add_argument('--rate', type=int, default=32 * 1024, help="Per-client read rate in bytes/s.")
+    parser.add_argument('--hold', type=float, default=20.0, help="Seconds each client keeps reading.")
+    parser.add_argument('--ttfb-timeout', type=float, default=60.0, help="Give up on a client with no status line after this many seconds.")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,225 @@
+# /home/www/froogle/backend/benchmarks/transcode.py
+# Transcoding throughput: generates deterministic synthetic fixtures with ffmpeg's lavfi sources, runs them through the
+# same command builders the Celery tasks use (build_video_mp4_command, build_audio_mp3_command, build_hls_command)
+# under one or more config profiles, and reports x realtime, CPU-seconds, peak RSS and output size per run.
+#
+# Profiles override app config keys; the implicit 'configured' profile is the config the workers would load from .env:
+#   python benchmarks/transcode.py --resolutions 1280x720,1920x1080 --durations 10,60 \
+#       --profile fast VIDEO_MP4_VIDEO_PRESET=veryfast VIDEO_MP4_VIDEO_CRF=20 \
+#       --profile mp3-v2 "AUDIO_MP3_OPTIONS=-q:a 2"
+# Compare two result files (exits 1 if x realtime dropped, or CPU-seconds or output size grew, by more than --threshold):
+#   python benchmarks/transcode.py --compare results/transcode-abc123.json results/transcode-def456.json
+#
+# Fixtures are cached in --fixtures-dir by name, so reruns and comparisons across commits encode identical inputs.
+# Run on an otherwise idle machine; ffmpeg uses every core by default, so CPU-seconds / wall is the parallelism achieved.
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+
+# Source codec -> (container extension, encoder args). Sources are encoded near-losslessly so the decode side is realistic.
+VIDEO_SOURCES = {
+    'h264': ('.mkv', ['-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '12', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-b:a', '256k']),
+    'mpeg4': ('.avi', ['-c:v', 'mpeg4', '-q:v', '2', '-c:a', 'libmp3lame', '-b:a', '256k']),
+    'prores': ('.mov', ['-c:v', 'prores_ks', '-profile:v', '1', '-c:a', 'pcm_s16le']),
+}
+AUDIO_SOURCES = {
+    'wav': ('.wav', ['-c:a', 'pcm_s16le']),
+    'flac': ('.flac', ['-c:a', 'flac']),
+    'aac': ('.m4a', ['-c:a', 'aac', '-b:a', '256k']),
+    'opus': ('.opus', ['-c:a', 'libopus', '-b:a', '160k']),
+}
+# Fixed seeds and bit-exact muxing: the same arguments always produce the same fixture.
+BITEXACT = ['-fflags', '+bitexact', '-flags:v', '+bitexact', '-flags:a', '+bitexact', '-map_metadata', '-1']
+
+def audio_graph(duration):
+    tones = f"aevalsrc=0.4*sin(2*PI*440*t)+0.2*sin(2*PI*660*t)|0.4*sin(2*PI*550*t)+0.1*sin(2*PI*1320*t):s=48000:d={duration}"
+    return f"{tones}[t];anoisesrc=seed=42:a=0.05:r=48000:d={duration},pan=stereo|c0=c0|c1=c0[n];[t][n]amix=inputs=2[aout]"
+
+# --- Fixtures ---
+def make_fixture(ffmpeg, fixtures_dir, kind, codec, duration, size=None):
+    ext, encode_args = (VIDEO_SOURCES if kind == 'video' else AUDIO_SOURCES)[codec]
+    name = f"{kind}-{codec}-{size + '-' if size else ''}{duration}s{ext}"; path = os.path.join(fixtures_dir, name)
+    if os.path.exists(path): return path
+    graph = audio_graph(duration)
+    if kind == 'video':
+        # testsrc2 alone compresses to almost nothing; temporal noise gives the encoder real work at every resolution.
+        graph = f"testsrc2=size={size}:rate=30:duration={duration},noise=alls=12:allf=t:all_seed=1234,format=yuv420p[vout];{graph}"
+        maps = ['-map', '[vout]', '-map', '[aout]']
+    else:
+        maps = ['-map', '[aout]']
+    tmp_path = os.path.join(fixtures_dir, f".{name}.tmp{ext}")
+    command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-filter_complex', graph, *maps, *encode_args, *BITEXACT, '-y', tmp_path]
+    print(f"generating {name}", file=sys.stderr)
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(f"Fixture {name} failed (exit {result.returncode}): {result.stderr.strip()[-500:]}")
+    os.replace(tmp_path, path)
+    return path
+
+def available_encoders(ffmpeg):
+    out = subprocess.run([ffmpeg, '-hide_banner', '-encoders'], capture_output=True, text=True, check=True).stdout
+    return {line.split()[1] for line in out.splitlines() if line.startswith(' ') and len(line.split()) > 1}
+
+def ffmpeg_version(ffmpeg):
+    try: return subprocess.run([ffmpeg, '-version'], capture_output=True, text=True, timeout=10).stdout.split('\n', 1)[0]
+    except (OSError, subprocess.SubprocessError): return None
+
+# --- Measurement ---
+def run_measured(command):
+    # Runs one ffmpeg command and returns (wall_s, cpu_s, peak_rss_bytes) for that child alone, via wait4's rusage.
+    with tempfile.TemporaryFile() as stderr_file:
+        started = time.perf_counter()
+        proc = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=stderr_file)
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - started
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode:
+            stderr_file.seek(0)
+            raise subprocess.CalledProcessError(proc.returncode, command, stderr=stderr_file.read().decode(errors='replace'))
+    return wall, usage.ru_utime + usage.ru_stime, usage.ru_maxrss * 1024  # ru_maxrss is KiB on Linux.
+
+def output_bytes(path):
+    if os.path.isfile(path): return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+def measure(api_app, config, job, source, work_dir, repeat):
+    runs = []
+    for _ in range(repeat):
+        out = os.path.join(work_dir, 'out')
+        shutil.rmtree(out, ignore_errors=True)
+        if job == 'mp4': command = api_app.build_video_mp4_command(config, source['path'], out)
+        elif job == 'mp3': command = api_app.build_audio_mp3_command(config, source['path'], out)
+        else:
+            rungs = api_app.hls_ladder_for(config, source['height'])
+            for i in range(len(rungs)): os.makedirs(os.path.join(out, f"v{i}"))
+            command = api_app.build_hls_command(config, source['path'], out, rungs, True)
+        wall, cpu, rss = run_measured(command)
+        runs.append({'wall_s': wall, 'cpu_s': cpu, 'peak_rss_bytes': rss, 'output_bytes': output_bytes(out)})
+    wall = statistics.median(r['wall_s'] for r in runs); cpu = statistics.median(r['cpu_s'] for r in runs)
+    return {'x_realtime': round(source['duration'] / wall, 2), 'wall_s': round(wall, 3), 'cpu_s': round(cpu, 3),
+            'cpu_per_wall': round(cpu / wall, 2), 'peak_rss_mb': round(max(r['peak_rss_bytes'] for r in runs) / 2**20, 1),
+            'output_mb': round(runs[-1]['output_bytes'] / 2**20, 3),
+            'output_kbps': round(runs[-1]['output_bytes'] * 8 / 1000 / source['duration'], 1), 'runs': repeat}
+
+# --- Profiles ---
+def resolve_profile(base_config, overrides):
+    config = dict(base_config); applied = {}
+    for item in overrides:
+        key, sep, value = item.partition('=')
+        if not sep or key not in base_config: sys.exit(f"Bad profile override {item!r}: expected KEY=VALUE for an existing config key.")
+        if key == 'AUDIO_MP3_OPTIONS': config[key] = value.split()
+        elif key == 'HLS_LADDER': config[key] = [tuple(rung.split(':')) for rung in value.split(',') if rung]
+        elif isinstance(base_config[key], int): config[key] = int(value)
+        else: config[key] = value
+        applied[key] = value
+    return config, applied
+
+def profile_summary(config):
+    return {'video': f"{config['VIDEO_MP4_VIDEO_CODEC']} preset={config['VIDEO_MP4_VIDEO_PRESET']} crf={config['VIDEO_MP4_VIDEO_CRF']} "
+                     f"{config['VIDEO_MP4_AUDIO_CODEC']}@{config['VIDEO_MP4_AUDIO_BITRATE']}",
+            'audio': f"{config['AUDIO_MP3_ENCODER']} {' '.join(config['AUDIO_MP3_OPTIONS'])} ar={config['AUDIO_MP3_SAMPLE_RATE']}",
+            'hls': f"preset={config['HLS_VIDEO_PRESET']} ladder={','.join(':'.join(map(str, r)) for r in config['HLS_LADDER'])}"}
+
+def git_commit():
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError): return None
+
+def print_row(row):
+    print(f"{row['profile']:<14} {row['job']:<4} {row['source']:<28} {row.get('x_realtime', '-'):>8} {row.get('cpu_s', '-'):>9} "
+          f"{row.get('cpu_per_wall', '-'):>6} {row.get('peak_rss_mb', '-'):>8} {row.get('output_mb', '-'):>9} {row.get('error', '')}")
+
+def main(args):
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    sys.path.insert(0, BACKEND_DIR)
+    import api_app
+    base_config = dict(api_app.app.config); ffmpeg = base_config['FFMPEG_PATH']
+    if not shutil.which(ffmpeg): sys.exit(f"ffmpeg not found ({ffmpeg}); set FFMPEG_PATH.")
+    encoders = available_encoders(ffmpeg)
+    profiles = [('configured', base_config, {})] + [(name, *resolve_profile(base_config, overrides)) for name, *overrides in args.profile or []]
+    resolutions = [s.strip() for s in args.resolutions.split(',') if s.strip()]
+    durations = [int(d) for d in args.durations.split(',') if d.strip()]
+    fixtures_dir = args.fixtures_dir or os.path.join(tempfile.gettempdir(), 'froogle-transcode-fixtures'); os.makedirs(fixtures_dir, exist_ok=True)
+
+    sources = []
+    for codec in [c for c in args.video_codecs.split(',') if c]:
+        if VIDEO_SOURCES[codec][1][1] not in encoders: print(f"skipping {codec} sources: ffmpeg lacks {VIDEO_SOURCES[codec][1][1]}", file=sys.stderr); continue
+        for size in resolutions:
+            for duration in durations:
+                sources.append({'kind': 'video', 'name': f"{codec}-{size}-{duration}s", 'codec': codec, 'resolution': size, 'height': int(size.split('x')[1]),
+                                'duration': duration, 'path': make_fixture(ffmpeg, fixtures_dir, 'video', codec, duration, size)})
+    for codec in [c for c in args.audio_codecs.split(',') if c]:
+        if AUDIO_SOURCES[codec][1][1] not in encoders: print(f"skipping {codec} sources: ffmpeg lacks {AUDIO_SOURCES[codec][1][1]}", file=sys.stderr); continue
+        for duration in durations:
+            sources.append({'kind': 'audio', 'name': f"{codec}-{duration}s", 'codec': codec, 'resolution': None, 'duration': duration,
+                            'path': make_fixture(ffmpeg, fixtures_dir, 'audio', codec, duration)})
+
+    results = []
+    print(f"{'profile':<14} {'job':<4} {'source':<28} {'x_rt':>8} {'cpu_s':>9} {'cpu/w':>6} {'rss_mb':>8} {'out_mb':>9}")
+    with tempfile.TemporaryDirectory(prefix='froogle-transcode-') as work_dir:
+        for name, config, _ in profiles:
+            for source in sources:
+                jobs = (['mp4'] + (['hls'] if args.hls else [])) if source['kind'] == 'video' else ['mp3']
+                for job in jobs:
+                    row = {'profile': name, 'job': job, 'source': source['name'], 'source_codec': source['codec'],
+                           'resolution': source['resolution'], 'duration_s': source['duration']}
+                    try: row.update(measure(api_app, config, job, source, work_dir, args.repeat))
+                    except subprocess.CalledProcessError as e: row['error'] = f"exit {e.returncode}: {(e.stderr or '').strip()[-300:]}"
+                    results.append(row); print_row(row)
+
+    report = {'benchmark': 'transcode', 'commit': git_commit(), 'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+              'ffmpeg': ffmpeg_version(ffmpeg), 'cpu_count': os.cpu_count(), 'repeat': args.repeat, 'python': sys.version.split()[0],
+              'profiles': {name: {'overrides': applied, **profile_summary(config)} for name, config, applied in profiles},
+              'results': results}
+    output = args.output or os.path.join(BENCH_DIR, 'results', f"transcode-{report['commit'] or 'nogit'}-{datetime.datetime.now():%Y%m%d%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f: json.dump(report, f, indent=2)
+    print(output)
+
+def compare(old_path, new_path, threshold):
+    with open(old_path) as f: old = json.load(f)
+    with open(new_path) as f: new = json.load(f)
+    old_rows = {(r['profile'], r['job'], r['source']): r for r in old['results']}; regressions = 0
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    for row in new['results']:
+        base = old_rows.get((row['profile'], row['job'], row['source']))
+        if not base: continue
+        cells = []
+        for field in ('x_realtime', 'cpu_s', 'peak_rss_mb', 'output_mb'):
+            a, b = base.get(field), row.get(field)
+            change = (b - a) / a if a and b is not None else None
+            worse = change is not None and (change < -threshold if field == 'x_realtime' else change > threshold and field != 'peak_rss_mb')
+            regressions += worse
+            cells.append(f"{field}={a}->{b}" + (f" ({change:+.0%})" if change is not None else '') + (' !' if worse else ''))
+        print(f"{row['profile']:<14} {row['job']:<4} {row['source']:<28} " + '  '.join(cells))
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the worker ffmpeg commands on synthetic fixtures under config profiles.")
+    parser.add_argument('--profile', nargs='+', action='append', metavar=('NAME', 'KEY=VALUE'),
+                        help="Named config profile with app config overrides; repeatable. 'configured' (no overrides) always runs.")
+    parser.add_argument('--resolutions', default='640x360,1280x720,1920x1080', help="Comma-separated WxH video fixture sizes.")
+    parser.add_argument('--durations', default='10,60', help="Comma-separated fixture durations in seconds.")
+    parser.add_argument('--video-codecs', default='h264,mpeg4,prores', help=f"Video fixture source codecs ({', '.join(VIDEO_SOURCES)}).")
+    parser.add_argument('--audio-codecs', default='wav,flac,aac,opus', help=f"Audio fixture source codecs ({', '.join(AUDIO_SOURCES)}).")
+    parser.add_argument('--hls', action='store_true', help="Also package each video fixture with the HLS ladder.")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per measurement; wall and CPU are medians, RSS the max.")
+    parser.add_argument('--fixtures-dir', default='', help="Fixture cache directory (default <tmp>/froogle-transcode-fixtures).")
+    parser.add_argument('--output', default='', help="Result file (default benchmarks/results/transcode-<commit>-<time>.json).")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="Compare two result files instead of running.")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Relative change counted as a regression by --compare.")
+    args = parser.parse_args()
+    if args.compare: sys.exit(compare(*args.compare, args.threshold))
+    unknown = [c for c in args.video_codecs.split(',') if c and c not in VIDEO_SOURCES] + [c for c in args.audio_codecs.split(',') if c and c not in AUDIO_SOURCES]
+    if unknown: parser.error(f"unknown fixture codec(s): {', '.join(unknown)}")
+    main(args)
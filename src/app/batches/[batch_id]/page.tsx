@@ -12,6 +12,7 @@ import {
   toggleMediaLiked, 
   deleteMedia,
   uploadFiles, 
+  subscribeBatchEvents,
   ApiResponse, // Kept ApiResponse for now, will remove if still unused after this
   Batch, 
 } from '../../../services/api'; 
@@ -37,6 +38,7 @@ export default function BatchDetailsPage() {
   const [uploadSuccessMessage, setUploadSuccessMessage] = useState<string | null>(null);
   const [uploadType, setUploadType] = useState<'media' | 'import_zip' | 'blob_storage'>('media');
   const [fileDescription, setFileDescription] = useState('');
+  const [eventsCursor, setEventsCursor] = useState<string | undefined>(undefined);
 
 
   // --- Fetch Batch Details ---
@@ -47,6 +49,7 @@ export default function BatchDetailsPage() {
     if (response.success && response.batch) { 
       setBatch(response.batch); 
       setNewBatchName(response.batch.name); 
+      setEventsCursor(response.batch.events_cursor);
     } else {
       setError(response.message || 'Failed to load Lightbox details.');
       setBatch(null);
@@ -65,6 +68,31 @@ export default function BatchDetailsPage() {
   }, [batchId, fetchDetails]);
 
 
+  // --- Live item updates (processing status, progress, new previews) ---
+  useEffect(() => {
+    if (!batchId || !eventsCursor) return;
+    return subscribeBatchEvents(batchId, eventsCursor, (event) => {
+      if (event.kind === 'resync') {
+        fetchDetails(); // Missed events were trimmed; a fresh read also restarts the subscription.
+        return;
+      }
+      setBatch(prevBatch => {
+        if (!prevBatch) return null;
+        const items = prevBatch.media_items || [];
+        if (event.kind === 'deleted') {
+          return { ...prevBatch, media_items: items.filter(item => item.id !== event.media_id) };
+        }
+        if (event.kind === 'progress') {
+          return { ...prevBatch, media_items: items.map(item => item.id === event.media_id ? { ...item, progress: Number(event.progress) } : item) };
+        }
+        if (!event.item) return prevBatch;
+        const known = items.some(item => item.id === event.item!.id);
+        return { ...prevBatch, media_items: known ? items.map(item => item.id === event.item!.id ? event.item! : item) : [...items, event.item] };
+      });
+    });
+  }, [batchId, eventsCursor, fetchDetails]);
+
+
   // --- Handlers for Batch Actions ---
 
   const handleDeleteBatch = async () => {
@@ -454,7 +482,7 @@ export default function BatchDetailsPage() {
               <div>
                 <h3 className="font-semibold text-gray-800 text-lg mb-1 break-words">{media.original_filename}</h3>
                 <p className="text-sm text-gray-600">Type: {media.mimetype}</p>
-                <p className="text-sm text-gray-600">Status: {media.processing_status.replace(/_/g, ' ')}</p>
+                <p className="text-sm text-gray-600">Status: {media.processing_status.replace(/_/g, ' ')}{media.processing_status === 'processing' && media.progress != null ? ` (${media.progress}%)` : ''}</p>
                 {media.error_message && <p className="text-xs text-red-500 mt-1">Error: {media.error_message}</p>}
                 <p className="text-xs text-gray-500 mt-1">Uploaded: {new Date(media.upload_timestamp * 1000).toLocaleString()}</p>
                 {media.description && <p className="text-sm text-gray-700 mt-2 italic">{media.description}</p>}
@@ -465,10 +493,10 @@ export default function BatchDetailsPage() {
                 {media.processing_status === 'completed' && media.web_url ? (
                   <>
                     {media.mimetype?.startsWith('image/') && ( // Added nullish coalescing for mimetype check
-                      <img src={media.web_url} alt={media.original_filename} className="max-w-full max-h-full object-contain" />
+                      <img src={media.thumb_url || media.web_url} alt={media.original_filename} loading="lazy" className="max-w-full max-h-full object-contain" />
                     )}
                     {media.mimetype?.startsWith('video/') && ( // Added nullish coalescing
-                      <video controls src={media.web_url} className="max-w-full max-h-full object-contain"></video>
+                      <video controls preload={media.poster_url ? 'none' : 'metadata'} poster={media.poster_url || undefined} src={media.web_url} className="max-w-full max-h-full object-contain"></video>
                     )}
                     {media.mimetype?.startsWith('audio/') && ( // Added nullish coalescing
                       <audio controls src={media.web_url} className="w-full"></audio>
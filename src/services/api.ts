@@ -17,6 +17,8 @@ export interface ApiResponse<T = unknown> { // Changed 'any' to 'unknown'
   public_slideshow_url?: string;
   media_items?: MediaItem[];
   media_data?: MediaItem[]; // For public slideshow response
+  not_found?: string[]; // Bulk endpoints: IDs that do not exist or are not accessible
+  usage?: StorageUsage; // Batch list: the caller's storage usage and quota
   data?: T; // Generic data field for API responses
 }
 
@@ -39,6 +41,14 @@ export interface Batch {
   public_share_url?: string;
   public_slideshow_url?: string;
   media_items?: MediaItem[]; // Optional, for details view
+  events_cursor?: string; // Position in the batch's event stream as of this read; see subscribeBatchEvents
+  stored_bytes?: number; // Bytes this Lightbox's items occupy, renditions included
+}
+
+export interface StorageUsage {
+  bytes: number;
+  items: number;
+  quota_bytes: number; // 0 = unlimited
 }
 
 export interface MediaItem {
@@ -50,10 +60,19 @@ export interface MediaItem {
   upload_timestamp: number;
   processing_status: 'queued' | 'processing' | 'completed' | 'failed' | 'queued_import' | 'failed_import';
   error_message?: string;
+  progress?: number | null; // Percent complete while a video/audio conversion is running
   web_url?: string; // URL for web-optimized display (e.g., resized image, converted video)
   download_url?: string; // URL to download the original file (or web_url if no original)
   public_display_url?: string; // For slideshows, if different from web_url for public access
   public_download_url?: string; // For slideshows, if different for public download
+  thumb_url?: string | null; // Small WebP/AVIF rendition for grids (images and PDFs), once generated
+  preview_url?: string | null; // Medium rendition for lightbox/slideshow viewing
+  public_thumb_url?: string | null;
+  public_preview_url?: string | null;
+  poster_url?: string | null; // Video poster frame
+  sprite_vtt_url?: string | null; // WebVTT index into the video's scrub sprite sheet
+  public_poster_url?: string | null;
+  public_sprite_vtt_url?: string | null;
   is_hidden: boolean;
   is_liked: boolean;
   description?: string; // Optional user-provided description
@@ -62,6 +81,17 @@ export interface MediaItem {
 
 export type UploadType = 'media' | 'import_zip' | 'blob_storage';
 
+export type BatchEventKind = 'status' | 'progress' | 'preview' | 'updated' | 'deleted' | 'resync';
+
+export interface BatchEvent {
+  kind: BatchEventKind;
+  media_id?: string;
+  status?: string;
+  progress?: string;
+  asset?: string;
+  item?: MediaItem; // Current item JSON, sent with 'status', 'preview' and 'updated' events
+}
+
 // Removed eslint-disable-next-line @typescript-eslint/no-explicit-any
 export async function callApi<T>(endpoint: string, method: string = 'GET', data?: unknown): Promise<ApiResponse<T>> { // Changed 'data?: any' to 'data?: unknown'
   const headers: HeadersInit = {
@@ -154,6 +184,21 @@ export async function deleteMedia(mediaId: string): Promise<ApiResponse> {
   return callApi(`/api/v1/media/${mediaId}`, 'DELETE');
 }
 
+// Current status/progress/URLs for just these items (up to 500), for polling fresh uploads.
+export async function getMediaBulkStatus(mediaIds: string[]): Promise<ApiResponse> {
+  return callApi(`/api/v1/media/bulk_status`, 'POST', { media_ids: mediaIds });
+}
+
+export type BulkMediaAction =
+  | { action: 'set_hidden' | 'set_liked'; value: boolean }
+  | { action: 'delete' }
+  | { action: 'move'; target_batch_id: string };
+
+// Applies one action to many items (up to 500). Response lists applied, skipped and not_found IDs.
+export async function bulkMediaAction(mediaIds: string[], operation: BulkMediaAction): Promise<ApiResponse & { applied?: string[]; skipped?: string[] }> {
+  return callApi(`/api/v1/media/bulk`, 'POST', { ...operation, media_ids: mediaIds });
+}
+
 
 // Removed eslint-disable-next-line @typescript-eslint/no-explicit-any
 export async function uploadFiles(files: File[], uploadType: UploadType, existingBatchId?: string, newBatchName?: string, description?: string): Promise<ApiResponse<unknown>> { // Changed 'ApiResponse<any>' to 'ApiResponse<unknown>'
@@ -203,3 +248,62 @@ export async function uploadFiles(files: File[], uploadType: UploadType, existin
 export async function getPublicSlideshow(shareToken: string): Promise<ApiResponse<{ batch: Batch; media_data: MediaItem[]; }>> { // Changed 'ApiResponse<any>' to 'ApiResponse<unknown>'
   return callApi(`/api/v1/public_slideshow/${shareToken}`, 'GET');
 }
+
+
+// Streams /batches/<id>/events. EventSource cannot send the Authorization header, so this reads the
+// SSE response via fetch and reconnects with Last-Event-ID. Returns a function that stops the subscription.
+export function subscribeBatchEvents(batchId: string, cursor: string | undefined, onEvent: (event: BatchEvent) => void): () => void {
+  const controller = new AbortController();
+  let lastEventId = cursor;
+  let retryMs = 3000;
+
+  const connect = async () => {
+    const token = localStorage.getItem('token');
+    const headers: HeadersInit = { Accept: 'text/event-stream' };
+    if (token) {
+      headers['Authorization'] = `Bearer ${token}`;
+    }
+    if (lastEventId) {
+      headers['Last-Event-ID'] = lastEventId;
+    }
+    try {
+      const response = await fetch(`${API_BASE_URL_ROOT}/api/v1/batches/${batchId}/events`, { headers, signal: controller.signal });
+      if (!response.ok || !response.body) {
+        if (response.status === 401 || response.status === 403 || response.status === 404) return; // Not retryable
+        throw new Error(`Event stream failed with status ${response.status}`);
+      }
+      const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+      let buffer = '';
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += value;
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+          const block = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          let eventName = 'message';
+          let data = '';
+          for (const line of block.split('\n')) {
+            if (line.startsWith('id: ')) lastEventId = line.slice(4);
+            else if (line.startsWith('event: ')) eventName = line.slice(7);
+            else if (line.startsWith('data: ')) data += line.slice(6);
+            else if (line.startsWith('retry: ')) retryMs = Number(line.slice(7)) || retryMs;
+          }
+          if (data) {
+            onEvent({ ...JSON.parse(data), kind: eventName as BatchEventKind });
+          }
+        }
+      }
+    } catch (error) {
+      if (controller.signal.aborted) return;
+      console.error('Batch event stream error:', error);
+    }
+    if (!controller.signal.aborted) {
+      setTimeout(connect, retryMs); // The server ends streams periodically; pick up where we left off.
+    }
+  };
+
+  connect();
+  return () => controller.abort();
+}